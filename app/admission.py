@@ -0,0 +1,136 @@
+import math
+import threading
+import time
+from functools import lru_cache
+
+from app.cache import RedisCache, get_redis_cache
+from app.config import get_settings
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+
+logger = get_logger()
+
+
+class AdmissionController:
+    """
+    Queue derinliği ve son task süreleri ile yeni session kabul kararı.
+
+    Lane başına tahmini bekleme = kuyruktaki iş / worker slotu * task
+    süresinin p95'i (`task_runtime:{lane}`). Tahmin lane'in SLO'sunu aşarsa
+    yeni iş reddedilir ve kuyruğun SLO altına inmesi için gereken süre
+    Retry-After olarak döner. Yeterli örnek yoksa ya da Redis yoksa kabul.
+    """
+
+    def __init__(
+        self,
+        redis_cache: RedisCache,
+        metrics: MetricsRecorder,
+        lane_queues: dict[str, list[str]],
+        lane_concurrency: dict[str, int],
+        slo_seconds: dict[str, float],
+        enabled: bool = True,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        refresh_seconds: float = 2.0,
+    ):
+        self._redis_cache = redis_cache
+        self._metrics = metrics
+        self._lane_queues = lane_queues
+        self._lane_concurrency = lane_concurrency
+        self._slo_seconds = slo_seconds
+        self._enabled = enabled
+        self._quantile = quantile
+        self._min_samples = min_samples
+        self._refresh_seconds = refresh_seconds
+        # Her istekte LLEN + percentile okunmaz, kısa süre process'te tutulur
+        self._projections: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, lanes: tuple[str, ...]) -> int | None:
+        """İş kabul edilirse None, edilmezse kaç saniye sonra denenmeli."""
+        if not self._enabled:
+            return None
+
+        overshoot = 0.0
+        for lane in lanes:
+            slo = self._slo_seconds.get(lane)
+            if slo is None:
+                continue
+            wait = self.projected_wait(lane)
+            if wait > slo:
+                self._metrics.incr(f"admission:{lane}:rejected")
+                logger.warning(f"Admission rejected: {lane} wait {wait:.1f}s > SLO {slo:.0f}s")
+                overshoot = max(overshoot, wait - slo)
+
+        return math.ceil(max(overshoot, 1.0)) if overshoot else None
+
+    def projected_wait(self, lane: str) -> float:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._projections.get(lane)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        wait = self._project(lane)
+        with self._lock:
+            self._projections[lane] = (now + self._refresh_seconds, wait)
+        return wait
+
+    def queue_depth(self, lane: str) -> int | None:
+        client = self._redis_cache.client
+        queues = self._lane_queues.get(lane)
+        if client is None or not queues:
+            return None
+
+        try:
+            pipe = client.pipeline()
+            for queue in queues:
+                pipe.llen(queue)
+            return sum(pipe.execute())
+        except Exception as depth_error:
+            logger.warning(f"Queue depth unavailable: {depth_error}")
+            return None
+
+    def _project(self, lane: str) -> float:
+        depth = self.queue_depth(lane)
+        if not depth:
+            return 0.0
+
+        runtime = self._metrics.percentile(
+            f"task_runtime:{lane}", self._quantile, self._min_samples
+        )
+        if runtime is None:
+            return 0.0
+        return depth * runtime / max(self._lane_concurrency.get(lane, 1), 1)
+
+
+@lru_cache(maxsize=1)
+def get_admission_controller() -> AdmissionController:
+    settings = get_settings()
+
+    if settings.worker_mode == "async":
+        lane_queues = {
+            "fast": [settings.async_worker_fast_queue],
+            "bulk": [settings.async_worker_queue],
+        }
+        max_sessions = settings.async_worker_max_sessions
+        lane_concurrency = {
+            "fast": max_sessions,
+            "bulk": max_sessions - settings.async_worker_fast_reserved_sessions,
+        }
+    else:
+        lane_queues = {}
+        for queue, lane in settings.celery_queue_lanes.items():
+            lane_queues.setdefault(lane, []).append(queue)
+        lane_concurrency = settings.admission_lane_concurrency
+
+    return AdmissionController(
+        redis_cache=get_redis_cache(),
+        metrics=get_metrics(),
+        lane_queues=lane_queues,
+        lane_concurrency=lane_concurrency,
+        slo_seconds=settings.admission_slo_seconds,
+        enabled=settings.admission_control_enabled,
+        quantile=settings.admission_quantile,
+        min_samples=settings.admission_min_samples,
+    )
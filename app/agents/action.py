@@ -1,9 +1,9 @@
 import json
 
-from app.agents.base import BaseAgent
+from app.agents.base import BaseAgent, FieldsCallback
 from app.llm import get_action_llm
 from app.models.domain import ActionItem, ActionPlan, StructuredProblemTree
-from app.utils import clean_llm_json_response
+from app.utils import clean_llm_json_response, parse_llm_json
 
 
 class ActionPlanAgent(BaseAgent):
@@ -11,35 +11,53 @@ class ActionPlanAgent(BaseAgent):
         super().__init__(llm=get_action_llm())
 
     def create_plan(
-        self, problem_tree: StructuredProblemTree, chat_summary: str, response_language: str = "Turkish"
+        self,
+        problem_tree: StructuredProblemTree,
+        chat_summary: str,
+        response_language: str = "Turkish",
+        on_fields: FieldsCallback | None = None,
     ) -> ActionPlan:
+        """`on_fields` verilirse plan stream edilir, biten alanlar (örn. risks) hemen iletilir."""
+        variables = self._plan_variables(problem_tree, chat_summary, response_language)
+        if self.structured_output and on_fields is not None:
+            return self.stream_structured("action_plan", variables, ActionPlan, on_fields)
+        if self.structured_output:
+            return self.invoke_structured("action_plan", variables, ActionPlan)
+
         planning_response = self.invoke_llm(
-            prompt_name="action_plan",
-            prompt_variables={
-                "problem_type": problem_tree.problem_type.value,
-                "main_problem": problem_tree.main_problem,
-                "problem_tree_formatted": self._format_tree(problem_tree),
-                "chat_summary": chat_summary,
-                "response_language": response_language,
-            },
+            prompt_name="action_plan", prompt_variables=variables, validate=parse_llm_json
         )
         return self._parse_plan(planning_response)
 
     async def create_plan_async(
-        self, problem_tree: StructuredProblemTree, chat_summary: str, response_language: str = "Turkish"
+        self,
+        problem_tree: StructuredProblemTree,
+        chat_summary: str,
+        response_language: str = "Turkish",
+        on_fields: FieldsCallback | None = None,
     ) -> ActionPlan:
+        variables = self._plan_variables(problem_tree, chat_summary, response_language)
+        if self.structured_output and on_fields is not None:
+            return await self.astream_structured("action_plan", variables, ActionPlan, on_fields)
+        if self.structured_output:
+            return await self.invoke_structured_async("action_plan", variables, ActionPlan)
+
         planning_response = await self.invoke_llm_async(
-            prompt_name="action_plan",
-            prompt_variables={
-                "problem_type": problem_tree.problem_type.value,
-                "main_problem": problem_tree.main_problem,
-                "problem_tree_formatted": self._format_tree(problem_tree),
-                "chat_summary": chat_summary,
-                "response_language": response_language,
-            },
+            prompt_name="action_plan", prompt_variables=variables, validate=parse_llm_json
         )
         return self._parse_plan(planning_response)
 
+    def _plan_variables(
+        self, problem_tree: StructuredProblemTree, chat_summary: str, response_language: str
+    ) -> dict:
+        return {
+            "problem_type": problem_tree.problem_type.value,
+            "main_problem": problem_tree.main_problem,
+            "problem_tree_formatted": self._format_tree(problem_tree),
+            "chat_summary": chat_summary,
+            "response_language": response_language,
+        }
+
     def _format_tree(self, problem_tree: StructuredProblemTree) -> str:
         lines = []
         for node in problem_tree.problem_tree:
@@ -1,15 +1,45 @@
+import asyncio
+import time
 from abc import ABC
-from typing import Any
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
 
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel, ValidationError
 
+from app.config import get_settings
+from app.hedging import get_hedge_policy
+from app.llm import get_llm_spec, get_provider_semaphore, llm_output_schema, with_json_schema
+from app.llm_cache import get_llm_cache, make_cache_key
+from app.llm_limiter import estimate_tokens, get_llm_limiter
+from app.logging import get_logger
+from app.metrics import get_metrics
 from app.prompts import format_prompt, load_prompt
+from app.singleflight import get_singleflight
+from app.streaming_json import IncrementalJSONParser
+
+TokenCallback = Callable[[str], Awaitable[None]]
+SyncTokenCallback = Callable[[str], None]
+FieldsCallback = Callable[[dict[str, Any]], None]
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+logger = get_logger()
+
+
+def _used_tokens(message: Any) -> int | None:
+    """Provider'ın bildirdiği toplam token; bildirmiyorsa None (tahmin geçerli kalır)."""
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
 
 
 class BaseAgent(ABC):
     def __init__(self, llm: BaseChatModel):
         self.llm = llm
+        self.llm_spec = get_llm_spec(llm)
+        # JSON üreten agent'lar provider-native structured output kullanır
+        self.structured_output = get_settings().llm_structured_output_enabled
 
     @property
     def agent_name(self) -> str:
@@ -27,14 +57,360 @@ class BaseAgent(ABC):
             HumanMessage(content=formatted["user"]),
         ]
 
-    def invoke_llm(self, prompt_name: str, prompt_variables: dict[str, Any]) -> str:
+    def _use_cache(self, prompt_name: str) -> bool:
+        # Opt-in: hem global flag hem prompt YAML'daki `cache: true` gerekli
+        return get_settings().llm_cache_enabled and load_prompt(prompt_name)["cache"]
+
+    def invoke_llm(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        llm: BaseChatModel | None = None,
+        output_schema: type[BaseModel] | None = None,
+        validate: Callable[[str], Any] | None = None,
+    ) -> str:
+        """
+        `llm` verilirse agent'ın modeli yerine o kullanılır (örn. ucuz ara adımlar).
+        `output_schema` verilirse cevap provider tarafında schema'ya bağlı JSON'dur.
+        `validate` hata fırlatırsa cevap döner ama cache'e yazılmaz (schema'sız
+        JSON yolu: kesik cevabın fallback'i TTL boyunca her hit'te dönmesin).
+        """
+        llm = llm or self.llm
         messages = self._build_messages(prompt_name, prompt_variables)
-        llm_response = self.llm.invoke(messages)
-        return llm_response.content
+        request_key = self._request_key(llm, messages, output_schema)
+        use_cache = self._use_cache(prompt_name)
+
+        if use_cache:
+            cached = get_llm_cache().get(request_key, prompt_name)
+            if cached is not None:
+                return cached
+
+        # Aynı anda aynı istek başka worker'da çalışıyorsa onun cevabı beklenir
+        settings = get_settings()
+        response_content = get_singleflight().run(
+            f"llm:{prompt_name}",
+            request_key,
+            lambda: self._call_llm(prompt_name, messages, llm, output_schema),
+            lease_seconds=settings.singleflight_lease_seconds,
+            result_ttl=settings.singleflight_result_ttl_seconds,
+        )
+
+        if use_cache and self._is_cacheable(prompt_name, response_content, validate):
+            ttl = load_prompt(prompt_name)["cache_ttl_seconds"]
+            get_llm_cache().set(request_key, response_content, ttl)
+        return response_content
 
     async def invoke_llm_async(
-        self, prompt_name: str, prompt_variables: dict[str, Any]
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        llm: BaseChatModel | None = None,
+        output_schema: type[BaseModel] | None = None,
+        validate: Callable[[str], Any] | None = None,
     ) -> str:
+        llm = llm or self.llm
         messages = self._build_messages(prompt_name, prompt_variables)
-        llm_response = await self.llm.ainvoke(messages)
-        return llm_response.content
+        request_key = self._request_key(llm, messages, output_schema)
+        use_cache = self._use_cache(prompt_name)
+
+        if use_cache:
+            cached = await asyncio.to_thread(get_llm_cache().get, request_key, prompt_name)
+            if cached is not None:
+                return cached
+
+        settings = get_settings()
+        response_content = await get_singleflight().run_async(
+            f"llm:{prompt_name}",
+            request_key,
+            lambda: self._call_llm_async(prompt_name, messages, llm, output_schema),
+            lease_seconds=settings.singleflight_lease_seconds,
+            result_ttl=settings.singleflight_result_ttl_seconds,
+        )
+
+        if use_cache and self._is_cacheable(prompt_name, response_content, validate):
+            ttl = load_prompt(prompt_name)["cache_ttl_seconds"]
+            await asyncio.to_thread(get_llm_cache().set, request_key, response_content, ttl)
+        return response_content
+
+    @staticmethod
+    def _is_cacheable(
+        prompt_name: str, response: str, validate: Callable[[str], Any] | None
+    ) -> bool:
+        if validate is None:
+            return True
+        try:
+            validate(response)
+            return True
+        except Exception:
+            get_metrics().incr(f"llm_cache:{prompt_name}:invalid")
+            return False
+
+    def invoke_structured(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        schema: type[ModelT],
+        exclude: tuple[str, ...] = (),
+    ) -> ModelT:
+        """
+        Schema'ya bağlı JSON cevabı doğrudan `model_validate_json` ile parse eder.
+        `exclude` alanları LLM'den istenmez (default'ları olmalı). Geçersiz cevap
+        sessiz fallback'e düşmez, hata stage'i retry'a gönderir.
+        """
+        output_schema = llm_output_schema(schema, exclude)
+        response = self.invoke_llm(prompt_name, prompt_variables, output_schema=output_schema)
+        return schema.model_validate_json(response)
+
+    async def invoke_structured_async(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        schema: type[ModelT],
+        exclude: tuple[str, ...] = (),
+    ) -> ModelT:
+        output_schema = llm_output_schema(schema, exclude)
+        response = await self.invoke_llm_async(
+            prompt_name, prompt_variables, output_schema=output_schema
+        )
+        return schema.model_validate_json(response)
+
+    def stream_structured(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        schema: type[ModelT],
+        on_fields: FieldsCallback,
+        exclude: tuple[str, ...] = (),
+    ) -> ModelT:
+        """
+        invoke_structured'ın stream'li hali: kapanan top-level alanlar
+        `on_fields`'e verilir, tam cevap yine `model_validate_json`'dan geçer.
+        Stream hedge ve single-flight'a girmez; stream hata verir ya da cevap
+        geçersiz çıkarsa istek invoke_structured ile (hedge + single-flight)
+        tekrarlanır. O cevabın alanları tekrar `on_fields`'e verilmez.
+        """
+        output_schema = llm_output_schema(schema, exclude)
+        parser = IncrementalJSONParser(output_schema)
+
+        def forward(text: str):
+            fields = parser.feed(text)
+            if fields:
+                on_fields(fields)
+
+        try:
+            response = self.stream_llm(
+                prompt_name, prompt_variables, forward, output_schema=output_schema
+            )
+            return schema.model_validate_json(response)
+        except Exception as stream_error:
+            self._record_stream_fallback(prompt_name, stream_error)
+            return self.invoke_structured(prompt_name, prompt_variables, schema, exclude)
+
+    async def astream_structured(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        schema: type[ModelT],
+        on_fields: FieldsCallback,
+        exclude: tuple[str, ...] = (),
+    ) -> ModelT:
+        output_schema = llm_output_schema(schema, exclude)
+        parser = IncrementalJSONParser(output_schema)
+
+        async def forward(text: str):
+            fields = parser.feed(text)
+            if fields:
+                on_fields(fields)
+
+        try:
+            response = await self.astream_llm(
+                prompt_name, prompt_variables, forward, output_schema=output_schema
+            )
+            return schema.model_validate_json(response)
+        except Exception as stream_error:
+            self._record_stream_fallback(prompt_name, stream_error)
+            return await self.invoke_structured_async(
+                prompt_name, prompt_variables, schema, exclude
+            )
+
+    @staticmethod
+    def _record_stream_fallback(prompt_name: str, stream_error: Exception):
+        logger.warning(
+            f"Structured stream failed for {prompt_name}, retrying without stream: {stream_error}"
+        )
+        get_metrics().incr(f"structured_output:{prompt_name}:stream_fallback")
+
+    @staticmethod
+    def _request_key(
+        llm: BaseChatModel, messages: list, output_schema: type[BaseModel] | None
+    ) -> str:
+        schema = output_schema.model_json_schema() if output_schema is not None else None
+        return make_cache_key(get_llm_spec(llm), messages, schema)
+
+    def _call_llm(
+        self,
+        prompt_name: str,
+        messages: list,
+        llm: BaseChatModel,
+        output_schema: type[BaseModel] | None = None,
+    ) -> str:
+        # Birincil model p95'i aşarsa ya da hata verirse yedek model devreye girer
+        return get_hedge_policy().run(
+            prompt_name,
+            llm,
+            lambda model: self._validated(
+                prompt_name, self._invoke_model(model, messages, output_schema), output_schema
+            ),
+        )
+
+    async def _call_llm_async(
+        self,
+        prompt_name: str,
+        messages: list,
+        llm: BaseChatModel,
+        output_schema: type[BaseModel] | None = None,
+    ) -> str:
+        async def call(model: BaseChatModel) -> str:
+            response = await self._invoke_model_async(model, messages, output_schema)
+            return self._validated(prompt_name, response, output_schema)
+
+        return await get_hedge_policy().run_async(prompt_name, llm, call)
+
+    @staticmethod
+    def _validated(
+        prompt_name: str, response: str, output_schema: type[BaseModel] | None
+    ) -> str:
+        # Geçersiz cevap (örn. max_tokens'ta kesilmiş JSON) cache'e ve
+        # single-flight'a girmeden hata olur; hedge varsa yedek model denenir
+        if output_schema is not None:
+            try:
+                output_schema.model_validate_json(response)
+            except ValidationError:
+                get_metrics().incr(f"structured_output:{prompt_name}:invalid")
+                raise
+        return response
+
+    @staticmethod
+    def _invoke_model(
+        llm: BaseChatModel, messages: list, output_schema: type[BaseModel] | None = None
+    ) -> str:
+        # Provider limiti: kapasite yoksa sırası gelene kadar beklenir
+        spec = get_llm_spec(llm)
+        estimated_tokens = estimate_tokens(messages, spec.max_tokens)
+        get_llm_limiter().wait(spec, estimated_tokens)
+
+        if output_schema is not None:
+            response = with_json_schema(llm, output_schema).invoke(messages)
+        else:
+            response = llm.invoke(messages)
+        get_llm_limiter().settle(spec, estimated_tokens, _used_tokens(response))
+        return response.text if output_schema is not None else response.content
+
+    @staticmethod
+    async def _invoke_model_async(
+        llm: BaseChatModel, messages: list, output_schema: type[BaseModel] | None = None
+    ) -> str:
+        spec = get_llm_spec(llm)
+        estimated_tokens = estimate_tokens(messages, spec.max_tokens)
+        await get_llm_limiter().wait_async(spec, estimated_tokens)
+
+        async with get_provider_semaphore(spec.provider):
+            if output_schema is not None:
+                response = await with_json_schema(llm, output_schema).ainvoke(messages)
+            else:
+                response = await llm.ainvoke(messages)
+        await asyncio.to_thread(
+            get_llm_limiter().settle, spec, estimated_tokens, _used_tokens(response)
+        )
+        return response.text if output_schema is not None else response.content
+
+    def stream_llm(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        on_token: SyncTokenCallback,
+        output_schema: type[BaseModel] | None = None,
+    ) -> str:
+        """
+        Token'ları geldikçe `on_token`'a iletir, tam cevabı döner.
+        Single-flight'a girmez; cache hit'i tek parça olarak akar.
+        """
+        messages = self._build_messages(prompt_name, prompt_variables)
+        request_key = self._request_key(self.llm, messages, output_schema)
+        use_cache = self._use_cache(prompt_name)
+
+        if use_cache:
+            cached = get_llm_cache().get(request_key, prompt_name)
+            if cached is not None:
+                on_token(cached)
+                return cached
+
+        estimated_tokens = estimate_tokens(messages, self.llm_spec.max_tokens)
+        get_llm_limiter().wait(self.llm_spec, estimated_tokens)
+
+        model = self.llm if output_schema is None else with_json_schema(self.llm, output_schema)
+        started_at = time.perf_counter()
+        chunks = []
+        used_tokens = None
+        for chunk in model.stream(messages):
+            used_tokens = _used_tokens(chunk) or used_tokens
+            if not chunk.text:
+                continue
+            if not chunks:
+                get_metrics().observe(f"llm_ttft:{prompt_name}", time.perf_counter() - started_at)
+            chunks.append(chunk.text)
+            on_token(chunk.text)
+
+        get_llm_limiter().settle(self.llm_spec, estimated_tokens, used_tokens)
+        response_content = self._validated(prompt_name, "".join(chunks), output_schema)
+        if use_cache:
+            ttl = load_prompt(prompt_name)["cache_ttl_seconds"]
+            get_llm_cache().set(request_key, response_content, ttl)
+        return response_content
+
+    async def astream_llm(
+        self,
+        prompt_name: str,
+        prompt_variables: dict[str, Any],
+        on_token: TokenCallback,
+        output_schema: type[BaseModel] | None = None,
+    ) -> str:
+        messages = self._build_messages(prompt_name, prompt_variables)
+        request_key = self._request_key(self.llm, messages, output_schema)
+        use_cache = self._use_cache(prompt_name)
+
+        if use_cache:
+            cached = await asyncio.to_thread(get_llm_cache().get, request_key, prompt_name)
+            if cached is not None:
+                await on_token(cached)
+                return cached
+
+        estimated_tokens = estimate_tokens(messages, self.llm_spec.max_tokens)
+        await get_llm_limiter().wait_async(self.llm_spec, estimated_tokens)
+
+        model = self.llm if output_schema is None else with_json_schema(self.llm, output_schema)
+        chunks = []
+        used_tokens = None
+        async with get_provider_semaphore(self.llm_spec.provider):
+            started_at = time.perf_counter()
+            async for chunk in model.astream(messages):
+                used_tokens = _used_tokens(chunk) or used_tokens
+                if not chunk.text:
+                    continue
+                if not chunks:
+                    await asyncio.to_thread(
+                        get_metrics().observe,
+                        f"llm_ttft:{prompt_name}",
+                        time.perf_counter() - started_at,
+                    )
+                chunks.append(chunk.text)
+                await on_token(chunk.text)
+
+        await asyncio.to_thread(
+            get_llm_limiter().settle, self.llm_spec, estimated_tokens, used_tokens
+        )
+        response_content = self._validated(prompt_name, "".join(chunks), output_schema)
+        if use_cache:
+            ttl = load_prompt(prompt_name)["cache_ttl_seconds"]
+            await asyncio.to_thread(get_llm_cache().set, request_key, response_content, ttl)
+        return response_content
@@ -1,174 +1,330 @@
 import json
-from app.agents.base import BaseAgent
+from app.agents.base import BaseAgent, SyncTokenCallback, TokenCallback
 from app.config import get_settings
 from app.llm import get_discovery_llm
-from app.models.domain import ConversationTurn, DiscoveryOutput
-from app.utils import clean_llm_json_response, detect_language
+from app.logging import get_logger
+from app.models.domain import ConversationTurn, DiscoveryOutput, DiscoverySession
+from app.utils import clean_llm_json_response, detect_language, parse_llm_json
+
+logger = get_logger()
 
 
 class DiscoveryAgent(BaseAgent):
+    """
+    Stateless discovery agent.
+
+    Konuşma state'i (ilk problem, turlar, aktif soru, dil) agent'ta tutulmaz;
+    her çağrıda DiscoverySession olarak verilir. Böylece herhangi bir worker
+    herhangi bir turu işleyebilir.
+    """
+
     def __init__(self):
         super().__init__(llm=get_discovery_llm())
         settings = get_settings()
         self.min_questions = settings.discovery_min_questions
         self.max_questions = settings.discovery_max_questions
-        self._reset_state()
-
-    def _reset_state(self):
-        """Reset agent state. Called when starting a new discovery session."""
-        self.initial_problem: str = ""
-        self.conversation_turns: list[ConversationTurn] = []
-        self.current_question: str = ""
-        self.response_language: str = "Turkish"
-
-    def start_discovery(self, user_problem: str, language: str | None = None) -> str:
-        self._reset_state()
-        self.initial_problem = user_problem
+        self.summary_enabled = settings.discovery_summary_enabled
+        self.verbatim_turns = settings.discovery_verbatim_turns
+        self.summary_min_chars = settings.discovery_summary_min_chars
+        self.history_budget_chars = settings.discovery_history_token_budget * 4
+
+    def new_session(self, user_problem: str, language: str | None = None) -> DiscoverySession:
         # Language detected from initial problem if not provided by workflow
-        self.response_language = language or detect_language(user_problem)
-        self.current_question = self._generate_question()
-        return self.current_question
+        return DiscoverySession(
+            initial_problem=user_problem,
+            response_language=language or detect_language(user_problem),
+        )
 
-    async def start_discovery_async(self, user_problem: str, language: str | None = None) -> str:
-        self._reset_state()
-        self.initial_problem = user_problem
-        self.response_language = language or detect_language(user_problem)
-        self.current_question = await self._generate_question_async()
-        return self.current_question
+    def start_discovery(
+        self, session: DiscoverySession, on_token: SyncTokenCallback | None = None
+    ) -> str:
+        session.current_question = self._generate_question(session, on_token)
+        return session.current_question
 
-    def continue_discovery(self, user_answer: str) -> str | DiscoveryOutput:
-        self._record_turn(user_answer)
+    async def start_discovery_async(
+        self, session: DiscoverySession, on_token: TokenCallback | None = None
+    ) -> str:
+        session.current_question = await self._generate_question_async(session, on_token)
+        return session.current_question
 
-        if self._should_complete():
-            return self._extract_insights()
+    def continue_discovery(
+        self,
+        session: DiscoverySession,
+        user_answer: str,
+        on_token: SyncTokenCallback | None = None,
+    ) -> str | DiscoveryOutput:
+        self._record_turn(session, user_answer)
 
-        self.current_question = self._generate_question()
-        return self.current_question
+        if self._should_complete(session):
+            return self._extract_insights(session)
 
-    async def continue_discovery_async(self, user_answer: str) -> str | DiscoveryOutput:
-        self._record_turn(user_answer)
+        self._fold_old_turns(session)
+        session.current_question = self._generate_question(session, on_token)
+        return session.current_question
 
-        if self._should_complete():
-            return await self._extract_insights_async()
+    async def continue_discovery_async(
+        self,
+        session: DiscoverySession,
+        user_answer: str,
+        on_token: TokenCallback | None = None,
+    ) -> str | DiscoveryOutput:
+        self._record_turn(session, user_answer)
 
-        self.current_question = await self._generate_question_async()
-        return self.current_question
+        if self._should_complete(session):
+            return await self._extract_insights_async(session)
 
-    def _record_turn(self, user_answer: str):
+        await self._fold_old_turns_async(session)
+        session.current_question = await self._generate_question_async(session, on_token)
+        return session.current_question
+
+    def _record_turn(self, session: DiscoverySession, user_answer: str):
         turn = ConversationTurn(
-            question=self.current_question,
+            question=session.current_question,
             answer=user_answer,
-            turn_number=len(self.conversation_turns) + 1,
+            turn_number=len(session.conversation_turns) + 1,
         )
-        self.conversation_turns.append(turn)
+        session.conversation_turns.append(turn)
 
-    def _generate_question(self) -> str:
-        no_conversation_msg = (
-            "Henüz konuşma yok." if self.response_language == "Turkish"
-            else "No conversation yet."
-        )
-        question = self.invoke_llm(
-            prompt_name="discovery_question",
-            prompt_variables={
-                "initial_problem": self.initial_problem,
-                "conversation_history": self._format_conversation_history()
-                or no_conversation_msg,
-                "question_number": len(self.conversation_turns) + 1,
-                "response_language": self.response_language,
-            },
+    def _turns_to_fold(self, session: DiscoverySession) -> list[ConversationTurn]:
+        """Özete katlanacak turlar: son K tur hariç henüz özetlenmemiş olanlar."""
+        if not self.summary_enabled:
+            return []
+
+        fold_until = len(session.conversation_turns) - self.verbatim_turns
+        turns = session.conversation_turns[session.summarized_turns:fold_until]
+        # Kısa turları özetlemek bir LLM çağrısına değmez; birikince toplu katlanır
+        if sum(len(turn.question) + len(turn.answer) for turn in turns) < self.summary_min_chars:
+            return []
+        return turns
+
+    def _summary_variables(
+        self, session: DiscoverySession, turns: list[ConversationTurn]
+    ) -> dict:
+        return {
+            "initial_problem": session.initial_problem,
+            "previous_summary": session.summary or "-",
+            "new_turns": self._format_turns(turns),
+            "response_language": session.response_language,
+        }
+
+    def _fold_old_turns(self, session: DiscoverySession):
+        """
+        Özet sadece optimizasyon: çağrı hata alırsa session değişmez, turlar
+        aynen kalır ve bir sonraki turda tekrar denenir.
+        """
+        turns = self._turns_to_fold(session)
+        if not turns:
+            return
+
+        try:
+            summary = self.invoke_llm(
+                prompt_name="discovery_summarize",
+                prompt_variables=self._summary_variables(session, turns),
+            )
+        except Exception as summary_error:
+            logger.warning(f"Discovery summary failed, keeping turns verbatim: {summary_error}")
+            return
+        session.summary = summary.strip()
+        session.summarized_turns += len(turns)
+
+    async def _fold_old_turns_async(self, session: DiscoverySession):
+        turns = self._turns_to_fold(session)
+        if not turns:
+            return
+
+        try:
+            summary = await self.invoke_llm_async(
+                prompt_name="discovery_summarize",
+                prompt_variables=self._summary_variables(session, turns),
+            )
+        except Exception as summary_error:
+            logger.warning(f"Discovery summary failed, keeping turns verbatim: {summary_error}")
+            return
+        session.summary = summary.strip()
+        session.summarized_turns += len(turns)
+
+    def _bounded_conversation_history(self, session: DiscoverySession) -> str:
+        """
+        Soru prompt'u için: özet + özetlenmemiş turlar. Token bütçesi aşılırsa
+        aynen kalan cevaplar kırpılır (kullanıcılar paragraf yapıştırıyor).
+        Cevap başına 200 karakter korunur; yer kalmazsa önce özet, sonra bu
+        taban da kırpılır. Sadece soru metinleri kırpılmaz.
+        """
+        turns = session.conversation_turns[session.summarized_turns:]
+        summary_block = (
+            f"Summary of Q1-Q{session.summarized_turns}: {session.summary}"
+            if session.summary
+            else ""
         )
-        return question.strip()
+        history = "\n".join(part for part in (summary_block, self._format_turns(turns)) if part)
+        if len(history) <= self.history_budget_chars or not turns:
+            return history
+
+        question_chars = sum(len(turn.question) + 16 for turn in turns)
+        summary_room = self.history_budget_chars - question_chars - 200 * len(turns)
+        if len(summary_block) > summary_room:
+            summary_block = self._clip(summary_block, max(summary_room, 0))
+        fixed_chars = len(summary_block) + question_chars
+        answer_chars = max((self.history_budget_chars - fixed_chars) // len(turns), 0)
+        clipped = [
+            turn.model_copy(update={"answer": self._clip(turn.answer, answer_chars)})
+            for turn in turns
+        ]
+        return "\n".join(part for part in (summary_block, self._format_turns(clipped)) if part)
+
+    @staticmethod
+    def _clip(text: str, max_chars: int) -> str:
+        if len(text) <= max_chars:
+            return text
+        # Baş ve son korunur; uzun cevapların sonucu genelde sonda
+        marker = " [...] "
+        if max_chars <= len(marker):
+            return text[:max_chars]
+        head = (max_chars - len(marker)) * 2 // 3
+        tail = max_chars - len(marker) - head
+        return f"{text[:head]}{marker}{text[-tail:]}"
 
-    async def _generate_question_async(self) -> str:
+    def _question_variables(self, session: DiscoverySession) -> dict:
         no_conversation_msg = (
-            "Henüz konuşma yok." if self.response_language == "Turkish"
+            "Henüz konuşma yok." if session.response_language == "Turkish"
             else "No conversation yet."
         )
-        question = await self.invoke_llm_async(
-            prompt_name="discovery_question",
-            prompt_variables={
-                "initial_problem": self.initial_problem,
-                "conversation_history": self._format_conversation_history()
-                or no_conversation_msg,
-                "question_number": len(self.conversation_turns) + 1,
-                "response_language": self.response_language,
-            },
-        )
+        return {
+            "initial_problem": session.initial_problem,
+            "conversation_history": self._bounded_conversation_history(session)
+            or no_conversation_msg,
+            "question_number": len(session.conversation_turns) + 1,
+            "response_language": session.response_language,
+        }
+
+    def _generate_question(
+        self, session: DiscoverySession, on_token: SyncTokenCallback | None = None
+    ) -> str:
+        if on_token is not None:
+            question = self.stream_llm(
+                prompt_name="discovery_question",
+                prompt_variables=self._question_variables(session),
+                on_token=on_token,
+            )
+        else:
+            question = self.invoke_llm(
+                prompt_name="discovery_question",
+                prompt_variables=self._question_variables(session),
+            )
         return question.strip()
 
-    def _should_complete(self) -> bool:
-        turn_count = len(self.conversation_turns)
+    async def _generate_question_async(
+        self, session: DiscoverySession, on_token: TokenCallback | None = None
+    ) -> str:
+        # on_token verilirse soru token token client'a akar
+        if on_token is not None:
+            question = await self.astream_llm(
+                prompt_name="discovery_question",
+                prompt_variables=self._question_variables(session),
+                on_token=on_token,
+            )
+        else:
+            question = await self.invoke_llm_async(
+                prompt_name="discovery_question",
+                prompt_variables=self._question_variables(session),
+            )
+        return question.strip()
+
+    def _should_complete(self, session: DiscoverySession) -> bool:
+        turn_count = len(session.conversation_turns)
         if turn_count < self.min_questions:
             return False
         if turn_count >= self.max_questions:
             return True
         # Stop early if last 2 answers are detailed (>100 chars each)
         # Prevents over-questioning when user is being thorough
-        recent_answers = [t.answer for t in self.conversation_turns[-2:]]
+        recent_answers = [t.answer for t in session.conversation_turns[-2:]]
         if len(recent_answers) >= 2 and all(len(ans) > 100 for ans in recent_answers):
             return True
 
         return False
 
-    def _extract_insights(self) -> DiscoveryOutput:
+    def _extraction_variables(self, session: DiscoverySession) -> dict:
+        return {
+            "initial_problem": session.initial_problem,
+            "conversation_history": self._format_conversation_history(session),
+            "response_language": session.response_language,
+        }
+
+    def _extract_insights(self, session: DiscoverySession) -> DiscoveryOutput:
+        if self.structured_output:
+            # Turlar LLM'den istenmez, session'dan eklenir
+            output = self.invoke_structured(
+                "discovery_extract",
+                self._extraction_variables(session),
+                DiscoveryOutput,
+                exclude=("conversation_turns",),
+            )
+            return output.model_copy(update={"conversation_turns": session.conversation_turns})
+
         extraction_response = self.invoke_llm(
             prompt_name="discovery_extract",
-            prompt_variables={
-                "initial_problem": self.initial_problem,
-                "conversation_history": self._format_conversation_history(),
-                "response_language": self.response_language,
-            },
+            prompt_variables=self._extraction_variables(session),
+            validate=parse_llm_json,
         )
-        return self._parse_extraction(extraction_response)
+        return self._parse_extraction(session, extraction_response)
+
+    async def _extract_insights_async(self, session: DiscoverySession) -> DiscoveryOutput:
+        if self.structured_output:
+            output = await self.invoke_structured_async(
+                "discovery_extract",
+                self._extraction_variables(session),
+                DiscoveryOutput,
+                exclude=("conversation_turns",),
+            )
+            return output.model_copy(update={"conversation_turns": session.conversation_turns})
 
-    async def _extract_insights_async(self) -> DiscoveryOutput:
         extraction_response = await self.invoke_llm_async(
             prompt_name="discovery_extract",
-            prompt_variables={
-                "initial_problem": self.initial_problem,
-                "conversation_history": self._format_conversation_history(),
-                "response_language": self.response_language,
-            },
+            prompt_variables=self._extraction_variables(session),
+            validate=parse_llm_json,
         )
-        return self._parse_extraction(extraction_response)
+        return self._parse_extraction(session, extraction_response)
 
-    def _parse_extraction(self, llm_response: str) -> DiscoveryOutput:
+    def _parse_extraction(self, session: DiscoverySession, llm_response: str) -> DiscoveryOutput:
         try:
             cleaned = clean_llm_json_response(llm_response)
             parsed = json.loads(cleaned)
 
             return DiscoveryOutput(
                 customer_stated_problem=parsed.get(
-                    "customer_stated_problem", self.initial_problem
+                    "customer_stated_problem", session.initial_problem
                 ),
                 identified_business_problem=parsed.get(
                     "identified_business_problem", ""
                 ),
                 hidden_root_risk=parsed.get("hidden_root_risk", ""),
                 chat_summary=parsed.get("chat_summary", ""),
-                conversation_turns=self.conversation_turns,
+                conversation_turns=session.conversation_turns,
             )
         except json.JSONDecodeError:
             fallback_msg = (
                 "Extraction başarısız - manuel analiz gerekli"
-                if self.response_language == "Turkish"
+                if session.response_language == "Turkish"
                 else "Extraction failed - manual analysis required"
             )
             return DiscoveryOutput(
-                customer_stated_problem=self.initial_problem,
+                customer_stated_problem=session.initial_problem,
                 identified_business_problem=fallback_msg,
-                hidden_root_risk="Belirlenemedi" if self.response_language == "Turkish" else "Could not be determined",
-                chat_summary=self._format_conversation_history(),
-                conversation_turns=self.conversation_turns,
+                hidden_root_risk="Belirlenemedi" if session.response_language == "Turkish" else "Could not be determined",
+                chat_summary=self._format_conversation_history(session),
+                conversation_turns=session.conversation_turns,
             )
 
-    def _format_conversation_history(self) -> str:
-        if not self.conversation_turns:
-            return ""
+    def _format_conversation_history(self, session: DiscoverySession) -> str:
+        # Extraction tek sefer çalışır ve tüm detaya ihtiyaç duyar: tam transcript
+        return self._format_turns(session.conversation_turns)
 
+    @staticmethod
+    def _format_turns(turns: list[ConversationTurn]) -> str:
         lines = []
-        for turn in self.conversation_turns:
+        for turn in turns:
             lines.append(f"Q{turn.turn_number}: {turn.question}")
             lines.append(f"A{turn.turn_number}: {turn.answer}")
 
-        return "\n".join(lines)
\ No newline at end of file
+        return "\n".join(lines)
@@ -0,0 +1,382 @@
+import asyncio
+import contextvars
+import queue
+from collections.abc import Awaitable, Callable
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any
+
+from app.stage_memo import StageMemo
+
+ErrorHandler = Callable[[dict, str, Exception], None]
+CompletionHandler = Callable[[dict, "Stage"], None]
+PartialListener = Callable[[dict[str, Any]], None]
+
+# Çalışan stage'e executor tarafından set edilir; çıktısının biten alanlarını bekleyen stage yoksa None
+_partial_listener: contextvars.ContextVar[PartialListener | None] = contextvars.ContextVar(
+    "partial_listener", default=None
+)
+
+
+def partial_output_listener() -> PartialListener | None:
+    """Stage içinden: output alanları tamamlandıkça executor'a bildiren callback."""
+    return _partial_listener.get()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """Pipeline'daki tek adım: state'ten okur, `output_key` için değer üretir."""
+
+    name: str
+    output_key: str
+    run: Callable[[dict], Any]
+    agent: str
+    depends_on: tuple[str, ...] = field(default_factory=tuple)
+    run_async: Callable[[dict], Awaitable[Any]] | None = None
+    inputs: tuple[str, ...] = field(default_factory=tuple)  # memo key'i; boşsa memo yok
+    # Bağımlılıktan sadece bu alanlar okunur; hepsi stream'de kapanınca stage erken başlar
+    fields: dict[str, tuple[str, ...]] = field(default_factory=dict)
+
+
+class _PartialOutputs:
+    """
+    Çalışan stage'lerin tamamlanan output alanları; gelen her alan ana döngüyü
+    uyandırır. Bu alanlarla erken başlayan stage'ler ve bağımlılığı bitene
+    kadar bekletilen çıktıları da burada tutulur.
+    """
+
+    def __init__(self):
+        self.fields: dict[str, dict[str, Any]] = {}
+        self.wakeup: Future = Future()
+        self.started_early: set[str] = set()
+        self.held: list[tuple[Stage, Any]] = []
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    def launched(self, stage: Stage, completed: set[str]):
+        if any(dep not in completed for dep in stage.depends_on):
+            self.started_early.add(stage.name)
+
+    def listener(self, stage_name: str) -> PartialListener:
+        def publish(fields: dict[str, Any]):
+            # Stage thread'inden ya da event loop'tan çağrılır
+            self._queue.put((stage_name, fields))
+            try:
+                self.wakeup.set_result(None)
+            except InvalidStateError:
+                pass
+
+        return publish
+
+    def drain(self):
+        # Önce yeni wakeup, sonra kuyruk: arada gelen alan kaybolmaz
+        if self.wakeup.done():
+            self.wakeup = Future()
+        while True:
+            try:
+                stage_name, fields = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self.fields.setdefault(stage_name, {}).update(fields)
+
+
+class StageExecutor:
+    """
+    Dependency-aware stage runner.
+
+    Bağımlılıkları tamamlanan stage'ler aynı anda çalışır (örn. risk ve report
+    ikisi de sadece action_plan'e bağlı). Sonuçlar tek thread'de state'e
+    yazılır, stage fonksiyonları state'in kopyasını okur. `memo` verilirse
+    aynı girdilerle daha önce biten stage'in çıktısı tekrar hesaplanmaz.
+
+    `early_start` açıksa `Stage.fields` tanımlı stage, bağımlılığı hâlâ
+    çalışırken okuduğu alanlar stream'de tamamlanınca başlar. Çıktısı
+    bağımlılık bitene kadar bekletilir; bağımlılık hata alırsa atılır, okunan
+    alanlar son çıktıdakinden farklıysa stage tekrar çalışır.
+    """
+
+    def __init__(
+        self,
+        stages: list[Stage],
+        on_error: ErrorHandler,
+        on_complete: CompletionHandler | None = None,
+        max_workers: int = 4,
+        memo: StageMemo | None = None,
+        early_start: bool = True,
+    ):
+        self._stages = stages
+        self._on_error = on_error
+        self._on_complete = on_complete
+        self._max_workers = max_workers
+        self._memo = memo
+        self._early_start = early_start
+
+        self._by_name = {stage.name: stage for stage in stages}
+        known = set(self._by_name)
+        for stage in stages:
+            missing = set(stage.depends_on) - known
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' unknown dependencies: {missing}")
+            if set(stage.fields) - set(stage.depends_on):
+                raise ValueError(f"Stage '{stage.name}' reads fields of a non-dependency")
+        # Çıktı alanları başka bir stage'i erken başlatabilecek stage'ler
+        self._streamed = {name for stage in stages for name in stage.fields}
+
+    @property
+    def stage_names(self) -> list[str]:
+        return [stage.name for stage in self._stages]
+
+    def get_stage(self, name: str) -> Stage:
+        return self._by_name[name]
+
+    def levels(self, state: dict) -> list[list[str]]:
+        """
+        Eksik stage'ler bağımlılık derinliğine göre gruplanmış halde; aynı
+        seviyedekiler birbirini beklemeden çalışabilir. Celery canvas'ı için.
+        """
+        completed = {
+            stage.name for stage in self._stages if state.get(stage.output_key) is not None
+        }
+        pending = [stage for stage in self._stages if stage.name not in completed]
+        levels = []
+        while ready := self._ready_stages(pending, completed):
+            levels.append([stage.name for stage in ready])
+            for stage in ready:
+                pending.remove(stage)
+                completed.add(stage.name)
+        return levels
+
+    def run_stage(self, state: dict, name: str) -> dict:
+        """Tek stage; hata yakalanmaz, retry kararı çağırana ait."""
+        stage = self._by_name[name]
+        output = self._run_memoized(stage, self._stage_state(stage, state, {}))
+        self._record(state, stage, output, set())
+        return state
+
+    def execute(self, state: dict) -> dict:
+        # Output'u state'te zaten olan stage'ler tekrar çalıştırılmaz
+        completed = {
+            stage.name for stage in self._stages if state.get(stage.output_key) is not None
+        }
+        pending = [stage for stage in self._stages if stage.name not in completed]
+        running: dict[Future, Stage] = {}
+        partials = _PartialOutputs()
+
+        with ThreadPoolExecutor(
+            max_workers=self._max_workers, thread_name_prefix="stage"
+        ) as pool:
+            while pending or running:
+                if not state.get("error"):
+                    for stage in self._ready_stages(pending, completed, partials.fields):
+                        pending.remove(stage)
+                        partials.launched(stage, completed)
+                        # Context kopyalanır: stage thread'i event listener'ları görsün
+                        context = contextvars.copy_context()
+                        running[
+                            pool.submit(
+                                context.run,
+                                self._run_stage,
+                                stage,
+                                self._stage_state(stage, state, partials.fields),
+                                self._listener(stage, partials),
+                            )
+                        ] = stage
+
+                if not running:
+                    break
+
+                finished, _ = wait([*running, partials.wakeup], return_when=FIRST_COMPLETED)
+                partials.drain()
+                for future in finished:
+                    if future in running:
+                        stage = running.pop(future)
+                        pending.extend(self._merge(state, stage, future, completed, partials))
+
+        return state
+
+    async def execute_async(self, state: dict) -> dict:
+        """
+        execute() ile aynı sıralama, thread yerine event loop task'ları.
+        `run_async` tanımlı olmayan stage'ler to_thread ile çalışır.
+        """
+        completed = {
+            stage.name for stage in self._stages if state.get(stage.output_key) is not None
+        }
+        pending = [stage for stage in self._stages if stage.name not in completed]
+        running: dict[asyncio.Future, Stage] = {}
+        partials = _PartialOutputs()
+
+        while pending or running:
+            if not state.get("error"):
+                for stage in self._ready_stages(pending, completed, partials.fields):
+                    pending.remove(stage)
+                    partials.launched(stage, completed)
+                    coroutine = self._run_stage_async(
+                        stage,
+                        self._stage_state(stage, state, partials.fields),
+                        self._listener(stage, partials),
+                    )
+                    running[asyncio.create_task(coroutine)] = stage
+
+            if not running:
+                break
+
+            wakeup = asyncio.wrap_future(partials.wakeup)
+            finished, _ = await asyncio.wait(
+                [*running, wakeup], return_when=asyncio.FIRST_COMPLETED
+            )
+            partials.drain()
+            for task in finished:
+                if task in running:
+                    stage = running.pop(task)
+                    pending.extend(self._merge(state, stage, task, completed, partials))
+
+        return state
+
+    def _listener(self, stage: Stage, partials: _PartialOutputs) -> PartialListener | None:
+        if not self._early_start or stage.name not in self._streamed:
+            return None
+        return partials.listener(stage.name)
+
+    def _stage_state(self, stage: Stage, state: dict, partials: dict[str, dict]) -> dict:
+        """
+        Stage'e verilen state kopyası. `fields` tanımlıysa bağımlılığın çıktısı
+        sadece o alanlara indirilir; erken ya da normal başlasın memo key'i aynı.
+        """
+        stage_state = dict(state)
+        for dependency, names in stage.fields.items():
+            output_key = self._by_name[dependency].output_key
+            source = state.get(output_key) or partials.get(dependency)
+            if source is not None:
+                stage_state[output_key] = {name: source[name] for name in names}
+        return stage_state
+
+    def _run_stage(self, stage: Stage, state: dict, listener: PartialListener | None) -> Any:
+        _partial_listener.set(listener)
+        return self._run_memoized(stage, state)
+
+    async def _run_stage_async(
+        self, stage: Stage, state: dict, listener: PartialListener | None
+    ) -> Any:
+        # Task kendi context kopyasında çalışır, set diğer stage'lere sızmaz
+        _partial_listener.set(listener)
+        return await self._run_memoized_async(stage, state)
+
+    def _run_memoized(self, stage: Stage, state: dict) -> Any:
+        if self._memo is None:
+            return stage.run(state)
+
+        output = self._memo.get(stage.name, state, stage.inputs)
+        if output is None:
+            output = stage.run(state)
+            self._memo.set(stage.name, state, stage.inputs, output)
+        return output
+
+    async def _run_memoized_async(self, stage: Stage, state: dict) -> Any:
+        if stage.run_async is None:
+            return await asyncio.to_thread(self._run_memoized, stage, state)
+
+        if self._memo is None:
+            return await stage.run_async(state)
+
+        output = await asyncio.to_thread(self._memo.get, stage.name, state, stage.inputs)
+        if output is None:
+            output = await stage.run_async(state)
+            await asyncio.to_thread(self._memo.set, stage.name, state, stage.inputs, output)
+        return output
+
+    def _ready_stages(
+        self,
+        pending: list[Stage],
+        completed: set[str],
+        partials: dict[str, dict] | None = None,
+    ) -> list[Stage]:
+        return [
+            stage
+            for stage in pending
+            if all(self._available(stage, dep, completed, partials) for dep in stage.depends_on)
+        ]
+
+    def _available(
+        self, stage: Stage, dependency: str, completed: set[str], partials: dict[str, dict] | None
+    ) -> bool:
+        if dependency in completed:
+            return True
+        names = stage.fields.get(dependency)
+        if not names or not partials or not self._early_start:
+            return False
+        return all(name in partials.get(dependency, {}) for name in names)
+
+    def _merge(
+        self,
+        state: dict,
+        stage: Stage,
+        future: Future | asyncio.Task,
+        completed: set[str],
+        partials: _PartialOutputs | None = None,
+    ) -> list[Stage]:
+        """Sonucu state'e yazar; tekrar çalıştırılması gereken stage'leri döner."""
+        try:
+            output = future.result()
+        except Exception as e:
+            self._on_error(state, stage.agent, e)
+            return []
+
+        if partials is None:
+            self._record(state, stage, output, completed)
+            return []
+        if stage.name in partials.started_early and any(
+            dep not in completed for dep in stage.depends_on
+        ):
+            # Erken başlayan stage: bağımlılığı bitmeden state'e yazılmaz
+            partials.held.append((stage, output))
+            return []
+
+        stale = self._record_early_aware(state, [(stage, output)], completed, partials)
+        while partials.held and not state.get("error"):
+            ready = [
+                item for item in partials.held
+                if all(dep in completed for dep in item[0].depends_on)
+            ]
+            if not ready:
+                break
+            for item in ready:
+                partials.held.remove(item)
+            stale += self._record_early_aware(state, ready, completed, partials)
+        return stale
+
+    def _record_early_aware(
+        self,
+        state: dict,
+        outputs: list[tuple[Stage, Any]],
+        completed: set[str],
+        partials: _PartialOutputs,
+    ) -> list[Stage]:
+        stale = []
+        for stage, output in outputs:
+            early = stage.name in partials.started_early
+            partials.started_early.discard(stage.name)
+            if early and not self._read_final_fields(stage, state, partials.fields):
+                # Bağımlılık stream'dekinden farklı bitti (örn. fallback ile yeniden
+                # üretildi): erken çıktı atılır, stage son çıktıyla tekrar çalışır
+                stale.append(stage)
+            else:
+                self._record(state, stage, output, completed)
+        return stale
+
+    def _read_final_fields(self, stage: Stage, state: dict, partials: dict[str, dict]) -> bool:
+        for dependency, names in stage.fields.items():
+            final = state[self._by_name[dependency].output_key]
+            streamed = partials.get(dependency, {})
+            if any(streamed.get(name) != final.get(name) for name in names):
+                return False
+        return True
+
+    def _record(self, state: dict, stage: Stage, output: Any, completed: set[str]):
+        state[stage.output_key] = output
+        state["current_agent"] = stage.name
+        if stage.name not in state["agent_flow"]:
+            state["agent_flow"].append(stage.name)
+        completed.add(stage.name)
+
+        if self._on_complete is not None:
+            self._on_complete(state, stage)
@@ -1,29 +1,87 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from app.agents.base import BaseAgent
-from app.llm import get_peer_llm
-from app.models.domain import IntentType
+from app.config import get_settings
+from app.intent_model import get_intent_model
+from app.llm import get_peer_chunk_llm, get_peer_llm
+from app.metrics import get_metrics
+from app.models.domain import IntentType, ResearchResult, ResearchTimings, SummaryTimings
+from app.research_cache import get_research_cache, query_fingerprint
 from app.search import get_research_service
-from app.utils import detect_language
+from app.singleflight import get_singleflight
+from app.utils import detect_language, split_sections
+
+NON_BUSINESS_MESSAGES = {
+    "Turkish": (
+        "Bu asistan iş ve strateji konularında yardımcı olmak için tasarlandı. "
+        "Sektör, rekabet veya şirketinizin yaşadığı bir problemle ilgili sorunuz varsa "
+        "memnuniyetle yardımcı olurum."
+    ),
+    "English": (
+        "This assistant is designed to help with business and strategy topics. "
+        "If you have a question about your industry, competitors or a problem your "
+        "company is facing, I'd be glad to help."
+    ),
+}
 
 
 class PeerAgent(BaseAgent):
     def __init__(self):
         super().__init__(llm=get_peer_llm())
+        self.chunk_llm = get_peer_chunk_llm()
         self.research_service = get_research_service()
+        self.research_cache = get_research_cache()
+        self.singleflight = get_singleflight()
+        self.settings = get_settings()
+        self.metrics = get_metrics()
+
+    def classify_intent(self, user_message: str) -> tuple[IntentType, str]:
+        """
+        (intent, kaynak). Kaynak "local" (lokal model) ya da "llm"; conversation
+        log'una yazılır, intent modeli sadece LLM etiketleriyle eğitilir.
+        """
+        local_intent = self._classify_locally(user_message)
+        if local_intent is not None:
+            return local_intent, "local"
+        return self._classify_with_llm(user_message), "llm"
 
-    def classify_intent(self, user_message: str) -> IntentType:
+    async def classify_intent_async(self, user_message: str) -> tuple[IntentType, str]:
+        local_intent = self._classify_locally(user_message)
+        if local_intent is not None:
+            return local_intent, "local"
+        return await self._classify_with_llm_async(user_message), "llm"
+
+    def _classify_with_llm(self, user_message: str) -> IntentType:
         classification_response = self.invoke_llm(
             prompt_name="peer_classify", prompt_variables={"user_input": user_message}
         )
 
         return self._parse_intent(classification_response)
 
-    async def classify_intent_async(self, user_message: str) -> IntentType:
+    async def _classify_with_llm_async(self, user_message: str) -> IntentType:
         classification_response = await self.invoke_llm_async(
             prompt_name="peer_classify", prompt_variables={"user_input": user_message}
         )
 
         return self._parse_intent(classification_response)
 
+    def _classify_locally(self, user_message: str) -> IntentType | None:
+        """Lokal model yeterince eminse LLM round-trip'i atlanır."""
+        intent_model = get_intent_model()
+        if intent_model is None:
+            return None
+
+        intent, confidence = intent_model.predict(user_message)
+        if confidence < self.settings.intent_confidence_threshold:
+            self.metrics.incr("intent_fastpath:escalated")
+            return None
+
+        self.metrics.incr(f"intent_fastpath:{intent.value}")
+        return intent
+
     def _parse_intent(self, llm_response: str) -> IntentType:
         cleaned = llm_response.strip().lower()
 
@@ -33,56 +91,231 @@ class PeerAgent(BaseAgent):
         return IntentType.NON_BUSINESS
 
     def handle_business_info(self, user_message: str) -> dict:
-        detected_lang = detect_language(user_message)
-        research_output = self.research_service.research(user_message)
+        # Aynı soru aynı anda birden fazla task'ta gelirse research + özet tek sefer yapılır
+        return self.singleflight.run(
+            "business_info",
+            query_fingerprint(user_message),
+            lambda: self._research_and_summarize(user_message),
+            lease_seconds=self._research_lease_seconds(),
+            result_ttl=self.settings.singleflight_result_ttl_seconds,
+            share=self._is_research_answer,
+        )
 
-        if not research_output.is_successful:
-            return {
-                "message": f"Araştırma yapılırken sorun oluştu: {research_output.error}",
-                "full_report": None,
-                "sources": [],
-                "research_time": 0,
-            }
-        summarized = self.invoke_llm(
-            prompt_name="peer_summarize",
-            prompt_variables={
-                "research_content": research_output.content,
-                "response_language": detected_lang,
-            },
+    async def handle_business_info_async(self, user_message: str) -> dict:
+        return await self.singleflight.run_async(
+            "business_info",
+            query_fingerprint(user_message),
+            lambda: self._research_and_summarize_async(user_message),
+            lease_seconds=self._research_lease_seconds(),
+            result_ttl=self.settings.singleflight_result_ttl_seconds,
+            share=self._is_research_answer,
         )
 
+    def _research_and_summarize(self, user_message: str) -> dict:
+        research_output = self.research_cache.lookup(user_message)
+        if research_output is None:
+            research_output = self.research_service.research(user_message)
+            self.research_cache.store(user_message, research_output)
+
+        return self.summarize_research(user_message, research_output)
+
+    async def _research_and_summarize_async(self, user_message: str) -> dict:
+        research_output = await asyncio.to_thread(self.research_cache.lookup, user_message)
+        if research_output is None:
+            research_output = await self.research_service.research_async(user_message)
+            await asyncio.to_thread(self.research_cache.store, user_message, research_output)
+
+        return await self.summarize_research_async(user_message, research_output)
+
+    def _research_lease_seconds(self) -> float:
+        # Lease research'ün en kötü süresi + özet boyunca tutulmalı
+        return (
+            self.research_service.polling_schedule.deadline
+            + self.settings.singleflight_lease_seconds
+        )
+
+    @staticmethod
+    def _is_research_answer(response: dict) -> bool:
+        # Hata cevapları paylaşılmaz, bekleyenler kendileri dener
+        return response.get("full_report") is not None
+
+    def start_business_info(self, user_message: str) -> dict:
+        """
+        Deferred research: Tavily task'ını başlatır ve beklemeden döner.
+        Sonuç hazır olunca complete_business_info ile tamamlanır.
+        """
+        cached_research = self.research_cache.lookup(user_message)
+        if cached_research is not None:
+            return self.summarize_research(user_message, cached_research)
+
+        started_at = time.time()
+        timings = ResearchTimings()
+        # Aynı sorgu için çalışan Tavily task'ı varsa yenisi açılmaz, aynı task_id izlenir
+        tavily_task = self.singleflight.run(
+            "research_submit",
+            query_fingerprint(user_message),
+            lambda: self.research_service.submit_research(user_message, timings=timings),
+            lease_seconds=self.settings.singleflight_lease_seconds,
+            result_ttl=self.research_service.polling_schedule.deadline,
+            share=lambda task: not task.get("error"),
+        )
+
+        if tavily_task.get("error"):
+            return self._research_failed(
+                ResearchResult(error=tavily_task["error"], timings=timings)
+            )
+
         return {
-            "message": summarized,
-            "full_report": research_output.content,
-            "sources": research_output.source_urls,
-            "research_time": research_output.elapsed_seconds,
+            "message": "",
+            "full_report": None,
+            "sources": [],
+            "research_time": 0,
+            "research_timings": timings.model_dump(),
+            "research_task_id": tavily_task["request_id"],
+            "research_started_at": started_at,
         }
 
-    async def handle_business_info_async(self, user_message: str) -> dict:
+    def complete_business_info(self, user_message: str, research_output: ResearchResult) -> dict:
+        self.research_cache.store(user_message, research_output)
+        return self.summarize_research(user_message, research_output)
+
+    def summarize_research(self, user_message: str, research_output: ResearchResult) -> dict:
+        if not research_output.is_successful:
+            return self._research_failed(research_output)
+
         detected_lang = detect_language(user_message)
-        research_output = await self.research_service.research_async(user_message)
+        content = research_output.content
+        timings = SummaryTimings()
 
+        chunks = self._research_chunks(content)
+        if chunks:
+            started_at = time.perf_counter()
+            workers = min(len(chunks), self.settings.peer_map_max_parallel)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarize") as pool:
+                futures = [
+                    pool.submit(
+                        contextvars.copy_context().run,
+                        self.invoke_llm,
+                        "peer_summarize_chunk",
+                        self._chunk_variables(chunks, index, detected_lang),
+                        self.chunk_llm,
+                    )
+                    for index in range(len(chunks))
+                ]
+                content = self._join_partials([future.result() for future in futures])
+            timings = self._map_timings(chunks, started_at)
+
+        started_at = time.perf_counter()
+        summarized = self.invoke_llm(
+            prompt_name="peer_summarize",
+            prompt_variables={"research_content": content, "response_language": detected_lang},
+        )
+        timings.reduce_seconds = round(time.perf_counter() - started_at, 3)
+        self._record_summary_timings(timings)
+        return self._research_response(summarized, research_output, timings)
+
+    async def summarize_research_async(
+        self, user_message: str, research_output: ResearchResult
+    ) -> dict:
         if not research_output.is_successful:
-            return {
-                "message": f"Araştırma yapılırken sorun oluştu: {research_output.error}",
-                "full_report": None,
-                "sources": [],
-                "research_time": 0,
-            }
+            return self._research_failed(research_output)
 
+        detected_lang = detect_language(user_message)
+        content = research_output.content
+        timings = SummaryTimings()
+
+        chunks = self._research_chunks(content)
+        if chunks:
+            started_at = time.perf_counter()
+            # Eşzamanlılık provider semaphore'u ile sınırlı
+            partials = await asyncio.gather(
+                *(
+                    self.invoke_llm_async(
+                        "peer_summarize_chunk",
+                        self._chunk_variables(chunks, index, detected_lang),
+                        self.chunk_llm,
+                    )
+                    for index in range(len(chunks))
+                )
+            )
+            content = self._join_partials(partials)
+            timings = self._map_timings(chunks, started_at)
+
+        started_at = time.perf_counter()
         summarized = await self.invoke_llm_async(
             prompt_name="peer_summarize",
-            prompt_variables={
-                "research_content": research_output.content,
-                "response_language": detected_lang,
-            },
+            prompt_variables={"research_content": content, "response_language": detected_lang},
         )
+        timings.reduce_seconds = round(time.perf_counter() - started_at, 3)
+        await asyncio.to_thread(self._record_summary_timings, timings)
+        return self._research_response(summarized, research_output, timings)
+
+    def _research_chunks(self, content: str) -> list[str] | None:
+        """
+        Uzun içerik bölümlerden parçalanır (map-reduce). Eşik altındaki içerik
+        tek peer_summarize çağrısıyla özetlenir: ek tur kısa raporda kazandırmaz.
+        """
+        if (
+            not self.settings.peer_map_reduce_enabled
+            or len(content) < self.settings.peer_map_reduce_min_chars
+        ):
+            return None
 
+        chunks = split_sections(content, self.settings.peer_chunk_chars)
+        return chunks if len(chunks) > 1 else None
+
+    @staticmethod
+    def _chunk_variables(chunks: list[str], index: int, language: str) -> dict:
+        return {
+            "chunk_content": chunks[index],
+            "part_number": index + 1,
+            "total_parts": len(chunks),
+            "response_language": language,
+        }
+
+    @staticmethod
+    def _join_partials(partials: list[str]) -> str:
+        return "\n\n".join(
+            f"Part {number}:\n{partial.strip()}" for number, partial in enumerate(partials, 1)
+        )
+
+    @staticmethod
+    def _map_timings(chunks: list[str], started_at: float) -> SummaryTimings:
+        return SummaryTimings(
+            mode="map_reduce",
+            chunks=len(chunks),
+            map_seconds=round(time.perf_counter() - started_at, 3),
+        )
+
+    def _record_summary_timings(self, timings: SummaryTimings):
+        if timings.mode == "map_reduce":
+            self.metrics.observe("peer_summarize:map", timings.map_seconds)
+            self.metrics.observe("peer_summarize:reduce", timings.reduce_seconds)
+        else:
+            self.metrics.observe("peer_summarize:single", timings.reduce_seconds)
+
+    def _research_response(
+        self,
+        summarized: str,
+        research_output: ResearchResult,
+        summary_timings: SummaryTimings,
+    ) -> dict:
         return {
             "message": summarized,
             "full_report": research_output.content,
             "sources": research_output.source_urls,
             "research_time": research_output.elapsed_seconds,
+            "research_timings": research_output.timings.model_dump(),
+            "summary_timings": summary_timings.model_dump(),
+        }
+
+    def _research_failed(self, research_output: ResearchResult) -> dict:
+        return {
+            "message": f"Araştırma yapılırken sorun oluştu: {research_output.error}",
+            "full_report": None,
+            "sources": [],
+            "research_time": 0,
+            "research_timings": research_output.timings.model_dump(),
         }
 
     def handle_business_problem(self, user_message: str) -> dict:
@@ -119,6 +352,14 @@ class PeerAgent(BaseAgent):
 
         return {"message": rejection, "route_to": None}
 
+    def handle_non_business_fast(self, user_message: str) -> dict:
+        """Lokal model eminse rejection için de LLM çağrılmaz."""
+        detected_lang = detect_language(user_message)
+        return {
+            "message": NON_BUSINESS_MESSAGES.get(detected_lang, NON_BUSINESS_MESSAGES["English"]),
+            "route_to": None,
+        }
+
     async def handle_non_business_async(self, user_message: str) -> dict:
         detected_lang = detect_language(user_message)
         rejection = await self.invoke_llm_async(
@@ -133,28 +374,62 @@ class PeerAgent(BaseAgent):
 
         return {"message": rejection, "route_to": None}
 
-    def process(self, user_message: str) -> dict:
-        detected_intent = self.classify_intent(user_message)
+    def process(
+        self,
+        user_message: str,
+        defer_research: bool = False,
+        intent: IntentType | None = None,
+        intent_source: str | None = None,
+    ) -> dict:
+        """`intent` verilirse (API'de zaten sınıflandırıldı) tekrar sınıflandırılmaz."""
+        if intent is not None:
+            detected_intent = intent
+        else:
+            detected_intent, intent_source = self.classify_intent(user_message)
         detected_lang = detect_language(user_message)
 
-        if detected_intent == IntentType.BUSINESS_INFO:
+        if detected_intent == IntentType.BUSINESS_INFO and defer_research:
+            result = self.start_business_info(user_message)
+        elif detected_intent == IntentType.BUSINESS_INFO:
             result = self.handle_business_info(user_message)
         elif detected_intent == IntentType.BUSINESS_PROBLEM:
             result = self.handle_business_problem(user_message)
+        elif intent_source == "local":
+            result = self.handle_non_business_fast(user_message)
         else:
             result = self.handle_non_business(user_message)
 
-        return {"intent": detected_intent.value, "language": detected_lang, **result}
+        return {
+            "intent": detected_intent.value,
+            "intent_source": intent_source,
+            "language": detected_lang,
+            **result,
+        }
 
-    async def process_async(self, user_message: str) -> dict:
-        detected_intent = await self.classify_intent_async(user_message)
+    async def process_async(
+        self,
+        user_message: str,
+        intent: IntentType | None = None,
+        intent_source: str | None = None,
+    ) -> dict:
+        if intent is not None:
+            detected_intent = intent
+        else:
+            detected_intent, intent_source = await self.classify_intent_async(user_message)
         detected_lang = detect_language(user_message)
 
         if detected_intent == IntentType.BUSINESS_INFO:
             result = await self.handle_business_info_async(user_message)
         elif detected_intent == IntentType.BUSINESS_PROBLEM:
             result = self.handle_business_problem(user_message)
+        elif intent_source == "local":
+            result = self.handle_non_business_fast(user_message)
         else:
             result = await self.handle_non_business_async(user_message)
 
-        return {"intent": detected_intent.value, "language": detected_lang, **result}
\ No newline at end of file
+        return {
+            "intent": detected_intent.value,
+            "intent_source": intent_source,
+            "language": detected_lang,
+            **result,
+        }
\ No newline at end of file
@@ -1,5 +1,5 @@
 from datetime import datetime
-from app.agents.base import BaseAgent
+from app.agents.base import BaseAgent, SyncTokenCallback, TokenCallback
 from app.llm import get_report_llm
 from app.models.domain import (
     ActionItem,
@@ -76,10 +76,11 @@ class ReportAgent(BaseAgent):
         problem_tree: StructuredProblemTree,
         action_plan: ActionPlan,
         response_language: str = "Turkish",
+        on_token: SyncTokenCallback | None = None,
     ) -> BusinessReport:
         """Generate the full business report."""
         executive_summary = self._generate_summary(
-            discovery_output, problem_tree, action_plan, response_language
+            discovery_output, problem_tree, action_plan, response_language, on_token
         )
 
         report_markdown = self._build_markdown(
@@ -98,9 +99,10 @@ class ReportAgent(BaseAgent):
         problem_tree: StructuredProblemTree,
         action_plan: ActionPlan,
         response_language: str = "Turkish",
+        on_token: TokenCallback | None = None,
     ) -> BusinessReport:
         executive_summary = await self._generate_summary_async(
-            discovery_output, problem_tree, action_plan, response_language
+            discovery_output, problem_tree, action_plan, response_language, on_token
         )
 
         report_markdown = self._build_markdown(
@@ -119,24 +121,15 @@ class ReportAgent(BaseAgent):
         tree: StructuredProblemTree,
         plan: ActionPlan,
         response_language: str = "Turkish",
+        on_token: SyncTokenCallback | None = None,
     ) -> str:
-        short_term_actions = "\n".join(
-            f"- {a.action} ({a.timeline})" for a in plan.short_term[:3]
-        )
-        success_metrics = "\n".join(f"- {m}" for m in plan.success_metrics[:3])
+        prompt_variables = self._summary_variables(discovery, tree, plan, response_language)
 
-        summary_response = self.invoke_llm(
-            prompt_name="report_summary",
-            prompt_variables={
-                "customer_stated_problem": discovery.customer_stated_problem,
-                "identified_problem": discovery.identified_business_problem,
-                "problem_type": tree.problem_type.value,
-                "main_problem": tree.main_problem,
-                "short_term_actions": short_term_actions,
-                "success_metrics": success_metrics,
-                "response_language": response_language,
-            },
-        )
+        # on_token verilirse özet task event kanalına token token akar
+        if on_token is not None:
+            summary_response = self.stream_llm("report_summary", prompt_variables, on_token)
+        else:
+            summary_response = self.invoke_llm("report_summary", prompt_variables)
         return summary_response.strip()
 
     async def _generate_summary_async(
@@ -145,25 +138,39 @@ class ReportAgent(BaseAgent):
         tree: StructuredProblemTree,
         plan: ActionPlan,
         response_language: str = "Turkish",
+        on_token: TokenCallback | None = None,
     ) -> str:
+        prompt_variables = self._summary_variables(discovery, tree, plan, response_language)
+
+        if on_token is not None:
+            summary_response = await self.astream_llm(
+                "report_summary", prompt_variables, on_token
+            )
+        else:
+            summary_response = await self.invoke_llm_async("report_summary", prompt_variables)
+        return summary_response.strip()
+
+    def _summary_variables(
+        self,
+        discovery: DiscoveryOutput,
+        tree: StructuredProblemTree,
+        plan: ActionPlan,
+        response_language: str,
+    ) -> dict:
         short_term_actions = "\n".join(
             f"- {a.action} ({a.timeline})" for a in plan.short_term[:3]
         )
         success_metrics = "\n".join(f"- {m}" for m in plan.success_metrics[:3])
 
-        summary_response = await self.invoke_llm_async(
-            prompt_name="report_summary",
-            prompt_variables={
-                "customer_stated_problem": discovery.customer_stated_problem,
-                "identified_problem": discovery.identified_business_problem,
-                "problem_type": tree.problem_type.value,
-                "main_problem": tree.main_problem,
-                "short_term_actions": short_term_actions,
-                "success_metrics": success_metrics,
-                "response_language": response_language,
-            },
-        )
-        return summary_response.strip()
+        return {
+            "customer_stated_problem": discovery.customer_stated_problem,
+            "identified_problem": discovery.identified_business_problem,
+            "problem_type": tree.problem_type.value,
+            "main_problem": tree.main_problem,
+            "short_term_actions": short_term_actions,
+            "success_metrics": success_metrics,
+            "response_language": response_language,
+        }
 
     def _build_action_table(self, actions: list[ActionItem], labels: dict) -> str:
         """Convert action list to Markdown table with language-adaptive headers."""
@@ -9,7 +9,7 @@ from app.models.domain import (
     RiskLevel,
     StructuredProblemTree,
 )
-from app.utils import clean_llm_json_response
+from app.utils import clean_llm_json_response, parse_llm_json
 
 
 class RiskAgent(BaseAgent):
@@ -22,19 +22,12 @@ class RiskAgent(BaseAgent):
         problem_tree: StructuredProblemTree,
         response_language: str = "Turkish",
     ) -> RiskAnalysis:
-        risks_formatted = "\n".join(f"- {risk}" for risk in action_plan.risks)
+        variables = self._analysis_variables(action_plan, problem_tree, response_language)
+        if self.structured_output:
+            return self.invoke_structured("risk_analysis", variables, RiskAnalysis)
 
         analysis_response = self.invoke_llm(
-            prompt_name="risk_analysis",
-            prompt_variables={
-                "main_problem": problem_tree.main_problem,
-                "problem_type": problem_tree.problem_type.value,
-                "risks_list": risks_formatted,
-                "short_term_count": len(action_plan.short_term),
-                "mid_term_count": len(action_plan.mid_term),
-                "long_term_count": len(action_plan.long_term),
-                "response_language": response_language,
-            },
+            prompt_name="risk_analysis", prompt_variables=variables, validate=parse_llm_json
         )
         return self._parse_analysis(analysis_response, action_plan.risks)
 
@@ -44,22 +37,31 @@ class RiskAgent(BaseAgent):
         problem_tree: StructuredProblemTree,
         response_language: str = "Turkish",
     ) -> RiskAnalysis:
-        risks_formatted = "\n".join(f"- {risk}" for risk in action_plan.risks)
+        variables = self._analysis_variables(action_plan, problem_tree, response_language)
+        if self.structured_output:
+            return await self.invoke_structured_async("risk_analysis", variables, RiskAnalysis)
 
         analysis_response = await self.invoke_llm_async(
-            prompt_name="risk_analysis",
-            prompt_variables={
-                "main_problem": problem_tree.main_problem,
-                "problem_type": problem_tree.problem_type.value,
-                "risks_list": risks_formatted,
-                "short_term_count": len(action_plan.short_term),
-                "mid_term_count": len(action_plan.mid_term),
-                "long_term_count": len(action_plan.long_term),
-                "response_language": response_language,
-            },
+            prompt_name="risk_analysis", prompt_variables=variables, validate=parse_llm_json
         )
         return self._parse_analysis(analysis_response, action_plan.risks)
 
+    def _analysis_variables(
+        self,
+        action_plan: ActionPlan,
+        problem_tree: StructuredProblemTree,
+        response_language: str,
+    ) -> dict:
+        return {
+            "main_problem": problem_tree.main_problem,
+            "problem_type": problem_tree.problem_type.value,
+            "risks_list": "\n".join(f"- {risk}" for risk in action_plan.risks),
+            "short_term_count": len(action_plan.short_term),
+            "mid_term_count": len(action_plan.mid_term),
+            "long_term_count": len(action_plan.long_term),
+            "response_language": response_language,
+        }
+
     def _parse_analysis(self, llm_response: str, original_risks: list[str]) -> RiskAnalysis:
         try:
             cleaned = clean_llm_json_response(llm_response)
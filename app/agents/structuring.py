@@ -8,7 +8,7 @@ from app.models.domain import (
     ProblemType,
     StructuredProblemTree,
 )
-from app.utils import clean_llm_json_response
+from app.utils import clean_llm_json_response, parse_llm_json
 
 
 class StructuringAgent(BaseAgent):
@@ -18,33 +18,40 @@ class StructuringAgent(BaseAgent):
     def structure_problem(
         self, discovery_output: DiscoveryOutput, response_language: str = "Turkish"
     ) -> StructuredProblemTree:
+        variables = self._structuring_variables(discovery_output, response_language)
+        if self.structured_output:
+            return self.invoke_structured("structure_tree", variables, StructuredProblemTree)
+
         structuring_response = self.invoke_llm(
-            prompt_name="structure_tree",
-            prompt_variables={
-                "customer_stated_problem": discovery_output.customer_stated_problem,
-                "identified_business_problem": discovery_output.identified_business_problem,
-                "hidden_root_risk": discovery_output.hidden_root_risk,
-                "chat_summary": discovery_output.chat_summary,
-                "response_language": response_language,
-            },
+            prompt_name="structure_tree", prompt_variables=variables, validate=parse_llm_json
         )
         return self._parse_response(structuring_response)
 
     async def structure_problem_async(
         self, discovery_output: DiscoveryOutput, response_language: str = "Turkish"
     ) -> StructuredProblemTree:
+        variables = self._structuring_variables(discovery_output, response_language)
+        if self.structured_output:
+            return await self.invoke_structured_async(
+                "structure_tree", variables, StructuredProblemTree
+            )
+
         structuring_response = await self.invoke_llm_async(
-            prompt_name="structure_tree",
-            prompt_variables={
-                "customer_stated_problem": discovery_output.customer_stated_problem,
-                "identified_business_problem": discovery_output.identified_business_problem,
-                "hidden_root_risk": discovery_output.hidden_root_risk,
-                "chat_summary": discovery_output.chat_summary,
-                "response_language": response_language,
-            },
+            prompt_name="structure_tree", prompt_variables=variables, validate=parse_llm_json
         )
         return self._parse_response(structuring_response)
 
+    def _structuring_variables(
+        self, discovery_output: DiscoveryOutput, response_language: str
+    ) -> dict:
+        return {
+            "customer_stated_problem": discovery_output.customer_stated_problem,
+            "identified_business_problem": discovery_output.identified_business_problem,
+            "hidden_root_risk": discovery_output.hidden_root_risk,
+            "chat_summary": discovery_output.chat_summary,
+            "response_language": response_language,
+        }
+
     def _parse_response(self, llm_response: str) -> StructuredProblemTree:
         try:
             cleaned = clean_llm_json_response(llm_response)
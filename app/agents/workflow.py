@@ -1,3 +1,7 @@
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import lru_cache
 from typing import Literal, TypedDict
 
@@ -6,22 +10,57 @@ from langgraph.graph import END, StateGraph
 from pymongo import MongoClient
 
 from app.agents.action import ActionPlanAgent
+from app.agents.base import SyncTokenCallback, TokenCallback
 from app.agents.discovery import DiscoveryAgent
+from app.agents.executor import Stage, StageExecutor, partial_output_listener
 from app.agents.peer import PeerAgent
 from app.agents.report import ReportAgent
 from app.agents.risk import RiskAgent
 from app.agents.structuring import StructuringAgent
 from app.config import get_settings
+from app.logging import get_logger
 from app.models.domain import (
     ActionItem,
     ActionPlan,
     ConversationTurn,
     DiscoveryOutput,
+    DiscoverySession,
     IntentType,
     ProblemNode,
     ProblemType,
+    ResearchResult,
     StructuredProblemTree,
 )
+from app.stage_memo import get_stage_memo
+from app.utils import detect_language
+
+logger = get_logger()
+
+StageListener = Callable[[str, dict], None]
+TokenListener = Callable[[str, str], None]
+
+# Worker task başına set edilir; workflow instance'ı process'te paylaşıldığı için
+# listener instance'a değil çalışma context'ine bağlı
+_stage_listener: ContextVar[StageListener | None] = ContextVar("stage_listener", default=None)
+_token_listener: ContextVar[TokenListener | None] = ContextVar("token_listener", default=None)
+
+
+@contextmanager
+def stage_events(
+    listener: StageListener, on_token: TokenListener | None = None
+) -> Iterator[None]:
+    """
+    Bu blok içinde biten her workflow adımı için listener(stage, output) çağrılır.
+    `on_token` verilirse stream edilen LLM çıktıları (discovery sorusu, rapor
+    özeti) on_token(stage, text) ile iletilir.
+    """
+    stage_token = _stage_listener.set(listener)
+    token_token = _token_listener.set(on_token)
+    try:
+        yield
+    finally:
+        _token_listener.reset(token_token)
+        _stage_listener.reset(stage_token)
 
 
 class WorkflowState(TypedDict):
@@ -29,8 +68,11 @@ class WorkflowState(TypedDict):
     user_input: str
     language: str  # "Turkish" or "English" — detected by PeerAgent, propagated to all agents
     intent: str | None
+    intent_source: str | None  # "local" (lokal model) ya da "llm"; intent modeli eğitimi için
     peer_response: dict | None
+    pending_research: dict | None  # deferred Tavily task — worker'ı bloklamadan poller tamamlar
     discovery_question: str | None
+    discovery_session: dict | None  # DiscoverySession — rehydrated on every turn
     discovery_output: dict | None
     awaiting_user_input: bool
     problem_tree: dict | None
@@ -49,8 +91,11 @@ def create_initial_state(session_id: str, user_input: str) -> WorkflowState:
         user_input=user_input,
         language="Turkish",  # default, overridden by PeerAgent detection
         intent=None,
+        intent_source=None,
         peer_response=None,
+        pending_research=None,
         discovery_question=None,
+        discovery_session=None,
         discovery_output=None,
         awaiting_user_input=False,
         problem_tree=None,
@@ -66,24 +111,42 @@ def create_initial_state(session_id: str, user_input: str) -> WorkflowState:
 
 class AdvisorWorkflow:
 
-    def __init__(self, checkpointer: MongoDBSaver | None = None):
+    def __init__(
+        self, checkpointer: MongoDBSaver | None = None, defer_research: bool = False
+    ):
         self._peer_agent = PeerAgent()
         self._structuring_agent = StructuringAgent()
         self._action_plan_agent = ActionPlanAgent()
         self._risk_agent = RiskAgent()
         self._report_agent = ReportAgent()
-        self._discovery_agents: dict[str, DiscoveryAgent] = {}
+        self._discovery_agent = DiscoveryAgent()
         self._checkpointer = checkpointer
+        self._defer_research = defer_research
+        self._stage_executor = StageExecutor(
+            self._build_stages(),
+            on_error=self._set_error,
+            on_complete=self._on_stage_complete,
+            memo=get_stage_memo(),
+            early_start=get_settings().pipeline_early_start_enabled,
+        )
         self.graph = self._build_graph()
 
-    def _get_discovery_agent(self, session_id: str) -> DiscoveryAgent:
-        if session_id not in self._discovery_agents:
-            self._discovery_agents[session_id] = DiscoveryAgent()
-        return self._discovery_agents[session_id]
+    def _load_discovery_session(self, state: WorkflowState) -> DiscoverySession:
+        if state.get("discovery_session"):
+            return DiscoverySession(**state["discovery_session"])
+
+        # discovery_session alanından önce kaydedilmiş session'lar: turlar kayıp,
+        # ilk problem ve aktif soru state'ten kurtarılır
+        peer_response = state.get("peer_response") or {}
+        return DiscoverySession(
+            initial_problem=peer_response.get("original_input", state["user_input"]),
+            response_language=state.get("language", "Turkish"),
+            current_question=state.get("discovery_question") or "",
+        )
 
-    def _cleanup_session(self, session_id: str):
-        if session_id in self._discovery_agents:
-            del self._discovery_agents[session_id]
+    def _store_discovery_session(self, state: WorkflowState, session: DiscoverySession):
+        state["discovery_session"] = session.model_dump()
+        state["discovery_question"] = session.current_question
 
     def _enter_node(self, state: WorkflowState, node_name: str):
         if node_name not in state["agent_flow"]:
@@ -110,28 +173,114 @@ class AdvisorWorkflow:
         )
 
     def _to_action_plan(self, data: dict) -> ActionPlan:
+        # Risk stage'i sadece okuduğu alanları alır (Stage.fields), kalanlar boş
         return ActionPlan(
             short_term=[ActionItem(**a) for a in data["short_term"]],
             mid_term=[ActionItem(**a) for a in data["mid_term"]],
             long_term=[ActionItem(**a) for a in data["long_term"]],
-            quick_wins=data["quick_wins"],
+            quick_wins=data.get("quick_wins", []),
             risks=data["risks"],
-            success_metrics=data["success_metrics"],
+            success_metrics=data.get("success_metrics", []),
         )
 
+    def _emit_stage(self, stage_name: str, output: dict):
+        listener = _stage_listener.get()
+        if listener is None:
+            return
+
+        try:
+            listener(stage_name, output)
+        except Exception as listener_error:
+            # Progress event'i kaybolabilir, workflow durmamalı
+            logger.warning(f"Stage listener failed for {stage_name}: {listener_error}")
+
+    def _token_callback(self, stage_name: str) -> SyncTokenCallback | None:
+        listener = _token_listener.get()
+        if listener is None:
+            return None
+
+        def forward(text: str):
+            try:
+                listener(stage_name, text)
+            except Exception as listener_error:
+                logger.warning(f"Token listener failed for {stage_name}: {listener_error}")
+
+        return forward
+
+    def _async_token_callback(self, stage_name: str) -> TokenCallback | None:
+        # Listener'lar senkron ve hafif (token'lar buffer'lanır, async worker'da
+        # publish sadece kuyruğa ekler), loop'ta doğrudan çağrılır
+        forward = self._token_callback(stage_name)
+        if forward is None:
+            return None
+
+        async def forward_async(text: str):
+            forward(text)
+
+        return forward_async
+
+    def _on_stage_complete(self, state: WorkflowState, stage: Stage):
+        self._emit_stage(stage.name, state[stage.output_key])
+
+    def _emit_discovery(self, state: WorkflowState):
+        if state["awaiting_user_input"]:
+            output = {"question": state["discovery_question"], "awaiting_user_input": True}
+        else:
+            output = {"discovery_output": state["discovery_output"], "awaiting_user_input": False}
+        self._emit_stage("discovery", output)
+
     def _set_error(self, state: WorkflowState, agent: str, error: Exception):
         state["error"] = f"{agent} error: {str(error)}"
         state["is_complete"] = True
 
+    def _build_stages(self) -> list[Stage]:
+        # risk ve report sadece action_plan'e bağlı, birlikte çalışırlar; risk
+        # plandan dört alan okur ve plan stream edilirken başlayabilir
+        return [
+            Stage(
+                name="structuring",
+                output_key="problem_tree",
+                run=self._run_structuring,
+                run_async=self._run_structuring_async,
+                agent="StructuringAgent",
+                inputs=("discovery_output", "language"),
+            ),
+            Stage(
+                name="action_plan",
+                output_key="action_plan",
+                run=self._run_action_plan,
+                run_async=self._run_action_plan_async,
+                agent="ActionPlanAgent",
+                inputs=("problem_tree", "discovery_output", "language"),
+                depends_on=("structuring",),
+            ),
+            Stage(
+                name="risk",
+                output_key="risk_analysis",
+                run=self._run_risk,
+                run_async=self._run_risk_async,
+                agent="RiskAgent",
+                inputs=("action_plan", "problem_tree", "language"),
+                depends_on=("action_plan",),
+                fields={"action_plan": ("risks", "short_term", "mid_term", "long_term")},
+            ),
+            Stage(
+                name="report",
+                output_key="business_report",
+                run=self._run_report,
+                run_async=self._run_report_async,
+                agent="ReportAgent",
+                inputs=("discovery_output", "problem_tree", "action_plan", "language"),
+                depends_on=("action_plan",),
+            ),
+        ]
+
     def _build_graph(self) -> StateGraph:
         workflow = StateGraph(WorkflowState)
 
         workflow.add_node("peer", self._peer_node)
         workflow.add_node("discovery", self._discovery_node)
-        workflow.add_node("structuring", self._structuring_node)
-        workflow.add_node("action_plan", self._action_plan_node)
-        workflow.add_node("risk", self._risk_node)
-        workflow.add_node("report", self._report_node)
+        workflow.add_node("pipeline", self._pipeline_node)
 
         workflow.set_entry_point("peer")
 
@@ -144,13 +293,10 @@ class AdvisorWorkflow:
         workflow.add_conditional_edges(
             "discovery",
             self._route_after_discovery,
-            {"structuring": "structuring", "await_input": END, "end": END},
+            {"pipeline": "pipeline", "await_input": END, "end": END},
         )
 
-        workflow.add_edge("structuring", "action_plan")
-        workflow.add_edge("action_plan", "risk")
-        workflow.add_edge("risk", "report")
-        workflow.add_edge("report", END)
+        workflow.add_edge("pipeline", END)
 
         return workflow.compile(checkpointer=self._checkpointer)
 
@@ -158,128 +304,262 @@ class AdvisorWorkflow:
         self._enter_node(state, "peer")
 
         try:
-            peer_result = self._peer_agent.process(state["user_input"])
-            state["intent"] = peer_result["intent"]
-            state["language"] = peer_result.get("language", "Turkish")
-            state["peer_response"] = peer_result
+            peer_result = self._peer_agent.process(
+                state["user_input"],
+                defer_research=self._defer_research,
+                intent=self._known_intent(state),
+                intent_source=state.get("intent_source"),
+            )
+            self._apply_peer_result(state, peer_result)
+        except Exception as e:
+            self._set_error(state, "PeerAgent", e)
 
-            if peer_result["intent"] != IntentType.BUSINESS_PROBLEM.value:
-                state["is_complete"] = True
+        return state
+
+    async def _peer_node_async(self, state: WorkflowState) -> WorkflowState:
+        # Async modda research beklemesi loop'u bloklamaz, deferred moda gerek yok
+        self._enter_node(state, "peer")
 
+        try:
+            peer_result = await self._peer_agent.process_async(
+                state["user_input"],
+                intent=self._known_intent(state),
+                intent_source=state.get("intent_source"),
+            )
+            self._apply_peer_result(state, peer_result)
         except Exception as e:
             self._set_error(state, "PeerAgent", e)
 
         return state
 
+    @staticmethod
+    def _known_intent(state: WorkflowState) -> IntentType | None:
+        # API (WebSocket) sınıflandırdıysa worker aynı intent ile devam eder
+        return IntentType(state["intent"]) if state.get("intent") else None
+
+    def _apply_peer_result(self, state: WorkflowState, peer_result: dict):
+        state["intent"] = peer_result["intent"]
+        state["intent_source"] = peer_result.get("intent_source")
+        state["language"] = peer_result.get("language", "Turkish")
+        state["peer_response"] = peer_result
+
+        if peer_result.get("research_task_id"):
+            state["pending_research"] = {
+                "task_id": peer_result["research_task_id"],
+                "started_at": peer_result["research_started_at"],
+                "last_poll_at": time.time(),
+                "attempt": 0,
+                "timings": peer_result["research_timings"],
+                "query": state["user_input"],
+            }
+        elif peer_result["intent"] != IntentType.BUSINESS_PROBLEM.value:
+            state["is_complete"] = True
+
+        if not state["pending_research"]:
+            self._emit_stage("peer", peer_result)
+
     def _discovery_node(self, state: WorkflowState) -> WorkflowState:
         self._enter_node(state, "discovery")
 
         try:
-            discovery_agent = self._get_discovery_agent(state["session_id"])
-
             if state["discovery_question"] is None:
-                first_question = discovery_agent.start_discovery(
+                session = self._discovery_agent.new_session(
                     state["user_input"], language=state.get("language", "Turkish")
                 )
-                state["discovery_question"] = first_question
+                self._discovery_agent.start_discovery(
+                    session, on_token=self._token_callback("discovery")
+                )
+                self._store_discovery_session(state, session)
                 state["awaiting_user_input"] = True
             else:
-                discovery_result = discovery_agent.continue_discovery(state["user_input"])
+                self._advance_discovery(state, state["user_input"])
 
-                if isinstance(discovery_result, DiscoveryOutput):
-                    state["discovery_output"] = discovery_result.model_dump()
-                    state["awaiting_user_input"] = False
-                else:
-                    state["discovery_question"] = discovery_result
-                    state["awaiting_user_input"] = True
+            self._emit_discovery(state)
 
         except Exception as e:
             self._set_error(state, "DiscoveryAgent", e)
 
         return state
 
-    def _structuring_node(self, state: WorkflowState) -> WorkflowState:
-        self._enter_node(state, "structuring")
+    async def _discovery_node_async(self, state: WorkflowState) -> WorkflowState:
+        self._enter_node(state, "discovery")
+        on_token = self._async_token_callback("discovery")
 
         try:
-            if state["discovery_output"] is None:
-                self._set_error(state, "StructuringAgent", Exception("Discovery output missing"))
-                return state
+            if state["discovery_question"] is None:
+                session = self._discovery_agent.new_session(
+                    state["user_input"], language=state.get("language", "Turkish")
+                )
+                await self._discovery_agent.start_discovery_async(session, on_token=on_token)
+                self._store_discovery_session(state, session)
+                state["awaiting_user_input"] = True
+            else:
+                await self._advance_discovery_async(state, state["user_input"], on_token)
 
-            discovery_output = self._to_discovery_output(state["discovery_output"])
-            structured_tree = self._structuring_agent.structure_problem(
-                discovery_output, response_language=state.get("language", "Turkish")
-            )
-            state["problem_tree"] = structured_tree.model_dump()
+            self._emit_discovery(state)
 
         except Exception as e:
-            self._set_error(state, "StructuringAgent", e)
+            self._set_error(state, "DiscoveryAgent", e)
 
         return state
 
-    def _action_plan_node(self, state: WorkflowState) -> WorkflowState:
-        self._enter_node(state, "action_plan")
+    def _advance_discovery(self, state: WorkflowState, user_answer: str):
+        session = self._load_discovery_session(state)
+        discovery_result = self._discovery_agent.continue_discovery(
+            session, user_answer, on_token=self._token_callback("discovery")
+        )
+        self._store_discovery_session(state, session)
+        self._apply_discovery_result(state, discovery_result)
+
+    async def _advance_discovery_async(
+        self, state: WorkflowState, user_answer: str, on_token: TokenCallback | None
+    ):
+        session = self._load_discovery_session(state)
+        discovery_result = await self._discovery_agent.continue_discovery_async(
+            session, user_answer, on_token=on_token
+        )
+        self._store_discovery_session(state, session)
+        self._apply_discovery_result(state, discovery_result)
+
+    def _apply_discovery_result(
+        self, state: WorkflowState, discovery_result: str | DiscoveryOutput
+    ):
+        if isinstance(discovery_result, DiscoveryOutput):
+            state["discovery_output"] = discovery_result.model_dump()
+            state["awaiting_user_input"] = False
+        else:
+            state["awaiting_user_input"] = True
 
-        try:
-            if state["problem_tree"] is None:
-                self._set_error(state, "ActionPlanAgent", Exception("Problem tree missing"))
-                return state
+    def _pipeline_node(self, state: WorkflowState) -> WorkflowState:
+        return self.run_pipeline(state)
 
-            problem_tree = self._to_problem_tree(state["problem_tree"])
-            chat_summary = state["discovery_output"]["chat_summary"]
+    def pipeline_levels(self, state: WorkflowState) -> list[list[str]]:
+        return self._stage_executor.levels(state)
 
-            generated_plan = self._action_plan_agent.create_plan(
-                problem_tree, chat_summary, response_language=state.get("language", "Turkish")
-            )
-            state["action_plan"] = generated_plan.model_dump()
+    def run_stage(self, state: WorkflowState, stage_name: str) -> WorkflowState:
+        """Celery stage task'ı için tek pipeline adımı; hata çağırana fırlatılır."""
+        return self._stage_executor.run_stage(state, stage_name)
 
-        except Exception as e:
-            self._set_error(state, "ActionPlanAgent", e)
+    def stage_agent(self, stage_name: str) -> str:
+        return self._stage_executor.get_stage(stage_name).agent
 
+    def run_pipeline(self, state: WorkflowState) -> WorkflowState:
+        """Discovery sonrası structuring → action_plan → {risk, report}."""
+        state = self._stage_executor.execute(state)
+        if not state.get("error"):
+            state["is_complete"] = True
         return state
 
-    def _risk_node(self, state: WorkflowState) -> WorkflowState:
-        self._enter_node(state, "risk")
+    async def run_pipeline_async(self, state: WorkflowState) -> WorkflowState:
+        state = await self._stage_executor.execute_async(state)
+        if not state.get("error"):
+            state["is_complete"] = True
+        return state
 
-        try:
-            if state["action_plan"] is None:
-                self._set_error(state, "RiskAgent", Exception("Action plan missing"))
-                return state
+    def _run_structuring(self, state: WorkflowState) -> dict:
+        if state["discovery_output"] is None:
+            raise Exception("Discovery output missing")
 
-            action_plan = self._to_action_plan(state["action_plan"])
-            problem_tree = self._to_problem_tree(state["problem_tree"])
+        discovery_output = self._to_discovery_output(state["discovery_output"])
+        structured_tree = self._structuring_agent.structure_problem(
+            discovery_output, response_language=state.get("language", "Turkish")
+        )
+        return structured_tree.model_dump()
 
-            analyzed_risks = self._risk_agent.analyze_risks(
-                action_plan, problem_tree, response_language=state.get("language", "Turkish")
-            )
-            state["risk_analysis"] = analyzed_risks.model_dump()
+    async def _run_structuring_async(self, state: WorkflowState) -> dict:
+        if state["discovery_output"] is None:
+            raise Exception("Discovery output missing")
 
-        except Exception as e:
-            self._set_error(state, "RiskAgent", e)
+        discovery_output = self._to_discovery_output(state["discovery_output"])
+        structured_tree = await self._structuring_agent.structure_problem_async(
+            discovery_output, response_language=state.get("language", "Turkish")
+        )
+        return structured_tree.model_dump()
 
-        return state
+    def _run_action_plan(self, state: WorkflowState) -> dict:
+        if state["problem_tree"] is None:
+            raise Exception("Problem tree missing")
 
-    def _report_node(self, state: WorkflowState) -> WorkflowState:
-        self._enter_node(state, "report")
+        problem_tree = self._to_problem_tree(state["problem_tree"])
+        chat_summary = state["discovery_output"]["chat_summary"]
 
-        try:
-            discovery_output = self._to_discovery_output(state["discovery_output"])
-            problem_tree = self._to_problem_tree(state["problem_tree"])
-            action_plan = self._to_action_plan(state["action_plan"])
+        generated_plan = self._action_plan_agent.create_plan(
+            problem_tree,
+            chat_summary,
+            response_language=state.get("language", "Turkish"),
+            on_fields=partial_output_listener(),
+        )
+        return generated_plan.model_dump()
 
-            final_report = self._report_agent.generate_report(
-                discovery_output, problem_tree, action_plan,
-                response_language=state.get("language", "Turkish")
-            )
-            state["business_report"] = final_report.model_dump()
-            state["is_complete"] = True
+    async def _run_action_plan_async(self, state: WorkflowState) -> dict:
+        if state["problem_tree"] is None:
+            raise Exception("Problem tree missing")
 
-            self._cleanup_session(state["session_id"])
+        problem_tree = self._to_problem_tree(state["problem_tree"])
+        chat_summary = state["discovery_output"]["chat_summary"]
 
-        except Exception as e:
-            self._set_error(state, "ReportAgent", e)
+        generated_plan = await self._action_plan_agent.create_plan_async(
+            problem_tree,
+            chat_summary,
+            response_language=state.get("language", "Turkish"),
+            on_fields=partial_output_listener(),
+        )
+        return generated_plan.model_dump()
 
-        return state
+    def _run_risk(self, state: WorkflowState) -> dict:
+        if state["action_plan"] is None:
+            raise Exception("Action plan missing")
+
+        action_plan = self._to_action_plan(state["action_plan"])
+        problem_tree = self._to_problem_tree(state["problem_tree"])
+
+        analyzed_risks = self._risk_agent.analyze_risks(
+            action_plan, problem_tree, response_language=state.get("language", "Turkish")
+        )
+        return analyzed_risks.model_dump()
+
+    async def _run_risk_async(self, state: WorkflowState) -> dict:
+        if state["action_plan"] is None:
+            raise Exception("Action plan missing")
+
+        action_plan = self._to_action_plan(state["action_plan"])
+        problem_tree = self._to_problem_tree(state["problem_tree"])
+
+        analyzed_risks = await self._risk_agent.analyze_risks_async(
+            action_plan, problem_tree, response_language=state.get("language", "Turkish")
+        )
+        return analyzed_risks.model_dump()
+
+    def _run_report(self, state: WorkflowState) -> dict:
+        # Report risk_analysis okumaz, bu yüzden risk ile paralel çalışabilir
+        if state["action_plan"] is None:
+            raise Exception("Action plan missing")
+
+        discovery_output = self._to_discovery_output(state["discovery_output"])
+        problem_tree = self._to_problem_tree(state["problem_tree"])
+        action_plan = self._to_action_plan(state["action_plan"])
+
+        final_report = self._report_agent.generate_report(
+            discovery_output, problem_tree, action_plan,
+            response_language=state.get("language", "Turkish"),
+            on_token=self._token_callback("report"),
+        )
+        return final_report.model_dump()
+
+    async def _run_report_async(self, state: WorkflowState) -> dict:
+        if state["action_plan"] is None:
+            raise Exception("Action plan missing")
+
+        discovery_output = self._to_discovery_output(state["discovery_output"])
+        problem_tree = self._to_problem_tree(state["problem_tree"])
+        action_plan = self._to_action_plan(state["action_plan"])
+
+        final_report = await self._report_agent.generate_report_async(
+            discovery_output, problem_tree, action_plan,
+            response_language=state.get("language", "Turkish"),
+            on_token=self._async_token_callback("report"),
+        )
+        return final_report.model_dump()
 
     def _route_after_peer(self, state: WorkflowState) -> Literal["discovery", "end"]:
         if state.get("error"):
@@ -292,92 +572,163 @@ class AdvisorWorkflow:
 
     def _route_after_discovery(
         self, state: WorkflowState
-    ) -> Literal["structuring", "await_input", "end"]:
+    ) -> Literal["pipeline", "await_input", "end"]:
         if state.get("error"):
             return "end"
 
         if state["awaiting_user_input"]:
             return "await_input"
 
-        return "structuring"
+        return "pipeline"
 
-    def run(self, session_id: str, user_input: str) -> WorkflowState:
+    def run(
+        self,
+        session_id: str,
+        user_input: str,
+        intent: str | None = None,
+        intent_source: str | None = None,
+    ) -> WorkflowState:
+        """`intent` verilirse peer adımı mesajı tekrar sınıflandırmaz."""
         state = create_initial_state(session_id, user_input)
+        state["intent"] = intent
+        state["intent_source"] = intent_source
         config = {"configurable": {"thread_id": session_id}}
         return self.graph.invoke(state, config)
 
-    def continue_session(self, state: WorkflowState, user_answer: str) -> WorkflowState:
-        state["user_input"] = user_answer
-        response_lang = state.get("language", "Turkish")
+    async def run_async(
+        self,
+        session_id: str,
+        user_input: str,
+        intent: str | None = None,
+        intent_source: str | None = None,
+    ) -> WorkflowState:
+        """
+        Graph ile aynı akış (peer → discovery → pipeline), event loop üzerinde.
+        Async worker kullanır; checkpointer'a yazılmaz, session Redis'te tutulur.
+        """
+        state = create_initial_state(session_id, user_input)
+        state["intent"] = intent
+        state["intent_source"] = intent_source
+        state = await self._peer_node_async(state)
+        if self._route_after_peer(state) == "end":
+            return state
 
-        discovery_agent = self._get_discovery_agent(state["session_id"])
+        state = await self._discovery_node_async(state)
+        if self._route_after_discovery(state) != "pipeline":
+            return state
+
+        return await self.run_pipeline_async(state)
+
+    def complete_research(
+        self, state: WorkflowState, research_output: ResearchResult
+    ) -> WorkflowState:
+        """Deferred research sonucu geldiğinde peer cevabını tamamlar."""
+        query = state["pending_research"]["query"]
 
         try:
-            discovery_result = discovery_agent.continue_discovery(user_answer)
+            state["peer_response"] = {
+                **state["peer_response"],
+                **self._peer_agent.complete_business_info(query, research_output),
+            }
+            state["peer_response"].pop("research_task_id", None)
+            state["peer_response"].pop("research_started_at", None)
+            state["is_complete"] = True
+            self._emit_stage("peer", state["peer_response"])
         except Exception as e:
-            self._set_error(state, "DiscoveryAgent", e)
-            return state
+            self._set_error(state, "PeerAgent", e)
 
-        # Discovery still in progress
-        if not isinstance(discovery_result, DiscoveryOutput):
-            state["discovery_question"] = discovery_result
-            state["awaiting_user_input"] = True
-            return state
+        state["pending_research"] = None
+        return state
 
-        # Discovery complete — chain remaining agents with detected language
-        state["discovery_output"] = discovery_result.model_dump()
-        state["awaiting_user_input"] = False
+    def continue_session(
+        self, state: WorkflowState, user_answer: str, run_pipeline: bool = True
+    ) -> WorkflowState:
+        state["user_input"] = user_answer
 
-        # Structuring
         try:
-            structured_tree = self._structuring_agent.structure_problem(
-                discovery_result, response_language=response_lang
-            )
-            state["problem_tree"] = structured_tree.model_dump()
-            state["agent_flow"].append("structuring")
+            self._advance_discovery(state, user_answer)
+            self._emit_discovery(state)
         except Exception as e:
-            self._set_error(state, "StructuringAgent", e)
+            self._set_error(state, "DiscoveryAgent", e)
+            return state
+
+        # Discovery still in progress (ya da pipeline stage task'larına devredilecek)
+        if state["awaiting_user_input"] or not run_pipeline:
             return state
 
-        # ActionPlan
+        # Discovery complete — remaining agents run as a stage DAG
+        return self.run_pipeline(state)
+
+    async def start_session_async(
+        self, session_id: str, user_input: str, on_token: TokenCallback | None = None
+    ) -> WorkflowState:
+        """
+        API process'inde (WebSocket) çalışan giriş adımı: intent sınıflandırılır,
+        iş problemi ise ilk discovery sorusu üretilir. Diğer intent'ler için
+        state sadece intent ile döner — research/cevap worker'da yapılır.
+        """
+        state = create_initial_state(session_id, user_input)
+        self._enter_node(state, "peer")
+
         try:
-            generated_plan = self._action_plan_agent.create_plan(
-                structured_tree, discovery_result.chat_summary,
-                response_language=response_lang
+            intent, state["intent_source"] = await self._peer_agent.classify_intent_async(
+                user_input
             )
-            state["action_plan"] = generated_plan.model_dump()
-            state["agent_flow"].append("action_plan")
+            state["intent"] = intent.value
+            if intent != IntentType.BUSINESS_PROBLEM:
+                return state
+
+            peer_result = {
+                "intent": intent.value,
+                "intent_source": state["intent_source"],
+                "language": detect_language(user_input),
+                **self._peer_agent.handle_business_problem(user_input),
+            }
+            state["language"] = peer_result["language"]
+            state["peer_response"] = peer_result
+            self._emit_stage("peer", peer_result)
         except Exception as e:
-            self._set_error(state, "ActionPlanAgent", e)
+            self._set_error(state, "PeerAgent", e)
             return state
 
-        # Risk
+        self._enter_node(state, "discovery")
         try:
-            analyzed_risks = self._risk_agent.analyze_risks(
-                generated_plan, structured_tree, response_language=response_lang
-            )
-            state["risk_analysis"] = analyzed_risks.model_dump()
-            state["agent_flow"].append("risk")
+            session = self._discovery_agent.new_session(user_input, language=state["language"])
+            await self._discovery_agent.start_discovery_async(session, on_token=on_token)
+            self._store_discovery_session(state, session)
+            state["awaiting_user_input"] = True
+            self._emit_discovery(state)
         except Exception as e:
-            self._set_error(state, "RiskAgent", e)
-            return state
+            self._set_error(state, "DiscoveryAgent", e)
+
+        return state
+
+    async def continue_session_async(
+        self,
+        state: WorkflowState,
+        user_answer: str,
+        on_token: TokenCallback | None = None,
+        run_pipeline: bool = False,
+    ) -> WorkflowState:
+        """
+        Tek discovery turu. WebSocket'te pipeline çalışmaz, worker'a devredilir;
+        async worker `run_pipeline=True` ile discovery bitince pipeline'ı da çalıştırır.
+        """
+        state["user_input"] = user_answer
 
-        # Report
         try:
-            final_report = self._report_agent.generate_report(
-                discovery_result, structured_tree, generated_plan,
-                response_language=response_lang
+            await self._advance_discovery_async(
+                state, user_answer, on_token or self._async_token_callback("discovery")
             )
-            state["business_report"] = final_report.model_dump()
-            state["agent_flow"].append("report")
+            self._emit_discovery(state)
         except Exception as e:
-            self._set_error(state, "ReportAgent", e)
+            self._set_error(state, "DiscoveryAgent", e)
             return state
 
-        state["is_complete"] = True
-        self._cleanup_session(state["session_id"])
+        if not run_pipeline or state["awaiting_user_input"]:
+            return state
 
-        return state
+        return await self.run_pipeline_async(state)
 
 
 def create_workflow_with_checkpointer() -> AdvisorWorkflow:
@@ -385,7 +736,10 @@ def create_workflow_with_checkpointer() -> AdvisorWorkflow:
     client = MongoClient(settings.mongodb_uri)
     db = client[settings.mongodb_database]
     checkpointer = MongoDBSaver(db)
-    return AdvisorWorkflow(checkpointer=checkpointer)
+    return AdvisorWorkflow(
+        checkpointer=checkpointer,
+        defer_research=settings.tavily_research_mode == "deferred",
+    )
 
 
 @lru_cache(maxsize=1)
@@ -0,0 +1,306 @@
+"""
+Async worker: tek process'te çok sayıda session.
+
+Celery worker'ı her task için bir process/thread slotu tutar; session'ların
+çoğu LLM ve Tavily cevabı beklediği için slotlar boşta bekler. Bu worker
+job'ları Redis listesinden alır ve her birini event loop'ta bir coroutine
+olarak çalıştırır. Eşzamanlı session sayısı `async_worker_max_sessions`,
+provider başına LLM çağrısı `llm_provider_concurrency` ile sınırlıdır.
+
+Kısa işler (sınıflandırma, discovery turu) ayrı bir listeden önce alınır;
+`async_worker_fast_reserved_sessions` kadar slot pipeline işlerine verilmez.
+
+Sonuçlar Celery result backend'ine aynı formatta yazılır; API tarafında
+GET /v1/tasks/{task_id}, SSE ve long-poll değişmeden çalışır.
+
+Alınan job kuyruktan silinmez, worker'ın processing listesine taşınır (LMOVE)
+ve sonuç yazılınca listeden düşülür. Process çökerse job'lar kaybolmaz; aynı
+`async_worker_id` ile açılan worker başlarken onları kuyruğun başına geri koyar.
+
+Çalıştırma (WORKER_MODE=async):
+    python -m app.async_worker
+"""
+
+import asyncio
+import json
+import signal
+import time
+
+from celery import states
+
+from app.agents.workflow import AdvisorWorkflow, get_advisor_workflow, stage_events
+from app.cache import AsyncRedisCache, get_async_redis_cache
+from app.config import get_settings
+from app.db import get_mongodb_service
+from app.events import AsyncTaskEventPublisher
+from app.logging import LogContext, get_logger
+from app.metrics import get_metrics
+from app.worker import (
+    _event_listeners,
+    _set_task_status,
+    build_conversation_log,
+    celery_app,
+)
+
+settings = get_settings()
+logger = get_logger()
+
+
+def build_job(
+    task_id: str,
+    session_id: str,
+    task: str,
+    existing_state: dict | None = None,
+    lane: str = "fast",
+    intent: str | None = None,
+    intent_source: str | None = None,
+) -> str:
+    return json.dumps(
+        {
+            "task_id": task_id,
+            "session_id": session_id,
+            "task": task,
+            "existing_state": existing_state,
+            "lane": lane,
+            "intent": intent,
+            "intent_source": intent_source,
+            "enqueued_at": time.time(),
+        },
+        ensure_ascii=False,
+    )
+
+
+async def enqueue_job(
+    cache: AsyncRedisCache,
+    task_id: str,
+    session_id: str,
+    task: str,
+    existing_state: dict | None = None,
+    lane: str = "fast",
+    intent: str | None = None,
+    intent_source: str | None = None,
+):
+    queue = settings.async_worker_fast_queue if lane == "fast" else settings.async_worker_queue
+    await cache.client.rpush(
+        queue,
+        build_job(task_id, session_id, task, existing_state, lane, intent, intent_source),
+    )
+
+
+class AsyncWorker:
+    def __init__(
+        self,
+        workflow: AdvisorWorkflow,
+        cache: AsyncRedisCache,
+        queue: str,
+        fast_queue: str,
+        max_sessions: int = 200,
+        fast_reserved_sessions: int = 20,
+        worker_id: str = "default",
+        idle_poll_timeout: float = 0.25,
+    ):
+        self._workflow = workflow
+        self._cache = cache
+        self._queue = queue
+        self._fast_queue = fast_queue
+        self._processing_queue = f"{queue}:processing:{worker_id}"
+        self._slots = asyncio.Semaphore(max_sessions)
+        self._bulk_limit = max(max_sessions - fast_reserved_sessions, 1)
+        self._bulk_running = 0
+        self._idle_poll_timeout = idle_poll_timeout
+        self._running: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def serve(self):
+        await self._requeue_unfinished()
+        logger.info(f"Async worker listening on '{self._fast_queue}', '{self._queue}'")
+
+        while not self._stopping.is_set():
+            # Slot yoksa kuyruktan alma: bekleyen job başka worker'a kalsın
+            await self._slots.acquire()
+            try:
+                raw_job = await self._take_job()
+            except Exception:
+                self._slots.release()
+                raise
+
+            if raw_job is None:
+                self._slots.release()
+                continue
+
+            job = json.loads(raw_job)
+            if job.get("lane") == "bulk":
+                self._bulk_running += 1
+            job_task = asyncio.create_task(self._run_job(job, raw_job))
+            self._running.add(job_task)
+            job_task.add_done_callback(self._running.discard)
+
+        if self._running:
+            logger.info(f"Draining {len(self._running)} running sessions")
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _poll_queues(self) -> list[str]:
+        # Listeler sırayla denenir: fast her zaman önce. Bulk kotası doluysa
+        # kalan slotlar sadece fast işlere açık.
+        if self._bulk_running >= self._bulk_limit:
+            return [self._fast_queue]
+        return [self._fast_queue, self._queue]
+
+    async def _take_job(self) -> str | None:
+        """
+        Job'u processing listesine taşıyarak alır. BLMOVE tek liste dinlediği
+        için önce bloklamadan sırayla bakılır; hepsi boşsa fast listesinde kısa
+        süre beklenir (bulk job en fazla `idle_poll_timeout` gecikir).
+        """
+        client = self._cache.client
+        for queue in self._poll_queues():
+            raw_job = await client.lmove(queue, self._processing_queue, "LEFT", "RIGHT")
+            if raw_job is not None:
+                return raw_job
+
+        return await client.blmove(
+            self._fast_queue, self._processing_queue, self._idle_poll_timeout, "LEFT", "RIGHT"
+        )
+
+    async def _requeue_unfinished(self):
+        """Önceki process'in bitiremediği job'lar kendi lane'lerinin başına döner."""
+        client = self._cache.client
+        unfinished = await client.lrange(self._processing_queue, 0, -1)
+        if not unfinished:
+            return
+
+        pipe = client.pipeline(transaction=True)
+        for raw_job in reversed(unfinished):
+            lane = json.loads(raw_job).get("lane", "fast")
+            pipe.lpush(self._fast_queue if lane == "fast" else self._queue, raw_job)
+        pipe.delete(self._processing_queue)
+        await pipe.execute()
+        logger.warning(f"Requeued {len(unfinished)} unfinished jobs from {self._processing_queue}")
+
+    async def _run_job(self, job: dict, raw_job: str):
+        if "enqueued_at" in job:
+            await asyncio.to_thread(
+                get_metrics().observe,
+                f"queue_wait:{job.get('lane', 'fast')}",
+                max(time.time() - job["enqueued_at"], 0.0),
+            )
+        started_at = time.monotonic()
+        try:
+            result = await self.process(
+                job["task_id"],
+                job["session_id"],
+                job["task"],
+                job.get("existing_state"),
+                intent=job.get("intent"),
+                intent_source=job.get("intent_source"),
+            )
+            await asyncio.to_thread(self._store_result, job["task_id"], result)
+            # Sonuç yazıldı: job artık tekrar çalıştırılmamalı
+            await self._cache.client.lrem(self._processing_queue, 1, raw_job)
+            await asyncio.to_thread(
+                get_metrics().observe,
+                f"task_runtime:{job.get('lane', 'fast')}",
+                time.monotonic() - started_at,
+            )
+        finally:
+            if job.get("lane") == "bulk":
+                self._bulk_running -= 1
+            self._slots.release()
+
+    async def process(
+        self,
+        task_id: str,
+        session_id: str,
+        task: str,
+        existing_state: dict | None = None,
+        intent: str | None = None,
+        intent_source: str | None = None,
+    ) -> dict:
+        """process_agent_task'ın async karşılığı; aynı sonuç formatı."""
+        with LogContext(session_id=session_id, agent="async_worker"):
+            await asyncio.to_thread(_set_task_status, task_id)
+            publisher = AsyncTaskEventPublisher(self._cache)
+
+            try:
+                with stage_events(*_event_listeners(task_id, publisher)):
+                    if existing_state and existing_state.get("awaiting_user_input"):
+                        logger.info(f"Continuing discovery: {task[:50]}...")
+                        state = await self._workflow.continue_session_async(
+                            existing_state, task, run_pipeline=True
+                        )
+                    elif existing_state and existing_state.get("discovery_output"):
+                        logger.info("Resuming pipeline")
+                        state = await self._workflow.run_pipeline_async(existing_state)
+                    else:
+                        logger.info(f"New task: {task[:50]}...")
+                        state = await self._workflow.run_async(
+                            session_id, task, intent=intent, intent_source=intent_source
+                        )
+
+                if state.get("error") or state["awaiting_user_input"]:
+                    # Hatalı session resume için saklanır
+                    await self._cache.save_session(
+                        session_id, dict(state), settings.session_ttl_seconds
+                    )
+                elif state["is_complete"] and existing_state:
+                    await self._cache.delete_session(session_id)
+
+                if state["is_complete"]:
+                    await self._persist(session_id, task, state)
+
+                logger.info(f"Task completed - intent: {state['intent']}")
+                return {"success": True, "session_id": session_id, "state": dict(state)}
+
+            except Exception as e:
+                logger.error(f"Task failed: {str(e)}")
+                return {"success": False, "session_id": session_id, "error": str(e)}
+
+            finally:
+                # Stage/token event'leri terminal status'tan önce gitmeli
+                await publisher.aclose()
+
+    async def _persist(self, session_id: str, user_input: str, state: dict):
+        try:
+            conversation = build_conversation_log(session_id, user_input, state)
+            result = await get_mongodb_service().log_conversation(conversation)
+            logger.info(f"Session persisted to MongoDB: {result}")
+        except Exception as persist_error:
+            logger.warning(f"MongoDB persist failed: {persist_error}")
+
+    @staticmethod
+    def _store_result(task_id: str, result: dict):
+        # Önce sonuç, sonra status: API terminal status'u görünce sonucu okur
+        celery_app.backend.store_result(task_id, result, states.SUCCESS)
+        _set_task_status(task_id, result)
+
+
+async def main():
+    cache = get_async_redis_cache()
+    if not await cache.connect():
+        raise SystemExit("Redis connection failed")
+
+    worker = AsyncWorker(
+        workflow=get_advisor_workflow(),
+        cache=cache,
+        queue=settings.async_worker_queue,
+        fast_queue=settings.async_worker_fast_queue,
+        max_sessions=settings.async_worker_max_sessions,
+        fast_reserved_sessions=settings.async_worker_fast_reserved_sessions,
+        worker_id=settings.async_worker_id,
+    )
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+
+    try:
+        await worker.serve()
+    finally:
+        await cache.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,14 +1,44 @@
 
 import json
+import time
 from functools import lru_cache
 
 from redis import Redis
+from redis.asyncio import BlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis
 
 from app.config import get_settings
 from app.logging import get_logger
 
 logger = get_logger()
 
+SESSION_KEY_PREFIX = "session:"
+TASK_STATUS_PREFIX = "task_status:"
+CELERY_RESULT_PREFIX = "celery-task-meta-"  # Celery Redis backend'inin key formatı
+
+
+# Sync (worker) ve async (API) store aynı key/format'ı kullanır
+def session_key(session_id: str) -> str:
+    return f"{SESSION_KEY_PREFIX}{session_id}"
+
+
+def serialize_session(state: dict) -> str:
+    return json.dumps(state)
+
+
+def deserialize_session(data: str | None) -> dict | None:
+    if data:
+        return json.loads(data)
+    return None
+
+
+def task_status_key(task_id: str) -> str:
+    return f"{TASK_STATUS_PREFIX}{task_id}"
+
+
+def task_result_key(task_id: str) -> str:
+    return f"{CELERY_RESULT_PREFIX}{task_id}"
+
 
 class RedisCache:
 
@@ -48,37 +78,201 @@ class RedisCache:
     def client(self) -> Redis | None:
         return self._client
 
-    def _session_key(self, session_id: str) -> str:
-        return f"session:{session_id}"
-
     def save_session(self, session_id: str, state: dict, ttl_seconds: int = 3600):
         if self._client is None:
             return
 
-        self._client.setex(
-            self._session_key(session_id), ttl_seconds, json.dumps(state)
-        )
+        self._client.setex(session_key(session_id), ttl_seconds, serialize_session(state))
 
     def get_session(self, session_id: str) -> dict | None:
         if self._client is None:
             return None
 
-        data = self._client.get(self._session_key(session_id))
-        if data:
-            return json.loads(data)
-        return None
+        return deserialize_session(self._client.get(session_key(session_id)))
 
     def delete_session(self, session_id: str):
         if self._client is None:
             return
 
-        self._client.delete(self._session_key(session_id))
+        self._client.delete(session_key(session_id))
 
     def session_exists(self, session_id: str) -> bool:
         if self._client is None:
             return False
 
-        return self._client.exists(self._session_key(session_id)) > 0
+        return self._client.exists(session_key(session_id)) > 0
+
+    def set_task_status(
+        self, task_id: str, status: str, error: str | None = None, ttl_seconds: int = 3600
+    ):
+        """Polling için küçük status kaydı; ağır sonuç Celery backend'inde kalır."""
+        if self._client is None:
+            return
+
+        record = {"status": status, "updated_at": time.time()}
+        if error:
+            record["error"] = error
+
+        pipe = self._client.pipeline()
+        pipe.hset(task_status_key(task_id), mapping=record)
+        pipe.expire(task_status_key(task_id), ttl_seconds)
+        pipe.execute()
+
+    def get_task_status(self, task_id: str) -> str | None:
+        if self._client is None:
+            return None
+
+        return self._client.hget(task_status_key(task_id), "status")
+
+
+class AsyncRedisCache:
+    """
+    API process'i için asyncio-native session store.
+
+    Handler'lar event loop'u bloklamasın diye redis.asyncio kullanır. Pool
+    sınırlı (BlockingConnectionPool): bağlantı dolunca istek `pool_timeout`
+    kadar sıra bekler, Redis'e sınırsız bağlantı açılmaz.
+
+    SSE ve long-poll pub/sub abonelikleri dakikalarca bağlantı tuttuğu için
+    ayrı bir pool kullanır; en fazla `max_subscribers` abonelik açılır, fazlası
+    reddedilir. Böylece açık stream'ler session/status okumalarını aç bırakmaz.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        max_connections: int = 50,
+        pool_timeout: float = 5.0,
+        max_subscribers: int = 200,
+    ):
+        self._client: AsyncRedis | None = None
+        self._subscriber_client: AsyncRedis | None = None
+        self._redis_url = redis_url
+        self._max_connections = max_connections
+        self._pool_timeout = pool_timeout
+        self._max_subscribers = max_subscribers
+        self._subscribers = 0
+
+    async def connect(self) -> bool:
+        if self._client is not None:
+            return True
+
+        try:
+            pool = BlockingConnectionPool.from_url(
+                self._redis_url,
+                max_connections=self._max_connections,
+                timeout=self._pool_timeout,
+                decode_responses=True,
+            )
+            self._client = AsyncRedis(connection_pool=pool)
+            await self._client.ping()
+            # Slot sayısı kadar bağlantı: abonelik pool'da hiç sıra beklemez
+            subscriber_pool = BlockingConnectionPool.from_url(
+                self._redis_url,
+                max_connections=self._max_subscribers,
+                timeout=self._pool_timeout,
+                decode_responses=True,
+            )
+            self._subscriber_client = AsyncRedis(connection_pool=subscriber_pool)
+            logger.info("Async Redis connection established")
+            return True
+        except Exception as conn_error:
+            logger.warning(f"Async Redis connection failed: {conn_error}")
+            await self.close()
+            return False
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        if self._subscriber_client:
+            await self._subscriber_client.aclose()
+            self._subscriber_client = None
+
+    async def is_connected(self) -> bool:
+        if self._client is None:
+            return False
+        try:
+            await self._client.ping()
+            return True
+        except Exception:
+            return False
+
+    @property
+    def client(self) -> AsyncRedis | None:
+        return self._client
+
+    def acquire_subscriber(self) -> AsyncRedis | None:
+        """
+        Pub/sub aboneliği için slot + client; limit doluysa ya da bağlantı
+        yoksa None. Alınan her slot `release_subscriber` ile bırakılmalı.
+        """
+        if self._subscriber_client is None or self._subscribers >= self._max_subscribers:
+            return None
+        self._subscribers += 1
+        return self._subscriber_client
+
+    def release_subscriber(self):
+        self._subscribers = max(self._subscribers - 1, 0)
+
+    async def save_session(self, session_id: str, state: dict, ttl_seconds: int = 3600):
+        if self._client is None:
+            return
+
+        await self._client.setex(session_key(session_id), ttl_seconds, serialize_session(state))
+
+    async def get_session(self, session_id: str) -> dict | None:
+        if self._client is None:
+            return None
+
+        return deserialize_session(await self._client.get(session_key(session_id)))
+
+    async def delete_session(self, session_id: str):
+        if self._client is None:
+            return
+
+        await self._client.delete(session_key(session_id))
+
+    async def session_exists(self, session_id: str) -> bool:
+        if self._client is None:
+            return False
+
+        return await self._client.exists(session_key(session_id)) > 0
+
+    async def claim_session_resume(self, session_id: str, ttl_seconds: int = 30) -> bool:
+        """
+        Aynı session'ı aynı anda tek istek resume eder; kilidi alan True döner.
+        TTL, kilidi bırakamadan ölen istek için. Bağlantı yoksa session da
+        okunamaz (404), kilit aranmaz.
+        """
+        if self._client is None:
+            return True
+
+        return bool(
+            await self._client.set(f"{session_key(session_id)}:resume", "1", nx=True, ex=ttl_seconds)
+        )
+
+    async def release_session_resume(self, session_id: str):
+        if self._client is None:
+            return
+
+        await self._client.delete(f"{session_key(session_id)}:resume")
+
+    async def get_task_status(self, task_id: str) -> dict | None:
+        if self._client is None:
+            return None
+
+        return await self._client.hgetall(task_status_key(task_id)) or None
+
+    async def get_task_result(self, task_id: str) -> dict | None:
+        """Celery result meta'sı ({"status", "result", ...}); yoksa None."""
+        if self._client is None:
+            return None
+
+        data = await self._client.get(task_result_key(task_id))
+        if data:
+            return json.loads(data)
+        return None
 
 
 @lru_cache(maxsize=1)
@@ -86,3 +280,14 @@ def get_redis_cache() -> RedisCache:
     settings = get_settings()
     return RedisCache(settings.redis_url)
 
+
+@lru_cache(maxsize=1)
+def get_async_redis_cache() -> AsyncRedisCache:
+    settings = get_settings()
+    return AsyncRedisCache(
+        settings.redis_url,
+        max_connections=settings.redis_async_max_connections,
+        pool_timeout=settings.redis_async_pool_timeout,
+        max_subscribers=settings.redis_async_max_subscribers,
+    )
+
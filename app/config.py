@@ -1,5 +1,7 @@
+import warnings
 from functools import lru_cache
 
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -11,14 +13,121 @@ class Settings(BaseSettings):
     anthropic_api_key: str
     google_api_key: str
     tavily_api_key: str
-    tavily_polling_interval: int = 3
+    tavily_poll_first_delay: float = 0.5
+    tavily_poll_fast_probes: int = 2
+    tavily_poll_backoff: float = 1.6
+    tavily_poll_max_interval: float = 8.0
+    tavily_poll_jitter: float = 0.2
+    tavily_poll_deadline_seconds: float = 180.0
     tavily_max_polling_attempts: int = 60
+    # Eski sabit aralık; verilirse adaptif polling'in üst sınırına çevrilir
+    tavily_polling_interval: float | None = None
+    research_cache_enabled: bool = True
+    research_cache_ttl_seconds: int = 21600
+    research_cache_similarity_threshold: float = 0.8
+    tavily_api_base_url: str | None = None
+    tavily_research_mode: str = "blocking"  # blocking, deferred
+    intent_model_path: str | None = None  # python -m app.intent_model train çıktısı
+    intent_confidence_threshold: float = 0.9
+    # Uzun research içeriği parçalara bölünüp paralel özetlenir, sonra birleştirilir
+    peer_map_reduce_enabled: bool = True
+    peer_map_reduce_min_chars: int = 16000  # altında tek peer_summarize çağrısı
+    peer_chunk_chars: int = 6000
+    peer_map_max_parallel: int = 8
     discovery_min_questions: int = 3
     discovery_max_questions: int = 5
+    # Soru prompt'unda eski turlar özetlenir, son K tur aynen kalır
+    discovery_summary_enabled: bool = True
+    discovery_verbatim_turns: int = 2
+    discovery_summary_min_chars: int = 1200  # daha kısa eski turlar özetlenmeye değmez
+    discovery_history_token_budget: int = 1500
     mongodb_uri: str = "mongodb://localhost:27017"
     mongodb_database: str = "business_advisor"
     redis_url: str = "redis://localhost:6379/0"
+    redis_async_max_connections: int = 50  # API process'inin async pool limiti
+    redis_async_pool_timeout: float = 5.0
+    # SSE + long-poll aboneliği üst sınırı; ayrı pool, dolunca 503 / anlık cevap
+    redis_async_max_subscribers: int = 200
     session_ttl_seconds: int = 3600
+    worker_mode: str = "celery"  # celery, async (python -m app.async_worker)
+    async_worker_queue: str = "async_agent_tasks"
+    async_worker_max_sessions: int = 200
+    # Async modda kısa işler ayrı listeden önce alınır; bu kadar slot bulk'a verilmez
+    async_worker_fast_queue: str = "async_agent_tasks:fast"
+    async_worker_fast_reserved_sessions: int = 20
+    # Processing listesinin adı; restart'ta aynı kalmalı, worker'lar arasında tekil olmalı
+    async_worker_id: str = "default"
+    # Pipeline stage'leri ayrı Celery task'ları olarak (chain/group) çalışır
+    celery_split_stages: bool = True
+    celery_stage_max_retries: int = 2
+    celery_stage_queues: dict[str, str] = {
+        "peer": "peer",
+        "discovery": "discovery",
+        "pipeline": "pipeline",
+        "structuring": "structuring",
+        "action_plan": "action_plan",
+        "risk": "risk",
+        "report": "report",
+    }
+    # Queue -> lane. Fast lane (sınıflandırma, discovery turu) ayrı worker havuzunda
+    # çalışır; bulk lane'deki uzun pipeline'lar birikse de kısa cevaplar beklemez
+    celery_queue_lanes: dict[str, str] = {
+        "celery": "fast",
+        "peer": "fast",
+        "discovery": "fast",
+        "pipeline": "bulk",
+        "structuring": "bulk",
+        "action_plan": "bulk",
+        "risk": "bulk",
+        "report": "bulk",
+    }
+    # Tahmini queue beklemesi lane SLO'sunu aşarsa yeni session 503 + Retry-After alır
+    admission_control_enabled: bool = True
+    admission_slo_seconds: dict[str, float] = {"fast": 15.0, "bulk": 120.0}
+    # Lane'i tüketen toplam Celery slotu (docker-compose: worker 4, worker-pipeline 8)
+    admission_lane_concurrency: dict[str, int] = {"fast": 4, "bulk": 8}
+    admission_quantile: float = 0.95
+    admission_min_samples: int = 20
+    stage_memo_enabled: bool = True  # stage çıktıları girdi hash'i ile saklanır (resume için)
+    stage_memo_ttl_seconds: int = 86400
+    # Action plan stream edilir; risk, okuduğu alanlar kapanınca plan bitmeden başlar.
+    # Risk vadelerin hepsini okuduğu için kazanç sadece success_metrics kadar: kapalı
+    pipeline_early_start_enabled: bool = False
+    task_events_keepalive_seconds: float = 15.0  # SSE stream'inde boşta keep-alive aralığı
+    task_events_stream_timeout_seconds: float = 600.0
+    task_long_poll_max_seconds: int = 30  # GET /v1/tasks/{id}?wait=N üst sınırı
+    # JSON üreten agent'lar provider'ın schema'ya bağlı çıktısını kullanır (regex parse yok)
+    llm_structured_output_enabled: bool = True
+    llm_cache_enabled: bool = False  # prompt YAML'da ayrıca `cache: true` gerekli
+    llm_cache_max_local_entries: int = 512
+    llm_cache_max_redis_entries: int = 10000
+    # Async modda provider başına eşzamanlı LLM çağrısı (JSON: {"openai": 64, ...})
+    llm_provider_concurrency: dict[str, int] = {
+        "openai": 64,
+        "anthropic": 32,
+        "google": 64,
+        "default": 16,
+    }
+    # Worker'lar arası provider limiti; "provider" ya da "provider:model" key'li
+    llm_rate_limit_enabled: bool = True
+    llm_rate_limits: dict[str, dict[str, int]] = {
+        "openai": {"rpm": 500, "tpm": 500000},
+        "anthropic": {"rpm": 50, "tpm": 50000},
+        "google": {"rpm": 1000, "tpm": 1000000},
+    }
+    # Hedged request: birincil model prompt'un p95'ini aşarsa yedek modele de istek atılır
+    llm_hedging_enabled: bool = True
+    llm_hedge_quantile: float = 0.95
+    llm_hedge_min_samples: int = 20  # bu kadar latency örneği birikmeden hedge yok
+    llm_hedge_min_delay_seconds: float = 2.0
+    llm_hedge_backups: dict[str, str] = {
+        "anthropic:claude-sonnet-4-5-20250929": "openai:gpt-5.1",
+        "openai:gpt-5.1": "anthropic:claude-sonnet-4-5-20250929",
+        "google:gemini-2.5-flash": "openai:gpt-5.1",
+    }
+    singleflight_enabled: bool = True  # aynı anda gelen özdeş research/LLM isteklerini birleştir
+    singleflight_lease_seconds: int = 120
+    singleflight_result_ttl_seconds: int = 15
     app_env: str = "development"  # development, production, testing
     debug: bool = True
     log_level: str = "INFO"
@@ -27,6 +136,24 @@ class Settings(BaseSettings):
     rate_limit_tasks: str = "60/minute"
     rate_limit_sessions: str = "30/minute"
 
+    @model_validator(mode="after")
+    def _map_deprecated_polling_interval(self) -> "Settings":
+        if self.tavily_polling_interval is None:
+            return self
+
+        warnings.warn(
+            "TAVILY_POLLING_INTERVAL is deprecated, use TAVILY_POLL_MAX_INTERVAL "
+            "and TAVILY_POLL_FIRST_DELAY",
+            FutureWarning,
+        )
+        if "tavily_poll_max_interval" not in self.model_fields_set:
+            self.tavily_poll_max_interval = self.tavily_polling_interval
+        if "tavily_poll_first_delay" not in self.model_fields_set:
+            self.tavily_poll_first_delay = min(
+                self.tavily_poll_first_delay, self.tavily_polling_interval
+            )
+        return self
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import threading
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio.client import PubSub
+
+from app.cache import AsyncRedisCache, RedisCache, get_redis_cache
+from app.logging import get_logger
+
+logger = get_logger()
+
+EVENTS_PREFIX = "task_events:"
+TERMINAL_STATUSES = {"completed", "failed"}
+
+
+def task_events_key(task_id: str) -> str:
+    return f"{EVENTS_PREFIX}{task_id}"
+
+
+def task_events_channel(task_id: str) -> str:
+    return f"{EVENTS_PREFIX}{task_id}:live"
+
+
+def is_terminal(event: dict) -> bool:
+    return event["event"] == "status" and event["data"].get("status") in TERMINAL_STATUSES
+
+
+def format_sse(event: dict) -> str:
+    payload = json.dumps(event["data"], ensure_ascii=False)
+    return f"id: {event['seq']}\nevent: {event['event']}\ndata: {payload}\n\n"
+
+
+class TaskEventPublisher:
+    """
+    Worker tarafı: task ilerleme event'lerini yayınlar.
+
+    Her event sıra numarası (seq) alır, replay için bir listeye eklenir ve
+    pub/sub kanalına basılır. Geç bağlanan client önce listeyi okur, sonra
+    kanalı dinler; seq ile tekrarlar elenir.
+    """
+
+    def __init__(self, redis_cache: RedisCache, ttl_seconds: int = 3600):
+        self._redis_cache = redis_cache
+        self._ttl_seconds = ttl_seconds
+
+    def publish(self, task_id: str, event_type: str, data: dict):
+        client = self._redis_cache.client
+        if client is None:
+            return
+
+        events_key = task_events_key(task_id)
+        try:
+            seq = client.incr(f"{events_key}:seq")
+            pipe = client.pipeline()
+            _queue_event(pipe, task_id, seq, event_type, data, self._ttl_seconds)
+            pipe.execute()
+        except Exception as publish_error:
+            logger.warning(f"Task event could not be published: {publish_error}")
+
+
+class AsyncTaskEventPublisher:
+    """
+    Async worker tarafı: TaskEventPublisher ile aynı event formatı, redis.asyncio
+    ile. Listener'lar senkron çağrıldığı için `publish` sadece kuyruğa ekler
+    (loop'tan ya da to_thread içinden); tek bir coroutine event'leri sırayla
+    basar. Event loop Redis round-trip'i için bloklanmaz, sıra korunur.
+    Job sonunda `aclose` ile kalan event'ler gönderilir.
+    """
+
+    def __init__(self, redis_cache: AsyncRedisCache, ttl_seconds: int = 3600):
+        self._redis_cache = redis_cache
+        self._ttl_seconds = ttl_seconds
+        self._loop = asyncio.get_running_loop()
+        self._pending: asyncio.Queue[tuple[str, str, dict] | None] = asyncio.Queue()
+        self._sender = asyncio.create_task(self._send_pending())
+
+    def publish(self, task_id: str, event_type: str, data: dict):
+        self._loop.call_soon_threadsafe(self._pending.put_nowait, (task_id, event_type, data))
+
+    async def aclose(self):
+        self._loop.call_soon_threadsafe(self._pending.put_nowait, None)
+        await self._sender
+
+    async def _send_pending(self):
+        while (event := await self._pending.get()) is not None:
+            await self._send(*event)
+
+    async def _send(self, task_id: str, event_type: str, data: dict):
+        client = self._redis_cache.client
+        if client is None:
+            return
+
+        try:
+            seq = await client.incr(f"{task_events_key(task_id)}:seq")
+            pipe = client.pipeline()
+            _queue_event(pipe, task_id, seq, event_type, data, self._ttl_seconds)
+            await pipe.execute()
+        except Exception as publish_error:
+            logger.warning(f"Task event could not be published: {publish_error}")
+
+
+def _queue_event(pipe, task_id: str, seq: int, event_type: str, data: dict, ttl_seconds: int):
+    events_key = task_events_key(task_id)
+    event = json.dumps(
+        {"seq": seq, "event": event_type, "data": data, "ts": time.time()},
+        ensure_ascii=False,
+    )
+    pipe.rpush(events_key, event)
+    pipe.expire(events_key, ttl_seconds)
+    pipe.expire(f"{events_key}:seq", ttl_seconds)
+    pipe.publish(task_events_channel(task_id), event)
+
+
+class TokenEventBuffer:
+    """
+    Stream edilen token'ları biriktirip toplu `token` event'i olarak basar;
+    her token için Redis round-trip'i yapılmaz. Paralel stage'lerden
+    çağrılabilir.
+    """
+
+    def __init__(
+        self,
+        publisher: TaskEventPublisher | AsyncTaskEventPublisher,
+        task_id: str,
+        flush_interval: float = 0.1,
+        max_chars: int = 200,
+    ):
+        self._publisher = publisher
+        self._task_id = task_id
+        self._flush_interval = flush_interval
+        self._max_chars = max_chars
+        self._buffers: dict[str, list[str]] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __call__(self, stage: str, text: str):
+        with self._lock:
+            self._buffers.setdefault(stage, []).append(text)
+            buffered = sum(len(chunk) for chunk in self._buffers[stage])
+            due = time.monotonic() - self._last_flush >= self._flush_interval
+            if due or buffered >= self._max_chars:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        for stage, chunks in self._buffers.items():
+            if chunks:
+                self._publisher.publish(
+                    self._task_id, "token", {"stage": stage, "text": "".join(chunks)}
+                )
+        self._buffers.clear()
+        self._last_flush = time.monotonic()
+
+
+async def iter_task_events(
+    client: AsyncRedis,
+    task_id: str,
+    after_seq: int = 0,
+    follow: bool = True,
+    keepalive_seconds: float = 15.0,
+    timeout_seconds: float = 600.0,
+    subscriber: AsyncRedis | None = None,
+) -> AsyncIterator[dict | None]:
+    """
+    API tarafı: önce birikmiş event'ler, sonra canlı olanlar (follow=True).
+
+    Uzun süre event gelmezse keep-alive için None yield edilir. Terminal
+    status event'inde ya da timeout'ta biter. Abonelik `subscriber`
+    (ayrı pub/sub pool'u) üzerinden açılır, replay `client` ile okunur.
+    """
+    # Replay'den önce subscribe: aradaki event kaçmasın, tekrarları seq eler
+    async with task_event_subscription(subscriber or client, task_id) as pubsub:
+        last_seq = after_seq
+        for raw_event in await client.lrange(task_events_key(task_id), 0, -1):
+            event = json.loads(raw_event)
+            if event["seq"] <= last_seq:
+                continue
+            last_seq = event["seq"]
+            yield event
+            if is_terminal(event):
+                return
+
+        if not follow:
+            return
+
+        deadline = time.monotonic() + timeout_seconds
+        while time.monotonic() < deadline:
+            message = await pubsub.get_message(timeout=keepalive_seconds)
+            if message is None:
+                yield None
+                continue
+
+            event = json.loads(message["data"])
+            if event["seq"] <= last_seq:
+                continue
+            last_seq = event["seq"]
+            yield event
+            if is_terminal(event):
+                return
+
+
+@asynccontextmanager
+async def task_event_subscription(client: AsyncRedis, task_id: str) -> AsyncIterator[PubSub]:
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(task_events_channel(task_id))
+    try:
+        yield pubsub
+    finally:
+        await pubsub.aclose()
+
+
+async def next_status_event(pubsub: PubSub, timeout_seconds: float) -> dict | None:
+    """Abone olunan task için bir sonraki status event'i; timeout'ta None."""
+    deadline = time.monotonic() + timeout_seconds
+    while (remaining := deadline - time.monotonic()) > 0:
+        message = await pubsub.get_message(timeout=remaining)
+        if message is None:
+            continue
+
+        event = json.loads(message["data"])
+        if event["event"] == "status":
+            return event
+    return None
+
+
+@lru_cache(maxsize=1)
+def get_event_publisher() -> TaskEventPublisher:
+    return TaskEventPublisher(get_redis_cache())
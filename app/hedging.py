@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import TypeVar
+
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from app.config import get_settings
+from app.llm import LLMSpec, get_llm, get_llm_spec
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+
+logger = get_logger()
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """
+    Yavaş LLM çağrıları için hedged request + failover.
+
+    Birincil model prompt'un öğrenilmiş p95 latency'sini aşarsa yedek modele
+    ikinci bir istek atılır; hangisi önce cevap verirse o kullanılır, diğeri
+    iptal edilir. Birincil hata verirse yedek beklemeden denenir. Latency
+    dağılımı her cevaptan sonra prompt + model başına metrics'e yazılır;
+    yeterli örnek yoksa hedge yapılmaz (sadece failover).
+    """
+
+    def __init__(
+        self,
+        metrics: MetricsRecorder,
+        backups: dict[str, str],
+        enabled: bool = True,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        min_delay_seconds: float = 2.0,
+        refresh_seconds: float = 30.0,
+    ):
+        self._metrics = metrics
+        self._backups = backups
+        self._enabled = enabled
+        self._quantile = quantile
+        self._min_samples = min_samples
+        self._min_delay_seconds = min_delay_seconds
+        self._refresh_seconds = refresh_seconds
+        # Percentile her çağrıda Redis'ten okunmaz, kısa süre process'te tutulur
+        self._thresholds: dict[str, tuple[float, float | None]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def latency_metric(prompt_name: str, spec: LLMSpec) -> str:
+        return f"llm_latency:{prompt_name}:{spec.provider}:{spec.model}"
+
+    def record(self, prompt_name: str, spec: LLMSpec, seconds: float):
+        self._metrics.observe(self.latency_metric(prompt_name, spec), seconds)
+
+    def hedge_delay(self, prompt_name: str, spec: LLMSpec) -> float | None:
+        """Yedek isteğin atılacağı süre; öğrenilmiş dağılım yoksa None."""
+        metric = self.latency_metric(prompt_name, spec)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._thresholds.get(metric)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        latency = self._metrics.percentile(metric, self._quantile, self._min_samples)
+        delay = None if latency is None else max(latency, self._min_delay_seconds)
+        with self._lock:
+            self._thresholds[metric] = (now + self._refresh_seconds, delay)
+        return delay
+
+    def backup_llm(self, spec: LLMSpec) -> BaseChatModel | None:
+        if not self._enabled:
+            return None
+
+        backup = self._backups.get(f"{spec.provider}:{spec.model}")
+        if not backup:
+            return None
+
+        provider, model = backup.split(":", 1)
+        return get_llm(
+            provider=provider,
+            model=model,
+            temperature=spec.temperature,
+            max_tokens=spec.max_tokens or 2000,
+        )
+
+    def run(self, prompt_name: str, llm: BaseChatModel, call: Callable[[BaseChatModel], T]) -> T:
+        spec = get_llm_spec(llm)
+        backup = self.backup_llm(spec)
+        if backup is None:
+            return self._timed(prompt_name, llm, call)
+
+        delay = self.hedge_delay(prompt_name, spec)
+        if delay is None:
+            try:
+                return self._timed(prompt_name, llm, call)
+            except Exception as primary_error:
+                return self._failover(prompt_name, backup, call, primary_error)
+
+        # Kaybeden thread kesilemez; sonucu yok sayılır, latency'si yine kaydedilir
+        pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+        try:
+            primary = pool.submit(
+                contextvars.copy_context().run, self._timed, prompt_name, llm, call
+            )
+            try:
+                return primary.result(timeout=delay)
+            except FutureTimeoutError:
+                pass
+            except Exception as primary_error:
+                return self._failover(prompt_name, backup, call, primary_error)
+
+            self._metrics.incr(f"llm_hedge:{prompt_name}:fired")
+            secondary = pool.submit(
+                contextvars.copy_context().run, self._timed, prompt_name, backup, call
+            )
+            return self._first_success(prompt_name, primary, secondary)
+        finally:
+            pool.shutdown(wait=False)
+
+    async def run_async(
+        self,
+        prompt_name: str,
+        llm: BaseChatModel,
+        call: Callable[[BaseChatModel], Awaitable[T]],
+    ) -> T:
+        spec = get_llm_spec(llm)
+        backup = self.backup_llm(spec)
+        if backup is None:
+            return await self._timed_async(prompt_name, llm, call)
+
+        delay = await asyncio.to_thread(self.hedge_delay, prompt_name, spec)
+        primary = asyncio.create_task(self._timed_async(prompt_name, llm, call))
+        secondary = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if primary in done:
+                if primary.exception() is None:
+                    return primary.result()
+                await asyncio.to_thread(self._metrics.incr, f"llm_hedge:{prompt_name}:failover")
+                logger.warning(f"LLM failover for {prompt_name}: {primary.exception()}")
+                return await self._timed_async(prompt_name, backup, call)
+
+            await asyncio.to_thread(self._metrics.incr, f"llm_hedge:{prompt_name}:fired")
+            secondary = asyncio.create_task(self._timed_async(prompt_name, backup, call))
+            pending = {primary, secondary}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = "primary" if task is primary else "backup"
+                        await asyncio.to_thread(
+                            self._metrics.incr, f"llm_hedge:{prompt_name}:{winner}_won"
+                        )
+                        return task.result()
+            raise primary.exception()
+        finally:
+            # Kaybeden istek iptal edilir (HTTP bağlantısı kapanır)
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def _timed(self, prompt_name: str, llm: BaseChatModel, call: Callable[[BaseChatModel], T]) -> T:
+        started_at = time.perf_counter()
+        result = call(llm)
+        self.record(prompt_name, get_llm_spec(llm), time.perf_counter() - started_at)
+        return result
+
+    async def _timed_async(
+        self,
+        prompt_name: str,
+        llm: BaseChatModel,
+        call: Callable[[BaseChatModel], Awaitable[T]],
+    ) -> T:
+        spec = get_llm_spec(llm)
+        started_at = time.perf_counter()
+        try:
+            result = await call(llm)
+        except asyncio.CancelledError:
+            # İptal edilen isteğin süresi alt sınır olarak kaydedilir; yoksa
+            # kuyruk hiç gözlenmez ve p95 zamanla aşağı kayar
+            asyncio.get_running_loop().run_in_executor(
+                None, self.record, prompt_name, spec, time.perf_counter() - started_at
+            )
+            raise
+
+        await asyncio.to_thread(self.record, prompt_name, spec, time.perf_counter() - started_at)
+        return result
+
+    def _failover(
+        self,
+        prompt_name: str,
+        backup: BaseChatModel,
+        call: Callable[[BaseChatModel], T],
+        primary_error: Exception,
+    ) -> T:
+        self._metrics.incr(f"llm_hedge:{prompt_name}:failover")
+        logger.warning(f"LLM failover for {prompt_name}: {primary_error}")
+        return self._timed(prompt_name, backup, call)
+
+    def _first_success(self, prompt_name: str, primary: Future, secondary: Future):
+        pending = {primary, secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    winner = "primary" if future is primary else "backup"
+                    self._metrics.incr(f"llm_hedge:{prompt_name}:{winner}_won")
+                    return future.result()
+        raise primary.exception()
+
+
+@lru_cache(maxsize=1)
+def get_hedge_policy() -> HedgePolicy:
+    settings = get_settings()
+    return HedgePolicy(
+        metrics=get_metrics(),
+        backups=settings.llm_hedge_backups,
+        enabled=settings.llm_hedging_enabled,
+        quantile=settings.llm_hedge_quantile,
+        min_samples=settings.llm_hedge_min_samples,
+        min_delay_seconds=settings.llm_hedge_min_delay_seconds,
+    )
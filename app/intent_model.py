@@ -0,0 +1,259 @@
+"""
+Lokal intent sınıflandırıcı (PeerAgent fast-path).
+
+Hashed karakter/kelime n-gram özellikleri üzerinde NumPy ile eğitilmiş
+multinomial logistic regression. Yüksek güvenli tahminler LLM'e gitmez,
+belirsiz olanlar peer_classify prompt'una escalate edilir.
+
+Eğitim (Mongo `conversations` collection'ından):
+    python -m app.intent_model train --output-dir artifacts/intent
+"""
+
+import argparse
+import json
+import zlib
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from app.config import get_settings
+from app.logging import get_logger
+from app.models.domain import IntentType
+from app.utils import normalize_text, utc_now
+
+logger = get_logger()
+
+FORMAT_VERSION = 1
+
+def hash_features(
+    text: str, n_features: int, ngram_range: tuple[int, int] = (2, 4)
+) -> tuple[np.ndarray, np.ndarray]:
+    """Sparse (indices, values) özellik vektörü, L2 normalize."""
+    normalized = normalize_text(text)
+    padded = f" {normalized} "
+    tokens = [f"w:{word}" for word in normalized.split()]
+
+    min_n, max_n = ngram_range
+    for n in range(min_n, max_n + 1):
+        tokens.extend(f"c{n}:{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+
+    if not tokens:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+    # Python hash() process'e göre değişir; model dosyası için stabil hash gerekli
+    hashed = np.array(
+        [zlib.crc32(token.encode("utf-8")) % n_features for token in tokens], dtype=np.int64
+    )
+    indices, counts = np.unique(hashed, return_counts=True)
+    values = counts.astype(np.float32)
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = np.exp(logits - logits.max())
+    return shifted / shifted.sum()
+
+
+class HashedNgramIntentModel:
+    def __init__(
+        self,
+        weights: np.ndarray,
+        bias: np.ndarray,
+        labels: list[str],
+        version: str,
+        ngram_range: tuple[int, int] = (2, 4),
+    ):
+        self.weights = weights
+        self.bias = bias
+        self.labels = labels
+        self.version = version
+        self.ngram_range = ngram_range
+
+    @property
+    def n_features(self) -> int:
+        return self.weights.shape[0]
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        indices, values = hash_features(text, self.n_features, self.ngram_range)
+        logits = values @ self.weights[indices] + self.bias
+        return _softmax(logits)
+
+    def predict(self, text: str) -> tuple[IntentType, float]:
+        probabilities = self.predict_proba(text)
+        best = int(probabilities.argmax())
+        return IntentType(self.labels[best]), float(probabilities[best])
+
+    @classmethod
+    def train(
+        cls,
+        texts: list[str],
+        labels: list[str],
+        n_features: int = 2**18,
+        epochs: int = 15,
+        learning_rate: float = 0.5,
+        l2: float = 1e-5,
+        seed: int = 42,
+    ) -> "HashedNgramIntentModel":
+        label_names = sorted(set(labels))
+        label_index = {label: i for i, label in enumerate(label_names)}
+        targets = np.array([label_index[label] for label in labels])
+        features = [hash_features(text, n_features) for text in texts]
+
+        weights = np.zeros((n_features, len(label_names)), dtype=np.float32)
+        bias = np.zeros(len(label_names), dtype=np.float32)
+        rng = np.random.default_rng(seed)
+
+        # Sparse SGD: her örnekte sadece aktif feature satırları güncellenir
+        for epoch in range(epochs):
+            step = learning_rate / (1 + epoch)
+            for i in rng.permutation(len(features)):
+                indices, values = features[i]
+                probabilities = _softmax(values @ weights[indices] + bias)
+                probabilities[targets[i]] -= 1.0
+
+                weights[indices] -= step * (
+                    np.outer(values, probabilities) + l2 * weights[indices]
+                )
+                bias -= step * probabilities
+
+        version = utc_now().strftime("%Y%m%d%H%M%S")
+        return cls(weights=weights, bias=bias, labels=label_names, version=version)
+
+    def save(self, output_dir: Path) -> Path:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        model_path = output_dir / f"intent-{self.version}.npz"
+        metadata = {
+            "format_version": FORMAT_VERSION,
+            "version": self.version,
+            "labels": self.labels,
+            "ngram_range": list(self.ngram_range),
+        }
+        np.savez_compressed(
+            model_path, weights=self.weights, bias=self.bias, metadata=json.dumps(metadata)
+        )
+        return model_path
+
+    @classmethod
+    def load(cls, model_path: Path) -> "HashedNgramIntentModel":
+        with np.load(model_path) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            if metadata["format_version"] != FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported intent model format: {metadata['format_version']}"
+                )
+            return cls(
+                weights=artifact["weights"],
+                bias=artifact["bias"],
+                labels=metadata["labels"],
+                version=metadata["version"],
+                ngram_range=tuple(metadata["ngram_range"]),
+            )
+
+
+@lru_cache(maxsize=1)
+def get_intent_model() -> HashedNgramIntentModel | None:
+    settings = get_settings()
+    if not settings.intent_model_path:
+        return None
+
+    try:
+        model = HashedNgramIntentModel.load(Path(settings.intent_model_path))
+        logger.info(f"Intent model loaded: {model.version}")
+        return model
+    except Exception as load_error:
+        logger.warning(f"Intent model could not be loaded: {load_error}")
+        return None
+
+
+# Lokal modelin kendi tahminleri etiket sayılmaz: retrain kendi hatalarını öğrenir
+TRUSTED_INTENT_SOURCES = ("llm", "human")
+
+
+def load_training_data(limit: int | None = None) -> tuple[list[str], list[str]]:
+    """Mongo `conversations` kayıtlarından LLM/insan etiketli (ilk mesaj, intent) çiftleri."""
+    from pymongo import MongoClient
+
+    settings = get_settings()
+    client = MongoClient(settings.mongodb_uri)
+    conversations = client[settings.mongodb_database]["conversations"]
+    valid_intents = {intent.value for intent in IntentType}
+
+    cursor = conversations.find(
+        {
+            "intent": {"$in": list(valid_intents)},
+            "intent_source": {"$in": list(TRUSTED_INTENT_SOURCES)},
+        },
+        {"user_input": 1, "initial_input": 1, "intent": 1},
+    ).sort("created_at", -1)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    texts, labels = [], []
+    for record in cursor:
+        # business_problem kayıtlarında user_input son discovery cevabı olabilir
+        text = record.get("initial_input") or record.get("user_input")
+        if text:
+            texts.append(text)
+            labels.append(record["intent"])
+
+    client.close()
+    return texts, labels
+
+
+def _evaluate(
+    model: HashedNgramIntentModel, texts: list[str], labels: list[str], threshold: float
+) -> dict:
+    predictions = [model.predict(text) for text in texts]
+    confident = [
+        (intent.value, label)
+        for (intent, confidence), label in zip(predictions, labels)
+        if confidence >= threshold
+    ]
+    return {
+        "accuracy": sum(intent.value == label for (intent, _), label in zip(predictions, labels))
+        / max(len(labels), 1),
+        "coverage": len(confident) / max(len(labels), 1),
+        "confident_accuracy": sum(p == label for p, label in confident) / max(len(confident), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokal intent modeli eğit")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train")
+    train_parser.add_argument("--output-dir", type=Path, default=Path("artifacts/intent"))
+    train_parser.add_argument("--limit", type=int, default=None)
+    train_parser.add_argument("--holdout", type=float, default=0.1)
+    train_parser.add_argument("--min-samples", type=int, default=50)
+    train_parser.add_argument("--epochs", type=int, default=15)
+    args = parser.parse_args()
+
+    texts, labels = load_training_data(args.limit)
+    if len(texts) < args.min_samples:
+        raise SystemExit(f"Not enough labelled conversations: {len(texts)} < {args.min_samples}")
+
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(texts))
+    holdout_size = int(len(texts) * args.holdout)
+    holdout, train = order[:holdout_size], order[holdout_size:]
+
+    model = HashedNgramIntentModel.train(
+        [texts[i] for i in train], [labels[i] for i in train], epochs=args.epochs
+    )
+    model_path = model.save(args.output_dir)
+
+    threshold = get_settings().intent_confidence_threshold
+    if holdout_size:
+        report = _evaluate(
+            model, [texts[i] for i in holdout], [labels[i] for i in holdout], threshold
+        )
+        print(json.dumps({"threshold": threshold, **report}, indent=2))
+
+    print(f"Model saved: {model_path} ({len(train)} samples)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,68 @@
+import asyncio
+import weakref
+from dataclasses import dataclass
 from functools import lru_cache
 from typing import Literal
 
 from langchain_anthropic import ChatAnthropic
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, create_model
 
 from app.config import get_settings
 
 LLMProvider = Literal["openai", "anthropic", "google"]
 
 
+@dataclass(frozen=True)
+class LLMSpec:
+    provider: str
+    model: str
+    temperature: float
+    max_tokens: int | None = None
+
+
+def get_llm_spec(llm: BaseChatModel) -> LLMSpec:
+    """get_llm ile oluşturulmuş bir client'ın provider/model/temperature bilgisi."""
+    if isinstance(llm, ChatOpenAI):
+        provider = "openai"
+    elif isinstance(llm, ChatAnthropic):
+        provider = "anthropic"
+    elif isinstance(llm, ChatGoogleGenerativeAI):
+        provider = "google"
+    else:
+        provider = llm._llm_type
+
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+    return LLMSpec(
+        provider=provider,
+        model=str(model),
+        temperature=float(getattr(llm, "temperature", None) or 0.0),
+        max_tokens=getattr(llm, "max_tokens", None) or getattr(llm, "max_output_tokens", None),
+    )
+
+
+# Semaphore'lar event loop'a bağlı; her loop (async worker, API) kendi limitini tutar
+_provider_semaphores: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]
+] = weakref.WeakKeyDictionary()
+
+
+def get_provider_semaphore(provider: str) -> asyncio.Semaphore:
+    """
+    Provider başına eşzamanlı async LLM çağrısı limiti.
+    Tek process yüzlerce session çalıştırırken provider rate limit'ine çarpmasın.
+    """
+    loop = asyncio.get_running_loop()
+    semaphores = _provider_semaphores.setdefault(loop, {})
+    if provider not in semaphores:
+        limits = get_settings().llm_provider_concurrency
+        semaphores[provider] = asyncio.Semaphore(limits.get(provider, limits.get("default", 16)))
+    return semaphores[provider]
+
+
 @lru_cache()
 def get_llm(
     provider: LLMProvider, model: str, temperature: float, max_tokens: int
@@ -45,6 +97,31 @@ def get_llm(
         raise ValueError(f"Desteklenmeyen provider: {provider}")
 
 
+def with_json_schema(llm: BaseChatModel, schema: type[BaseModel]) -> Runnable:
+    """
+    Provider tarafında schema'ya bağlı JSON üretimi (OpenAI response_format,
+    Anthropic output_config, Gemini response schema). Ham AIMessage döner;
+    parse çağıranda `model_validate_json` ile yapılır.
+    """
+    structured = llm.with_structured_output(schema, method="json_schema")
+    # with_structured_output = bağlı model | parser; parser atlanınca stream de chunk verir
+    return structured.first
+
+
+@lru_cache(maxsize=None)
+def llm_output_schema(model: type[BaseModel], exclude: tuple[str, ...] = ()) -> type[BaseModel]:
+    """LLM'in üretmediği alanlar (örn. agent'ın doldurduğu turlar) çıkarılmış schema."""
+    if not exclude:
+        return model
+
+    fields = {
+        name: (field.annotation, field)
+        for name, field in model.model_fields.items()
+        if name not in exclude
+    }
+    return create_model(model.__name__, __doc__=model.__doc__, **fields)
+
+
 def get_peer_llm() -> BaseChatModel:
     """
     PeerAgent için GPT-5.1
@@ -53,6 +130,16 @@ def get_peer_llm() -> BaseChatModel:
     return get_llm(provider="openai", model="gpt-5.1", temperature=0.3, max_tokens=1000)
 
 
+def get_peer_chunk_llm() -> BaseChatModel:
+    """
+    Uzun research içeriğinin parça özetleri (map adımı) için Gemini 2.5 Flash.
+    Parçalar paralel ve sayıca çok; son özet yine GPT-5.1 ile.
+    """
+    return get_llm(
+        provider="google", model="gemini-2.5-flash", temperature=0.3, max_tokens=1000
+    )
+
+
 def get_discovery_llm() -> BaseChatModel:
     """
     DiscoveryAgent için Claude 3.5 Sonnet.
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from langchain_core.messages import BaseMessage
+
+from app.cache import RedisCache, get_redis_cache
+from app.config import get_settings
+from app.llm import LLMSpec
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+
+logger = get_logger()
+
+
+def make_cache_key(
+    spec: LLMSpec, messages: list[BaseMessage], output_schema: dict | None = None
+) -> str:
+    """Content-addressed key: provider, model, temperature, render edilmiş mesajlar (+ schema)."""
+    request = {
+        "provider": spec.provider,
+        "model": spec.model,
+        "temperature": spec.temperature,
+        "messages": [[message.type, message.content] for message in messages],
+    }
+    if output_schema is not None:
+        request["output_schema"] = output_schema
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    İki katmanlı LLM response cache.
+
+    1. Process içi LRU (en hızlı, worker restart'ta kaybolur)
+    2. Redis (worker'lar arası paylaşılır, TTL + index üzerinden boyut limiti)
+
+    Hit/miss sayaçları prompt bazında metrics'e yazılır.
+    """
+
+    KEY_PREFIX = "llm_cache:"
+    INDEX_KEY = "llm_cache:index"
+
+    def __init__(
+        self,
+        redis_cache: RedisCache,
+        metrics: MetricsRecorder,
+        max_local_entries: int = 512,
+        max_redis_entries: int = 10000,
+    ):
+        self._redis_cache = redis_cache
+        self._metrics = metrics
+        self._max_local_entries = max_local_entries
+        self._max_redis_entries = max_redis_entries
+        self._local: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str, prompt_name: str) -> str | None:
+        cached = self._get_local(cache_key)
+        if cached is not None:
+            self._metrics.incr(f"llm_cache:{prompt_name}:hit_local")
+            return cached
+
+        cached = self._get_redis(cache_key)
+        if cached is not None:
+            ttl = self._redis_ttl(cache_key)
+            self._set_local(cache_key, cached, ttl)
+            self._metrics.incr(f"llm_cache:{prompt_name}:hit_redis")
+            return cached
+
+        self._metrics.incr(f"llm_cache:{prompt_name}:miss")
+        return None
+
+    def set(self, cache_key: str, response: str, ttl_seconds: int):
+        self._set_local(cache_key, response, ttl_seconds)
+        self._set_redis(cache_key, response, ttl_seconds)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def _get_local(self, cache_key: str) -> str | None:
+        with self._lock:
+            entry = self._local.get(cache_key)
+            if entry is None:
+                return None
+
+            expires_at, response = entry
+            if expires_at < time.time():
+                del self._local[cache_key]
+                return None
+
+            self._local.move_to_end(cache_key)
+            return response
+
+    def _set_local(self, cache_key: str, response: str, ttl_seconds: int):
+        with self._lock:
+            self._local[cache_key] = (time.time() + ttl_seconds, response)
+            self._local.move_to_end(cache_key)
+            while len(self._local) > self._max_local_entries:
+                self._local.popitem(last=False)
+
+    def _get_redis(self, cache_key: str) -> str | None:
+        client = self._redis_cache.client
+        if client is None:
+            return None
+
+        try:
+            return client.get(f"{self.KEY_PREFIX}{cache_key}")
+        except Exception as cache_error:
+            logger.warning(f"LLM cache read failed: {cache_error}")
+            return None
+
+    def _redis_ttl(self, cache_key: str) -> int:
+        try:
+            return max(self._redis_cache.client.ttl(f"{self.KEY_PREFIX}{cache_key}"), 1)
+        except Exception:
+            return 1
+
+    def _set_redis(self, cache_key: str, response: str, ttl_seconds: int):
+        client = self._redis_cache.client
+        if client is None:
+            return
+
+        try:
+            pipe = client.pipeline()
+            pipe.setex(f"{self.KEY_PREFIX}{cache_key}", ttl_seconds, response)
+            pipe.zadd(self.INDEX_KEY, {cache_key: time.time()})
+            pipe.zcard(self.INDEX_KEY)
+            index_size = pipe.execute()[-1]
+
+            overflow = index_size - self._max_redis_entries
+            if overflow > 0:
+                self._evict_oldest(overflow)
+        except Exception as cache_error:
+            logger.warning(f"LLM cache write failed: {cache_error}")
+
+    def _evict_oldest(self, count: int):
+        client = self._redis_cache.client
+        oldest = client.zrange(self.INDEX_KEY, 0, count - 1)
+        if not oldest:
+            return
+
+        pipe = client.pipeline()
+        pipe.delete(*[f"{self.KEY_PREFIX}{key}" for key in oldest])
+        pipe.zrem(self.INDEX_KEY, *oldest)
+        pipe.execute()
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache() -> LLMResponseCache:
+    settings = get_settings()
+    return LLMResponseCache(
+        redis_cache=get_redis_cache(),
+        metrics=get_metrics(),
+        max_local_entries=settings.llm_cache_max_local_entries,
+        max_redis_entries=settings.llm_cache_max_redis_entries,
+    )
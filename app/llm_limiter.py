@@ -0,0 +1,152 @@
+import asyncio
+import time
+from functools import lru_cache
+
+from langchain_core.messages import BaseMessage
+
+from app.cache import RedisCache, get_redis_cache
+from app.config import get_settings
+from app.llm import LLMSpec
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+
+logger = get_logger()
+
+# İki bucket (istek, token) aynı anda dakikalık hızla dolar. Çağrı kapasiteyi
+# hemen düşer, bucket eksiye inebilir; dönen değer borcun kapanacağı süre.
+# Böylece bekleyenler Redis'e varış sırasıyla (FIFO) sıraya girer, polling yok.
+_RESERVE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = math.min(tonumber(ARGV[3]), tpm)
+
+local bucket = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts')
+local requests = tonumber(bucket[1]) or rpm
+local tokens = tonumber(bucket[2]) or tpm
+local elapsed = math.max(now - (tonumber(bucket[3]) or now), 0)
+
+requests = math.min(rpm, requests + elapsed * rpm / 60) - 1
+tokens = math.min(tpm, tokens + elapsed * tpm / 60) - cost
+
+local wait = 0
+if requests < 0 then wait = math.max(wait, -requests * 60 / rpm) end
+if tokens < 0 then wait = math.max(wait, -tokens * 60 / tpm) end
+
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120 + math.ceil(wait))
+return tostring(wait)
+"""
+
+# Tahmin ile gerçek kullanım farkı bucket'a yansıtılır (key yoksa bucket zaten dolu)
+_SETTLE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'tokens', ARGV[1])
+end
+return 0
+"""
+
+
+def estimate_tokens(messages: list[BaseMessage], max_output_tokens: int | None) -> int:
+    """Prompt için kaba tahmin (~4 karakter/token) + cevap için üst sınır."""
+    prompt_chars = sum(len(str(message.content)) for message in messages)
+    return prompt_chars // 4 + (max_output_tokens or 0)
+
+
+class LLMRateLimiter:
+    """
+    Provider/model başına worker'lar arası RPM + TPM limiti (Redis token bucket).
+
+    Çağrı öncesi `reserve` kapasiteyi ayırır ve ne kadar beklenmesi gerektiğini
+    döner; cevap geldikten sonra `settle` tahmini token sayısını gerçek
+    kullanımla düzeltir. Bekleme süreleri `llm_rate_wait:{provider}` olarak
+    ölçülür. Limiti tanımlı olmayan provider'lar ve Redis yoksa bekleme yok.
+    """
+
+    KEY_PREFIX = "llm_rate:"
+
+    def __init__(
+        self,
+        redis_cache: RedisCache,
+        metrics: MetricsRecorder,
+        limits: dict[str, dict[str, int]],
+        enabled: bool = True,
+    ):
+        self._redis_cache = redis_cache
+        self._metrics = metrics
+        self._limits = limits
+        self._enabled = enabled
+
+    def wait(self, spec: LLMSpec, estimated_tokens: int):
+        delay = self.reserve(spec, estimated_tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, spec: LLMSpec, estimated_tokens: int):
+        delay = await asyncio.to_thread(self.reserve, spec, estimated_tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def reserve(self, spec: LLMSpec, estimated_tokens: int) -> float:
+        client = self._redis_cache.client
+        limit = self._limit_for(spec)
+        if client is None or limit is None:
+            return 0.0
+
+        try:
+            delay = float(
+                client.eval(
+                    _RESERVE_SCRIPT,
+                    1,
+                    self._bucket_key(spec),
+                    limit["rpm"],
+                    limit["tpm"],
+                    estimated_tokens,
+                )
+            )
+        except Exception as limiter_error:
+            logger.warning(f"LLM rate limiter unavailable: {limiter_error}")
+            return 0.0
+
+        self._metrics.observe(f"llm_rate_wait:{spec.provider}", delay)
+        if delay > 0:
+            self._metrics.incr(f"llm_rate_limited:{spec.provider}")
+            logger.info(f"LLM rate limit: waiting {delay:.2f}s for {spec.provider}/{spec.model}")
+        return delay
+
+    def settle(self, spec: LLMSpec, estimated_tokens: int, used_tokens: int | None):
+        client = self._redis_cache.client
+        if client is None or used_tokens is None or self._limit_for(spec) is None:
+            return
+
+        try:
+            client.eval(
+                _SETTLE_SCRIPT, 1, self._bucket_key(spec), estimated_tokens - used_tokens
+            )
+        except Exception as limiter_error:
+            logger.debug(f"LLM rate limiter settle failed: {limiter_error}")
+
+    def _limit_for(self, spec: LLMSpec) -> dict[str, int] | None:
+        if not self._enabled:
+            return None
+        return self._limits.get(f"{spec.provider}:{spec.model}") or self._limits.get(
+            spec.provider
+        )
+
+    def _bucket_key(self, spec: LLMSpec) -> str:
+        # Model'e özel limit yoksa provider'ın tüm modelleri tek bucket'ı paylaşır
+        if f"{spec.provider}:{spec.model}" in self._limits:
+            return f"{self.KEY_PREFIX}{spec.provider}:{spec.model}"
+        return f"{self.KEY_PREFIX}{spec.provider}"
+
+
+@lru_cache(maxsize=1)
+def get_llm_limiter() -> LLMRateLimiter:
+    settings = get_settings()
+    return LLMRateLimiter(
+        redis_cache=get_redis_cache(),
+        metrics=get_metrics(),
+        limits=settings.llm_rate_limits,
+        enabled=settings.llm_rate_limit_enabled,
+    )
@@ -1,15 +1,31 @@
+import asyncio
 import uuid
+import weakref
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Request, status
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from limits import parse as parse_rate_limit
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
-from app.cache import get_redis_cache
+from app.admission import get_admission_controller
+from app.agents.workflow import WorkflowState, get_advisor_workflow
+from app.async_worker import enqueue_job
+from app.cache import AsyncRedisCache, get_async_redis_cache, get_redis_cache
 from app.config import get_settings
 from app.db import get_mongodb_service
+from app.events import (
+    TERMINAL_STATUSES,
+    format_sse,
+    is_terminal,
+    iter_task_events,
+    next_status_event,
+    task_event_subscription,
+)
 from app.logging import LogContext, get_logger
+from app.metrics import get_metrics
 from app.models.api import (
     AgentExecuteRequest,
     ErrorResponse,
@@ -17,7 +33,14 @@ from app.models.api import (
     TaskStatusResponse,
     TaskSubmitResponse,
 )
-from app.worker import celery_app, process_agent_task
+from app.worker import (
+    agent_task_lane,
+    agent_task_queue,
+    celery_app,
+    process_agent_task,
+    process_pipeline_task,
+    stage_queue,
+)
 
 settings = get_settings()
 logger = get_logger()
@@ -35,13 +58,18 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("MongoDB connection failed - logging disabled")
 
+    # Metrics gibi sync yardımcılar için; handler'lar async store'u kullanır
     cache = get_redis_cache()
     cache.connect()
 
+    async_cache = get_async_redis_cache()
+    await async_cache.connect()
+
     yield
 
     logger.info("Application shutting down...")
     await db_service.close()
+    await async_cache.close()
     cache.close()
 
 
@@ -61,8 +89,8 @@ async def health_check():
     db_service = get_mongodb_service()
     db_healthy = await db_service.health_check()
 
-    cache = get_redis_cache()
-    redis_healthy = cache.is_connected()
+    cache = get_async_redis_cache()
+    redis_healthy = await cache.is_connected()
 
     overall_status = "healthy" if (db_healthy and redis_healthy) else "degraded"
 
@@ -71,6 +99,13 @@ async def health_check():
     )
 
 
+@app.get("/metrics", tags=["System"])
+async def get_metrics_snapshot():
+    """Paylaşılan sayaçlar (LLM cache hit/miss vb.) ve latency percentile'ları."""
+    # Snapshot sync Redis client ile okunuyor; event loop'u bloklamasın
+    return await asyncio.to_thread(get_metrics().snapshot)
+
+
 @app.post(
     "/v1/agent/execute",
     response_model=TaskSubmitResponse,
@@ -78,6 +113,7 @@ async def health_check():
         400: {"model": ErrorResponse},
         404: {"model": ErrorResponse},
         429: {"description": "Rate limit exceeded"},
+        503: {"description": "Queue over capacity, see Retry-After"},
     },
     tags=["Agent"],
 )
@@ -86,37 +122,62 @@ async def execute_agent(request: Request, body: AgentExecuteRequest):
     """
     Task'ı queue'ya gönder.
 
-    Rate limit: 20/dakika
+    Rate limit: 20/dakika. Kuyruk SLO'yu aşıyorsa yeni session 503 alır;
+    devam eden discovery session'ları her zaman kabul edilir.
     """
     if not body.task or not body.task.strip():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Task cannot be empty"
         )
 
-    cache = get_redis_cache()
+    cache = get_async_redis_cache()
 
     existing_state = None
     if body.session_id:
-        existing_state = cache.get_session(body.session_id)
+        existing_state = await cache.get_session(body.session_id)
         if not existing_state:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found or expired",
             )
+    else:
+        retry_after = await _admission_retry_after()
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Service is over capacity, retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
 
     session_id = body.session_id or str(uuid.uuid4())
 
     with LogContext(session_id=session_id, agent="api"):
         logger.info(f"Queuing task: {body.task[:50]}...")
 
-        celery_task = process_agent_task.delay(
-            session_id=session_id, task=body.task, existing_state=existing_state
-        )
-
-        logger.info(f"Task queued: {celery_task.id}")
+        if settings.worker_mode == "async":
+            task_id = str(uuid.uuid4())
+            await enqueue_job(
+                cache,
+                task_id,
+                session_id,
+                body.task,
+                existing_state,
+                lane=agent_task_lane(existing_state, inline_pipeline=True),
+            )
+        else:
+            task_id = process_agent_task.apply_async(
+                kwargs={
+                    "session_id": session_id,
+                    "task": body.task,
+                    "existing_state": existing_state,
+                },
+                queue=agent_task_queue(existing_state),
+            ).id
+
+        logger.info(f"Task queued: {task_id}")
 
         return TaskSubmitResponse(
-            task_id=celery_task.id,
+            task_id=task_id,
             session_id=session_id,
             status="pending",
             message="Task submitted to queue",
@@ -130,22 +191,159 @@ async def execute_agent(request: Request, body: AgentExecuteRequest):
     tags=["Agent"],
 )
 @limiter.limit(settings.rate_limit_tasks)
-async def get_task_status(request: Request, task_id: str):
+async def get_task_status(
+    request: Request,
+    task_id: str,
+    wait: int = Query(default=0, ge=0, le=settings.task_long_poll_max_seconds),
+):
     """
     Task durumunu sorgula (polling).
 
+    Önce worker'ın yazdığı küçük status kaydı okunur; ağır sonuç (rapor vb.)
+    sadece task bittiğinde Celery backend'inden çekilir.
+
+    `wait` > 0 ise long-poll: task durumu değişene kadar (en fazla `wait`
+    saniye) cevap bekletilir. Uyanma worker'ın status event'i ile olur.
+    Bekleyen istek sayısı doluysa anlık durum döner.
+
     Rate limit: 60/dakika
     """
-    result = celery_app.AsyncResult(task_id)
+    cache = get_async_redis_cache()
+    subscriber = cache.acquire_subscriber() if wait > 0 else None
+    if subscriber is None:
+        return await _load_task_status(task_id)
+
+    try:
+        # Status okunmadan önce subscribe: arada gelen değişiklik kaçmasın
+        async with task_event_subscription(subscriber, task_id) as pubsub:
+            current_status = await _load_task_status(task_id)
+            if current_status.status in TERMINAL_STATUSES:
+                return current_status
+
+            if await next_status_event(pubsub, wait) is None:
+                return current_status
+    finally:
+        cache.release_subscriber()
+
+    return await _load_task_status(task_id)
+
+
+@app.get("/v1/tasks/{task_id}/events", tags=["Agent"])
+@limiter.limit(settings.rate_limit_tasks)
+async def stream_task_events(request: Request, task_id: str):
+    """
+    Task ilerlemesini Server-Sent Events olarak akıtır.
+
+    Her workflow adımı bitince `stage` event'i (adımın çıktısıyla) gelir;
+    task bitince `completed` / `failed` event'i tam sonucu taşır ve stream
+    kapanır. Yeniden bağlanırken `Last-Event-ID` ile kaldığı yerden devam eder.
+    """
+    cache = get_async_redis_cache()
+    if cache.client is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Event stream unavailable"
+        )
+
+    subscriber = cache.acquire_subscriber()
+    if subscriber is None:
+        # Açık stream limiti dolu: client polling'e ya da sonra tekrar denemeye düşer
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many open event streams",
+            headers={"Retry-After": str(int(settings.task_events_keepalive_seconds))},
+        )
+
+    last_event_id = request.headers.get("last-event-id", "0")
+    after_seq = int(last_event_id) if last_event_id.isdigit() else 0
+
+    released = False
+
+    def release_subscriber():
+        nonlocal released
+        if not released:
+            released = True
+            cache.release_subscriber()
+
+    async def event_stream():
+        try:
+            async for chunk in _task_event_chunks(request, task_id, after_seq, subscriber):
+                yield chunk
+        finally:
+            release_subscriber()
+
+    stream = event_stream()
+    # Header gönderilemeyip stream hiç başlamazsa slot GC'de bırakılır
+    weakref.finalize(stream, release_subscriber)
+
+    return StreamingResponse(
+        stream,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _task_event_chunks(request: Request, task_id: str, after_seq: int, subscriber):
+    final_status = await _load_task_status(task_id)
+    already_finished = final_status.status in TERMINAL_STATUSES
+    last_seq = after_seq
+
+    async for event in iter_task_events(
+        get_async_redis_cache().client,
+        task_id,
+        after_seq=after_seq,
+        follow=not already_finished,
+        keepalive_seconds=settings.task_events_keepalive_seconds,
+        timeout_seconds=settings.task_events_stream_timeout_seconds,
+        subscriber=subscriber,
+    ):
+        if event is None:
+            yield ": keepalive\n\n"
+            if await request.is_disconnected():
+                return
+            continue
+
+        last_seq = event["seq"]
+        if is_terminal(event):
+            final_status = await _load_task_status(task_id)
+            break
+        yield format_sse(event)
+
+    if final_status.status in TERMINAL_STATUSES:
+        yield format_sse(
+            {"seq": last_seq, "event": final_status.status, "data": final_status.model_dump()}
+        )
+
+
+async def _load_task_status(task_id: str) -> TaskStatusResponse:
+    cache = get_async_redis_cache()
 
-    if result.state == "PENDING":
+    task_status = await cache.get_task_status(task_id)
+    if task_status and task_status["status"] == "processing":
+        return TaskStatusResponse(task_id=task_id, status="processing")
+
+    task_meta = await cache.get_task_result(task_id)
+    if task_meta is None:
+        # Status kaydı var ama sonuç expire olmuş olabilir
+        if task_status and task_status["status"] == "failed":
+            return TaskStatusResponse(
+                task_id=task_id, status="failed", error=task_status.get("error")
+            )
+        return TaskStatusResponse(task_id=task_id, status="pending")
+
+    return _task_response_from_meta(task_id, task_meta)
+
+
+def _task_response_from_meta(task_id: str, task_meta: dict) -> TaskStatusResponse:
+    task_state = task_meta.get("status", "PENDING")
+
+    if task_state == "PENDING":
         return TaskStatusResponse(task_id=task_id, status="pending")
 
-    if result.state == "STARTED":
+    if task_state == "STARTED":
         return TaskStatusResponse(task_id=task_id, status="processing")
 
-    if result.state == "SUCCESS":
-        task_result = result.result
+    if task_state == "SUCCESS":
+        task_result = task_meta["result"]
 
         if task_result.get("success"):
             state = task_result["state"]
@@ -160,12 +358,11 @@ async def get_task_status(request: Request, task_id: str):
             error=task_result.get("error", "Unknown error"),
         )
 
-    if result.state == "FAILURE":
-        return TaskStatusResponse(
-            task_id=task_id, status="failed", error=str(result.result)
-        )
+    if task_state == "FAILURE":
+        exception = celery_app.backend.exception_to_python(task_meta.get("result"))
+        return TaskStatusResponse(task_id=task_id, status="failed", error=str(exception))
 
-    return TaskStatusResponse(task_id=task_id, status=result.state.lower())
+    return TaskStatusResponse(task_id=task_id, status=task_state.lower())
 
 
 @app.get("/v1/sessions/{session_id}", tags=["Agent"])
@@ -176,8 +373,8 @@ async def get_session_status(request: Request, session_id: str):
 
     Rate limit: 30/dakika
     """
-    cache = get_redis_cache()
-    state = cache.get_session(session_id)
+    cache = get_async_redis_cache()
+    state = await cache.get_session(session_id)
 
     if state is None:
         raise HTTPException(
@@ -190,9 +387,286 @@ async def get_session_status(request: Request, session_id: str):
         "awaiting_user_input": state["awaiting_user_input"],
         "is_complete": state["is_complete"],
         "agent_flow": state["agent_flow"],
+        "error": state.get("error"),
     }
 
 
+@app.post(
+    "/v1/sessions/{session_id}/resume",
+    response_model=TaskSubmitResponse,
+    responses={404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}},
+    tags=["Agent"],
+)
+@limiter.limit(settings.rate_limit_execute)
+async def resume_session(request: Request, session_id: str):
+    """
+    Hata almış session'ı kaldığı yerden devam ettir.
+
+    Pipeline hatasında ilk eksik stage'den başlanır; biten stage'ler memo'dan
+    gelir. Discovery turunda hata alındıysa son cevap tekrar işlenir. Task
+    kuyruğa verilmeden önce hatası temizlenmiş state yazılır; aynı session
+    için eşzamanlı ya da tekrarlanan istek 409 alır.
+    """
+    cache = get_async_redis_cache()
+    if not await cache.claim_session_resume(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Session resume already in progress"
+        )
+
+    try:
+        # Kilit altında oku-temizle-yaz: ikinci istek temizlenmiş state'i görür
+        task_id = await _resume_failed_session(cache, session_id)
+    finally:
+        await cache.release_session_resume(session_id)
+
+    return TaskSubmitResponse(
+        task_id=task_id,
+        session_id=session_id,
+        status="pending",
+        message="Session resumed",
+    )
+
+
+async def _resume_failed_session(cache: AsyncRedisCache, session_id: str) -> str:
+    state = await cache.get_session(session_id)
+
+    if state is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired"
+        )
+    if not state.get("error"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Session has not failed")
+    if not state.get("discovery_session"):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Nothing to resume, submit the task again",
+        )
+
+    with LogContext(session_id=session_id, agent="api"):
+        logger.info(f"Resuming failed session: {state['error']}")
+        resumed_state = {**state, "error": None, "is_complete": False}
+        if resumed_state.get("discovery_output") is None:
+            resumed_state["awaiting_user_input"] = True
+
+        await cache.save_session(session_id, resumed_state, settings.session_ttl_seconds)
+        try:
+            return await _enqueue_resume(cache, session_id, resumed_state)
+        except Exception:
+            # Task kuyruğa girmedi: session tekrar resume edilebilsin
+            await cache.save_session(session_id, state, settings.session_ttl_seconds)
+            raise
+
+
+async def _enqueue_resume(cache: AsyncRedisCache, session_id: str, state: dict) -> str:
+    if settings.worker_mode == "async":
+        task_id = str(uuid.uuid4())
+        await enqueue_job(
+            cache,
+            task_id,
+            session_id,
+            state["user_input"],
+            state,
+            lane=agent_task_lane(state, inline_pipeline=True),
+        )
+        return task_id
+
+    if state["awaiting_user_input"]:
+        return process_agent_task.apply_async(
+            kwargs={
+                "session_id": session_id,
+                "task": state["user_input"],
+                "existing_state": state,
+            },
+            queue=agent_task_queue(state),
+        ).id
+
+    return process_pipeline_task.apply_async(
+        kwargs={"session_id": session_id, "state": state}, queue=stage_queue("pipeline")
+    ).id
+
+
+@app.websocket("/v1/discovery/ws")
+async def discovery_socket(websocket: WebSocket):
+    """
+    Discovery sohbeti için WebSocket: turlar worker'a gitmeden API'de çalışır.
+
+    İlk mesaj {"task": ..., "session_id": opsiyonel}, sonrakiler {"answer": ...}.
+    Sunucu soruyu `token` mesajlarıyla akıtır, ardından `question` gönderir.
+    Discovery bitince pipeline worker'a verilir ve `discovery_complete`
+    mesajındaki task_id ile /v1/tasks/{id}/events üzerinden izlenir. İş
+    problemi dışındaki intent'ler doğrudan worker'a gider (`task_queued`).
+    """
+    await websocket.accept()
+    cache = get_async_redis_cache()
+    workflow = get_advisor_workflow()
+
+    async def send_token(text: str):
+        await websocket.send_json({"type": "token", "text": text})
+
+    disconnected = False
+    try:
+        opening = await websocket.receive_json()
+        if await _socket_rate_limited(websocket):
+            return
+        task = (opening.get("task") or "").strip()
+        if not task:
+            await websocket.send_json({"type": "error", "message": "Task cannot be empty"})
+            return
+
+        if opening.get("session_id"):
+            session_id = opening["session_id"]
+            state = await cache.get_session(session_id)
+            if not state or not state.get("awaiting_user_input"):
+                await websocket.send_json(
+                    {"type": "error", "message": "Session not found or expired"}
+                )
+                return
+            state = await workflow.continue_session_async(state, task, on_token=send_token)
+        else:
+            retry_after = await _admission_retry_after()
+            if retry_after is not None:
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "message": "Service is over capacity, retry later",
+                        "retry_after": retry_after,
+                    }
+                )
+                return
+
+            session_id = str(uuid.uuid4())
+            with LogContext(session_id=session_id, agent="api"):
+                logger.info(f"Discovery socket opened: {task[:50]}...")
+            state = await workflow.start_session_async(session_id, task, on_token=send_token)
+
+            if state["intent"] != "business_problem" and not state.get("error"):
+                # Intent burada belirlendi; worker tekrar sınıflandırmaz
+                task_id = await _enqueue_peer_task(cache, session_id, task, state)
+                await websocket.send_json(
+                    {"type": "task_queued", "session_id": session_id, "task_id": task_id}
+                )
+                return
+
+        while await _send_discovery_turn(websocket, session_id, state):
+            message = await websocket.receive_json()
+            if await _socket_rate_limited(websocket):
+                return
+            answer = (message.get("answer") or "").strip()
+            if not answer:
+                await websocket.send_json({"type": "error", "message": "Answer cannot be empty"})
+                continue
+            state = await workflow.continue_session_async(state, answer, on_token=send_token)
+
+    except WebSocketDisconnect:
+        disconnected = True
+        logger.info("Discovery socket disconnected")
+    finally:
+        if not disconnected:
+            await websocket.close()
+
+
+async def _enqueue_peer_task(
+    cache: AsyncRedisCache, session_id: str, task: str, state: WorkflowState
+) -> str:
+    if settings.worker_mode == "async":
+        task_id = str(uuid.uuid4())
+        await enqueue_job(
+            cache,
+            task_id,
+            session_id,
+            task,
+            lane="fast",
+            intent=state["intent"],
+            intent_source=state["intent_source"],
+        )
+        return task_id
+
+    return process_agent_task.apply_async(
+        kwargs={
+            "session_id": session_id,
+            "task": task,
+            "intent": state["intent"],
+            "intent_source": state["intent_source"],
+        },
+        queue=stage_queue("peer"),
+    ).id
+
+
+async def _socket_rate_limited(websocket: WebSocket) -> bool:
+    """
+    slowapi WebSocket route'larını sınırlamaz; her mesaj IP başına ayrı bir
+    "discovery_socket" limitinden, /v1/agent/execute ile aynı oranda sayılır.
+    Aşıldıysa hata gönderilir.
+    """
+    if not limiter.enabled:
+        return False
+
+    client_ip = websocket.client.host if websocket.client else "127.0.0.1"
+    try:
+        allowed = await asyncio.to_thread(
+            limiter.limiter.hit,
+            parse_rate_limit(settings.rate_limit_execute),
+            "discovery_socket",
+            client_ip,
+        )
+    except Exception as limit_error:
+        logger.warning(f"WebSocket rate limit check failed: {limit_error}")
+        return False
+
+    if not allowed:
+        await websocket.send_json(
+            {"type": "error", "message": f"Rate limit exceeded: {settings.rate_limit_execute}"}
+        )
+    return not allowed
+
+
+async def _admission_retry_after() -> int | None:
+    # Yeni session hem fast lane'de cevap hem sonra bulk lane'de pipeline bekler
+    return await asyncio.to_thread(get_admission_controller().retry_after, ("fast", "bulk"))
+
+
+async def _send_discovery_turn(websocket: WebSocket, session_id: str, state: WorkflowState) -> bool:
+    """Turun sonucunu client'a iletir; yeni cevap bekleniyorsa True döner."""
+    if state.get("error"):
+        await websocket.send_json({"type": "error", "message": state["error"]})
+        return False
+
+    cache = get_async_redis_cache()
+    if state["awaiting_user_input"]:
+        # HTTP /v1/agent/execute ile de devam edilebilsin diye session store'a yazılır
+        await cache.save_session(session_id, dict(state), settings.session_ttl_seconds)
+        await websocket.send_json(
+            {
+                "type": "question",
+                "session_id": session_id,
+                "question": state["discovery_question"],
+                "question_number": len(state["discovery_session"]["conversation_turns"]) + 1,
+            }
+        )
+        return True
+
+    # Son turda awaiting_user_input=True ile yazılan session kalmasın; pipeline
+    # bitince silinir, hata alırsa resume için üzerine yazılır
+    await cache.save_session(session_id, dict(state), settings.session_ttl_seconds)
+    if settings.worker_mode == "async":
+        task_id = str(uuid.uuid4())
+        await enqueue_job(cache, task_id, session_id, state["user_input"], dict(state), lane="bulk")
+    else:
+        task_id = process_pipeline_task.apply_async(
+            kwargs={"session_id": session_id, "state": dict(state)},
+            queue=stage_queue("pipeline"),
+        ).id
+    await websocket.send_json(
+        {
+            "type": "discovery_complete",
+            "session_id": session_id,
+            "task_id": task_id,
+            "discovery_output": state["discovery_output"],
+        }
+    )
+    return False
+
+
 def _build_response_dict(session_id: str, state: dict) -> dict:
     if state.get("error"):
         return {
@@ -0,0 +1,87 @@
+from functools import lru_cache
+
+from app.cache import RedisCache, get_redis_cache
+from app.logging import get_logger
+
+logger = get_logger()
+
+
+class MetricsRecorder:
+    """
+    Redis üzerinde paylaşılan basit sayaçlar ve gözlemler.
+
+    Counter'lar tek bir hash'te tutulur; gözlemler (latency vb.) sum/count
+    olarak toplanır ve percentile için son N örnek bir listede saklanır.
+    Redis yoksa kayıt sessizce atlanır — metrik yüzünden istek düşmemeli.
+    """
+
+    COUNTERS_KEY = "metrics:counters"
+    SAMPLES_PREFIX = "metrics:samples:"
+
+    def __init__(self, redis_cache: RedisCache, max_samples: int = 500):
+        self._redis_cache = redis_cache
+        self._max_samples = max_samples
+
+    def incr(self, name: str, amount: float = 1):
+        client = self._redis_cache.client
+        if client is None:
+            return
+
+        try:
+            client.hincrbyfloat(self.COUNTERS_KEY, name, amount)
+        except Exception as metrics_error:
+            logger.debug(f"Metric write failed: {metrics_error}")
+
+    def observe(self, name: str, value: float):
+        client = self._redis_cache.client
+        if client is None:
+            return
+
+        try:
+            pipe = client.pipeline()
+            pipe.hincrbyfloat(self.COUNTERS_KEY, f"{name}:sum", value)
+            pipe.hincrbyfloat(self.COUNTERS_KEY, f"{name}:count", 1)
+            pipe.lpush(f"{self.SAMPLES_PREFIX}{name}", value)
+            pipe.ltrim(f"{self.SAMPLES_PREFIX}{name}", 0, self._max_samples - 1)
+            pipe.execute()
+        except Exception as metrics_error:
+            logger.debug(f"Metric write failed: {metrics_error}")
+
+    def percentile(self, name: str, quantile: float, min_samples: int = 1) -> float | None:
+        client = self._redis_cache.client
+        if client is None:
+            return None
+
+        try:
+            samples = sorted(float(v) for v in client.lrange(f"{self.SAMPLES_PREFIX}{name}", 0, -1))
+        except Exception:
+            return None
+
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(int(quantile * len(samples)), len(samples) - 1)
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        client = self._redis_cache.client
+        if client is None:
+            return {"counters": {}, "percentiles": {}}
+
+        counters = {
+            name: float(value) for name, value in client.hgetall(self.COUNTERS_KEY).items()
+        }
+
+        percentiles = {}
+        for sample_key in client.scan_iter(match=f"{self.SAMPLES_PREFIX}*"):
+            name = sample_key[len(self.SAMPLES_PREFIX):]
+            percentiles[name] = {
+                "p50": self.percentile(name, 0.5),
+                "p95": self.percentile(name, 0.95),
+            }
+
+        return {"counters": counters, "percentiles": percentiles}
+
+
+@lru_cache(maxsize=1)
+def get_metrics() -> MetricsRecorder:
+    return MetricsRecorder(get_redis_cache())
@@ -11,7 +11,10 @@ class ConversationLog(BaseModel):
 
     session_id: str
     user_input: str
+    initial_input: str | None = None  # session'ın ilk mesajı (intent modeli eğitimi için)
     intent: str
+    # "llm" ya da "local" (lokal modelin kendi tahmini); eğitimde sadece llm/human kullanılır
+    intent_source: str | None = None
     agent_flow: list[str]
     final_response: dict[str, Any]
     created_at: datetime = Field(default_factory=utc_now)
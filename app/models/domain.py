@@ -39,6 +39,18 @@ class DiscoveryOutput(BaseModel):
     conversation_turns: list[ConversationTurn] = Field(default_factory=list)
 
 
+class DiscoverySession(BaseModel):
+    """Discovery konuşmasının serileştirilebilir state'i; her turda WorkflowState'ten yeniden kurulur."""
+
+    initial_problem: str
+    response_language: str = "Turkish"
+    current_question: str = ""
+    conversation_turns: list[ConversationTurn] = Field(default_factory=list)
+    # İlk `summarized_turns` tur `summary`'ye katlandı; soru prompt'una sadece özet + kalanlar girer
+    summary: str = ""
+    summarized_turns: int = 0
+
+
 class ProblemNode(BaseModel):
     main_cause: str
     sub_causes: list[str]
@@ -97,10 +109,41 @@ class RiskAnalysis(BaseModel):
     risks: list[RiskDetail] = Field(description="Detaylandırılmış riskler")
     overall_risk_level: RiskLevel = Field(description="Genel risk seviyesi")
     top_priority_risk: str = Field(description="En öncelikli risk")
+
+
+class ResearchPoll(BaseModel):
+    delay_seconds: float = Field(description="Poll öncesi bekleme")
+    request_seconds: float = Field(description="get_research çağrı süresi")
+    status: str
+
+
+class ResearchTimings(BaseModel):
+    """elapsed_seconds'ın faz kırılımı — polling planını production verisiyle ayarlamak için."""
+    submit_seconds: float = 0
+    wait_seconds: float = 0
+    poll_seconds: float = 0
+    polls: list[ResearchPoll] = Field(default_factory=list)
+
+    def record_poll(self, poll: ResearchPoll):
+        self.polls.append(poll)
+        self.wait_seconds = round(self.wait_seconds + poll.delay_seconds, 3)
+        self.poll_seconds = round(self.poll_seconds + poll.request_seconds, 3)
+
+
+class SummaryTimings(BaseModel):
+    """Research özetinin faz kırılımı; `single` modda sadece reduce (tek çağrı) var."""
+    mode: str = "single"  # single, map_reduce
+    chunks: int = 1
+    map_seconds: float = 0
+    reduce_seconds: float = 0
+
+
 class ResearchResult(BaseModel):
     content: str = ""
     sources: list[ResearchSource] = Field(default_factory=list)
     elapsed_seconds: float = 0
+    timings: ResearchTimings = Field(default_factory=ResearchTimings)
+    from_cache: bool = False
     error: str | None = None
 
     @computed_field
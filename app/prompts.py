@@ -22,6 +22,8 @@ def load_prompt(prompt_name: str) -> dict[str, Any]:
             )
     prompt_data.setdefault("temperature", 0.7)
     prompt_data.setdefault("max_tokens", 1500)
+    prompt_data.setdefault("cache", False)
+    prompt_data.setdefault("cache_ttl_seconds", 3600)
     return prompt_data
 
 
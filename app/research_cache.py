@@ -0,0 +1,206 @@
+import hashlib
+import json
+import random
+import time
+import zlib
+from functools import lru_cache
+
+from app.cache import RedisCache, get_redis_cache
+from app.config import get_settings
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+from app.models.domain import ResearchResult
+from app.utils import normalize_text
+
+logger = get_logger()
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def query_shingles(query: str, size: int = 4) -> set[str]:
+    normalized = normalize_text(query)
+    if len(normalized) <= size:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def _same_stem(word: str, other: str) -> bool:
+    # Ek farkı (kim / kimdir, türkiye / türkiyede) aynı kelime sayılır
+    shorter, longer = sorted((word, other), key=len)
+    return len(shorter) >= 3 and longer.startswith(shorter)
+
+
+def query_terms_match(query: str, other: str) -> bool:
+    """
+    Near-duplicate için kelime kontrolü: sayılar/yıllar birebir aynı olmalı,
+    diğer kelimelerin her birinin karşı sorguda aynı kökten bir karşılığı
+    olmalı. Karakter benzerliği yüksek olsa da "Turkey" / "Germany" ya da
+    2024 / 2023 farkı ayrı soru demektir.
+    """
+    words, other_words = set(normalize_text(query).split()), set(normalize_text(other).split())
+    numbers = {word for word in words if any(char.isdigit() for char in word)}
+    other_numbers = {word for word in other_words if any(char.isdigit() for char in word)}
+    if numbers != other_numbers:
+        return False
+
+    return all(
+        any(_same_stem(word, candidate) for candidate in other_words - other_numbers)
+        for word in words - other_words
+    ) and all(
+        any(_same_stem(word, candidate) for candidate in words - numbers)
+        for word in other_words - words
+    )
+
+
+def query_fingerprint(query: str) -> str:
+    """Normalize edilmiş sorgunun hash'i (büyük/küçük harf, noktalama fark etmez)."""
+    return hashlib.sha1(normalize_text(query).encode("utf-8")).hexdigest()
+
+
+class MinHasher:
+    """Karakter shingle'ları için MinHash imzası (Jaccard benzerliği tahmini)."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._params = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, shingles: set[str]) -> list[int]:
+        hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles] or [0]
+        return [
+            min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in self._params
+        ]
+
+    @staticmethod
+    def similarity(first: list[int], second: list[int]) -> float:
+        matches = sum(a == b for a, b in zip(first, second))
+        return matches / max(len(first), 1)
+
+
+class ResearchCache:
+    """
+    Tavily research sonuçları için Redis cache.
+
+    Normalize edilmiş sorgu ile birebir eşleşme önce denenir; yoksa MinHash
+    LSH band'leri üzerinden aday bulunup tahmini Jaccard benzerliği eşik
+    üstündeyse ve sayılar/özel isimler kelime bazında tutuyorsa
+    (`query_terms_match`) near-duplicate olarak servis edilir. Tazelik TTL ile sağlanır.
+    """
+
+    ENTRY_PREFIX = "research_cache:entry:"
+    BAND_PREFIX = "research_cache:band:"
+
+    def __init__(
+        self,
+        redis_cache: RedisCache,
+        metrics: MetricsRecorder,
+        enabled: bool = True,
+        ttl_seconds: int = 21600,
+        similarity_threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+    ):
+        self._redis_cache = redis_cache
+        self._metrics = metrics
+        self._enabled = enabled
+        self._ttl_seconds = ttl_seconds
+        self._similarity_threshold = similarity_threshold
+        self._hasher = MinHasher(num_perm=num_perm)
+        self._bands = bands
+        self._rows = num_perm // bands
+
+    def lookup(self, query: str) -> ResearchResult | None:
+        client = self._redis_cache.client
+        if client is None or not self._enabled:
+            return None
+
+        try:
+            entry = self._find_entry(query)
+        except Exception as cache_error:
+            logger.warning(f"Research cache read failed: {cache_error}")
+            return None
+
+        if entry is None:
+            self._metrics.incr("research_cache:miss")
+            return None
+
+        cached_result = ResearchResult(**entry["result"])
+        self._metrics.incr("research_cache:hit")
+        self._metrics.incr("research_cache:saved_seconds", cached_result.elapsed_seconds)
+        logger.info(f"Research cache hit: '{entry['query'][:50]}'")
+        return cached_result.model_copy(update={"from_cache": True})
+
+    def store(self, query: str, research_output: ResearchResult):
+        client = self._redis_cache.client
+        if client is None or not self._enabled:
+            return
+        if not research_output.is_successful or research_output.from_cache:
+            return
+
+        signature = self._hasher.signature(query_shingles(query))
+        entry_id = query_fingerprint(query)
+        entry = {
+            "query": query,
+            "signature": signature,
+            "result": research_output.model_dump(exclude={"source_urls", "is_successful"}),
+            "created_at": time.time(),
+        }
+
+        try:
+            pipe = client.pipeline()
+            pipe.setex(f"{self.ENTRY_PREFIX}{entry_id}", self._ttl_seconds, json.dumps(entry))
+            for band_key in self._band_keys(signature):
+                pipe.sadd(band_key, entry_id)
+                pipe.expire(band_key, self._ttl_seconds)
+            pipe.execute()
+        except Exception as cache_error:
+            logger.warning(f"Research cache write failed: {cache_error}")
+
+    def _find_entry(self, query: str) -> dict | None:
+        client = self._redis_cache.client
+
+        exact = client.get(f"{self.ENTRY_PREFIX}{query_fingerprint(query)}")
+        if exact:
+            return json.loads(exact)
+
+        signature = self._hasher.signature(query_shingles(query))
+        candidate_ids = set()
+        for band_key in self._band_keys(signature):
+            candidate_ids.update(client.smembers(band_key))
+        if not candidate_ids:
+            return None
+
+        best_entry, best_similarity = None, self._similarity_threshold
+        raw_entries = client.mget([f"{self.ENTRY_PREFIX}{cid}" for cid in candidate_ids])
+        for raw_entry in raw_entries:
+            if raw_entry is None:  # TTL dolmuş, band set'inde kalmış
+                continue
+            entry = json.loads(raw_entry)
+            similarity = MinHasher.similarity(signature, entry["signature"])
+            if similarity >= best_similarity and query_terms_match(query, entry["query"]):
+                best_entry, best_similarity = entry, similarity
+
+        return best_entry
+
+    def _band_keys(self, signature: list[int]) -> list[str]:
+        keys = []
+        for band in range(self._bands):
+            rows = signature[band * self._rows:(band + 1) * self._rows]
+            band_hash = hashlib.sha1(",".join(map(str, rows)).encode()).hexdigest()[:16]
+            keys.append(f"{self.BAND_PREFIX}{band}:{band_hash}")
+        return keys
+
+
+@lru_cache(maxsize=1)
+def get_research_cache() -> ResearchCache:
+    settings = get_settings()
+    return ResearchCache(
+        redis_cache=get_redis_cache(),
+        metrics=get_metrics(),
+        enabled=settings.research_cache_enabled,
+        ttl_seconds=settings.research_cache_ttl_seconds,
+        similarity_threshold=settings.research_cache_similarity_threshold,
+    )
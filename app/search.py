@@ -1,44 +1,164 @@
-
 import asyncio
+import random
 import time
+from dataclasses import dataclass
 from functools import lru_cache
 
 from tavily import TavilyClient
 
 from app.config import get_settings
-from app.models.domain import ResearchResult, ResearchSource
+from app.logging import get_logger
+from app.models.domain import ResearchPoll, ResearchResult, ResearchSource, ResearchTimings
+
+logger = get_logger()
+
+RESEARCH_PENDING = "pending"
+
+
+@dataclass(frozen=True)
+class PollingSchedule:
+    """
+    Tavily status polling planı.
+
+    İlk `fast_probes` kontrol kısa aralıkla yapılır (kısa job'lar beklemesin),
+    sonra aralık `backoff` ile büyür ve `max_interval`'da sabitlenir (uzun
+    job'lar gereksiz API çağrısı yapmasın). Toplam bekleme `deadline` ile sınırlı.
+    """
+
+    first_delay: float = 0.5
+    fast_probes: int = 2
+    backoff: float = 1.6
+    max_interval: float = 8.0
+    jitter: float = 0.2
+    deadline: float = 180.0
+    max_attempts: int = 60
+
+    def delay(self, attempt: int) -> float:
+        if attempt < self.fast_probes:
+            base = self.first_delay
+        else:
+            exponent = attempt - self.fast_probes + 1
+            base = min(self.first_delay * self.backoff**exponent, self.max_interval)
+
+        if self.jitter:
+            base *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(base, 0.0)
+
+    def is_exhausted(self, attempt: int, waited: float) -> bool:
+        return attempt >= self.max_attempts or waited >= self.deadline
 
 
 class TavilyResearchService:
     def __init__(
-        self, tavily_api_key: str, polling_interval: int, max_polling_attempts: int
+        self,
+        tavily_api_key: str,
+        polling_schedule: PollingSchedule,
+        api_base_url: str | None = None,
+        tavily_client: TavilyClient | None = None,
     ):
-        self.tavily_client = TavilyClient(api_key=tavily_api_key)
-        self.polling_interval = polling_interval
-        self.max_polling_attempts = max_polling_attempts
+        # api_base_url / tavily_client: lokal fake Tavily ile test için
+        self.tavily_client = tavily_client or TavilyClient(
+            api_key=tavily_api_key, api_base_url=api_base_url
+        )
+        self.polling_schedule = polling_schedule
 
     def research(self, query: str, model: str = "mini") -> ResearchResult:
         start_time = time.time()
+        timings = ResearchTimings()
 
-        tavily_task = self._create_research_task(query, model)
+        tavily_task = self.submit_research(query, model, timings)
 
         if tavily_task.get("error"):
-            return ResearchResult(error=tavily_task["error"])
+            return ResearchResult(error=tavily_task["error"], timings=timings)
 
-        task_id = tavily_task.get("request_id")
-        if not task_id:
-            return ResearchResult(error="Tavily task_id döndürmedi")
+        task_id = tavily_task["request_id"]
+        completed_research = self._wait_for_completion(task_id, timings)
 
-        completed_research = self._wait_for_completion(task_id)
+        elapsed = time.time() - start_time
+        return self.build_result(completed_research, elapsed, timings)
 
-        if completed_research.get("error"):
-            return ResearchResult(error=completed_research["error"])
+    async def research_async(self, query: str, model: str = "mini") -> ResearchResult:
+        """
+        research() ile aynı akış; polling aralarında thread tutulmaz
+        (asyncio.sleep), sadece HTTP çağrıları thread'de yapılır.
+        """
+        start_time = time.time()
+        timings = ResearchTimings()
+
+        tavily_task = await asyncio.to_thread(self.submit_research, query, model, timings)
+
+        if tavily_task.get("error"):
+            return ResearchResult(error=tavily_task["error"], timings=timings)
+
+        completed_research = await self._wait_for_completion_async(
+            tavily_task["request_id"], timings
+        )
 
         elapsed = time.time() - start_time
-        return self._parse_tavily_response(completed_research, elapsed)
+        return self.build_result(completed_research, elapsed, timings)
 
-    async def research_async(self, query: str, model: str = "mini") -> ResearchResult:
-        return await asyncio.to_thread(self.research, query, model)
+    def submit_research(
+        self, query: str, model: str = "mini", timings: ResearchTimings | None = None
+    ) -> dict:
+        """Research task'ını başlatır, sonucu beklemez."""
+        submit_start = time.time()
+        tavily_task = self._create_research_task(query, model)
+        if timings is not None:
+            timings.submit_seconds = round(time.time() - submit_start, 3)
+
+        if tavily_task.get("error"):
+            return tavily_task
+
+        if not tavily_task.get("request_id"):
+            return {"error": "Tavily task_id döndürmedi"}
+
+        return tavily_task
+
+    def check_research(
+        self, task_id: str, timings: ResearchTimings | None = None, delay: float = 0.0
+    ) -> dict:
+        """
+        Tek seferlik status kontrolü (sleep yok).
+
+        Tamamlandıysa Tavily response'u, devam ediyorsa {"status": "pending"},
+        hata varsa {"error": ...} döner. `timings` verilirse poll kaydedilir.
+        """
+        request_start = time.time()
+        research_status = self._fetch_status(task_id)
+
+        if timings is not None:
+            request_seconds = time.time() - request_start
+            if research_status.get("error"):
+                poll_status = "error"
+            else:
+                poll_status = research_status.get("status", "completed")
+            timings.record_poll(
+                ResearchPoll(
+                    delay_seconds=round(delay, 3),
+                    request_seconds=round(request_seconds, 3),
+                    status=poll_status,
+                )
+            )
+
+        return research_status
+
+    def build_result(
+        self, research_status: dict, elapsed: float, timings: ResearchTimings | None = None
+    ) -> ResearchResult:
+        timings = timings or ResearchTimings()
+        logger.info(
+            f"Research finished in {elapsed:.2f}s - submit: {timings.submit_seconds}s, "
+            f"wait: {timings.wait_seconds:.2f}s, poll: {timings.poll_seconds:.2f}s, "
+            f"polls: {len(timings.polls)}"
+        )
+
+        if research_status.get("error"):
+            return ResearchResult(error=research_status["error"], timings=timings)
+
+        return self._parse_tavily_response(research_status, elapsed, timings)
+
+    def timeout_status(self) -> dict:
+        return {"error": f"Research {self.polling_schedule.deadline:.0f} saniyede tamamlanmadı"}
 
     def _create_research_task(self, query: str, model: str) -> dict:
         try:
@@ -46,29 +166,61 @@ class TavilyResearchService:
         except Exception as tavily_error:
             return {"error": f"Research task oluşturulamadı: {tavily_error}"}
 
-    def _wait_for_completion(self, task_id: str) -> dict:
-        for _ in range(self.max_polling_attempts):
-            time.sleep(self.polling_interval)
+    def _fetch_status(self, task_id: str) -> dict:
+        try:
+            tavily_status = self.tavily_client.get_research(task_id)
+        except Exception as polling_error:
+            return {"error": f"Polling hatası: {polling_error}"}
+
+        current_status = tavily_status.get("status")
+
+        if current_status == "completed":
+            return tavily_status
 
-            try:
-                tavily_status = self.tavily_client.get_research(task_id)
-            except Exception as polling_error:
-                return {"error": f"Polling hatası: {polling_error}"}
+        if current_status == "failed":
+            failure_reason = tavily_status.get("error", "Bilinmeyen hata")
+            return {"error": f"Tavily research başarısız: {failure_reason}"}
 
-            current_status = tavily_status.get("status")
+        return {"status": RESEARCH_PENDING}
 
-            if current_status == "completed":
-                return tavily_status
+    def _wait_for_completion(self, task_id: str, timings: ResearchTimings) -> dict:
+        schedule = self.polling_schedule
+        wait_start = time.time()
+        attempt = 0
 
-            if current_status == "failed":
-                failure_reason = tavily_status.get("error", "Bilinmeyen hata")
-                return {"error": f"Tavily research başarısız: {failure_reason}"}
+        while not schedule.is_exhausted(attempt, time.time() - wait_start):
+            remaining = schedule.deadline - (time.time() - wait_start)
+            delay = min(schedule.delay(attempt), max(remaining, 0.0))
+            time.sleep(delay)
 
-        max_wait = self.max_polling_attempts * self.polling_interval
-        return {"error": f"Research {max_wait} saniyede tamamlanmadı"}
+            research_status = self.check_research(task_id, timings, delay)
+            attempt += 1
+
+            if research_status.get("status") != RESEARCH_PENDING:
+                return research_status
+
+        return self.timeout_status()
+
+    async def _wait_for_completion_async(self, task_id: str, timings: ResearchTimings) -> dict:
+        schedule = self.polling_schedule
+        wait_start = time.time()
+        attempt = 0
+
+        while not schedule.is_exhausted(attempt, time.time() - wait_start):
+            remaining = schedule.deadline - (time.time() - wait_start)
+            delay = min(schedule.delay(attempt), max(remaining, 0.0))
+            await asyncio.sleep(delay)
+
+            research_status = await asyncio.to_thread(self.check_research, task_id, timings, delay)
+            attempt += 1
+
+            if research_status.get("status") != RESEARCH_PENDING:
+                return research_status
+
+        return self.timeout_status()
 
     def _parse_tavily_response(
-        self, tavily_response: dict, elapsed: float
+        self, tavily_response: dict, elapsed: float, timings: ResearchTimings
     ) -> ResearchResult:
         parsed_sources = []
 
@@ -84,16 +236,28 @@ class TavilyResearchService:
             content=tavily_response.get("content", ""),
             sources=parsed_sources,
             elapsed_seconds=round(elapsed, 2),
+            timings=timings,
         )
 
 
+def get_polling_schedule() -> PollingSchedule:
+    settings = get_settings()
+    return PollingSchedule(
+        first_delay=settings.tavily_poll_first_delay,
+        fast_probes=settings.tavily_poll_fast_probes,
+        backoff=settings.tavily_poll_backoff,
+        max_interval=settings.tavily_poll_max_interval,
+        jitter=settings.tavily_poll_jitter,
+        deadline=settings.tavily_poll_deadline_seconds,
+        max_attempts=settings.tavily_max_polling_attempts,
+    )
+
+
 @lru_cache(maxsize=1)
 def get_research_service() -> TavilyResearchService:
     settings = get_settings()
     return TavilyResearchService(
         tavily_api_key=settings.tavily_api_key,
-        polling_interval=settings.tavily_polling_interval,
-        max_polling_attempts=settings.tavily_max_polling_attempts,
+        polling_schedule=get_polling_schedule(),
+        api_base_url=settings.tavily_api_base_url,
     )
-
-
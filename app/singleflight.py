@@ -0,0 +1,258 @@
+import asyncio
+import json
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from functools import lru_cache
+from typing import Any
+
+from app.cache import AsyncRedisCache, RedisCache, get_async_redis_cache, get_redis_cache
+from app.config import get_settings
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+
+logger = get_logger()
+
+# Lease sadece sahibi tarafından silinir (süresi dolup başkası aldıysa dokunma)
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_FAILED = ""
+
+
+class SingleFlight:
+    """
+    Worker'lar arası single-flight: aynı key için aynı anda tek hesaplama.
+
+    İlk gelen Redis'te kısa bir lease alır (SET NX EX) ve işi yapar; diğerleri
+    pub/sub kanalında sonucu bekler. Sonuç `result_ttl` boyunca saklanır, o
+    pencerede gelenler de beklemeden paylaşılan sonucu alır. Lider hata alırsa
+    ya da lease dolarsa bekleyenler işi kendileri yapar — coalescing sadece
+    optimizasyon, doğruluk ona bağlı değil. Redis yoksa doğrudan hesaplanır.
+
+    `run_async`'te bekleme `async_cache` (redis.asyncio) üzerinden loop'ta
+    yapılır; thread'de sadece lease denemesi çalışır. Abonelik slotu yoksa
+    key'ler `poll_interval` ile yoklanır, async bağlantı yoksa beklenmez.
+    """
+
+    LEASE_PREFIX = "singleflight:lease:"
+    RESULT_PREFIX = "singleflight:result:"
+    CHANNEL_PREFIX = "singleflight:done:"
+
+    def __init__(
+        self,
+        redis_cache: RedisCache,
+        metrics: MetricsRecorder,
+        enabled: bool = True,
+        poll_interval: float = 0.5,
+        async_cache: AsyncRedisCache | None = None,
+    ):
+        self._redis_cache = redis_cache
+        self._async_cache = async_cache
+        self._metrics = metrics
+        self._enabled = enabled
+        self._poll_interval = poll_interval
+
+    def run(
+        self,
+        name: str,
+        key: str,
+        compute: Callable[[], Any],
+        lease_seconds: float = 120,
+        result_ttl: float = 15,
+        share: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        """`compute` sonucu JSON serileştirilebilir olmalı."""
+        token, shared = self._join(name, key, lease_seconds)
+        if shared is not None:
+            return json.loads(shared)
+        if token is None:
+            return compute()
+
+        try:
+            result = compute()
+        except Exception:
+            self._finish(key, token, _FAILED, result_ttl)
+            raise
+
+        self._finish(key, token, self._encode(result, share), result_ttl)
+        return result
+
+    async def run_async(
+        self,
+        name: str,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        lease_seconds: float = 120,
+        result_ttl: float = 15,
+        share: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        token, shared = await self._join_async(name, key, lease_seconds)
+        if shared is not None:
+            return json.loads(shared)
+        if token is None:
+            return await compute()
+
+        try:
+            result = await compute()
+        except Exception:
+            await asyncio.to_thread(self._finish, key, token, _FAILED, result_ttl)
+            raise
+
+        await asyncio.to_thread(
+            self._finish, key, token, self._encode(result, share), result_ttl
+        )
+        return result
+
+    def _join(self, name: str, key: str, lease_seconds: float) -> tuple[str | None, str | None]:
+        """
+        (token, shared) döner: token → lider biziz; shared → paylaşılan sonuç;
+        ikisi de None → coalescing yok, kendimiz hesaplarız.
+        """
+        token, shared, follow = self._try_lead(name, key, lease_seconds)
+        if not follow:
+            return token, shared
+
+        try:
+            shared = self._wait(key, lease_seconds)
+        except Exception as flight_error:
+            logger.warning(f"Single-flight unavailable for {name}: {flight_error}")
+            return None, None
+        return None, self._followed(name, shared)
+
+    async def _join_async(
+        self, name: str, key: str, lease_seconds: float
+    ) -> tuple[str | None, str | None]:
+        token, shared, follow = await asyncio.to_thread(
+            self._try_lead, name, key, lease_seconds
+        )
+        if not follow:
+            return token, shared
+
+        try:
+            shared = await self._wait_async(key, lease_seconds)
+        except Exception as flight_error:
+            logger.warning(f"Single-flight unavailable for {name}: {flight_error}")
+            return None, None
+        return None, await asyncio.to_thread(self._followed, name, shared)
+
+    def _try_lead(
+        self, name: str, key: str, lease_seconds: float
+    ) -> tuple[str | None, str | None, bool]:
+        """Paylaşılan sonuç ya da lease; ikisi de yoksa (lease başkasında) follow=True."""
+        client = self._redis_cache.client
+        if client is None or not self._enabled:
+            return None, None, False
+
+        try:
+            shared = client.get(f"{self.RESULT_PREFIX}{key}")
+            if shared:
+                self._metrics.incr(f"singleflight:{name}:shared")
+                return None, shared, False
+
+            token = uuid.uuid4().hex
+            if client.set(f"{self.LEASE_PREFIX}{key}", token, nx=True, ex=max(int(lease_seconds), 1)):
+                self._metrics.incr(f"singleflight:{name}:leader")
+                return token, None, False
+        except Exception as flight_error:
+            logger.warning(f"Single-flight unavailable for {name}: {flight_error}")
+            return None, None, False
+
+        return None, None, True
+
+    def _followed(self, name: str, shared: str | None) -> str | None:
+        if shared:
+            self._metrics.incr(f"singleflight:{name}:coalesced")
+            return shared
+
+        self._metrics.incr(f"singleflight:{name}:fallback")
+        return None
+
+    def _wait(self, key: str, timeout: float) -> str | None:
+        client = self._redis_cache.client
+        result_key = f"{self.RESULT_PREFIX}{key}"
+        lease_key = f"{self.LEASE_PREFIX}{key}"
+
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f"{self.CHANNEL_PREFIX}{key}")
+        try:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                # Subscribe'dan önce bitmiş olabilir: her turda key'lere de bak
+                shared = client.get(result_key)
+                if shared or not client.exists(lease_key):
+                    return shared
+
+                message = pubsub.get_message(timeout=self._poll_interval)
+                if message is not None:
+                    return message["data"] or None
+            return None
+        finally:
+            pubsub.close()
+
+    async def _wait_async(self, key: str, timeout: float) -> str | None:
+        client = self._async_cache.client if self._async_cache is not None else None
+        if client is None:
+            return None
+
+        result_key = f"{self.RESULT_PREFIX}{key}"
+        lease_key = f"{self.LEASE_PREFIX}{key}"
+        subscriber = self._async_cache.acquire_subscriber()
+        pubsub = None
+        try:
+            if subscriber is not None:
+                pubsub = subscriber.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(f"{self.CHANNEL_PREFIX}{key}")
+
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                shared = await client.get(result_key)
+                if shared or not await client.exists(lease_key):
+                    return shared
+
+                if pubsub is None:
+                    # Abonelik slotu yok: key'ler aralıklarla yoklanır
+                    await asyncio.sleep(self._poll_interval)
+                    continue
+                message = await pubsub.get_message(timeout=self._poll_interval)
+                if message is not None:
+                    return message["data"] or None
+            return None
+        finally:
+            if pubsub is not None:
+                await pubsub.aclose()
+            if subscriber is not None:
+                self._async_cache.release_subscriber()
+
+    def _finish(self, key: str, token: str, payload: str, result_ttl: float):
+        client = self._redis_cache.client
+        try:
+            pipe = client.pipeline()
+            if payload:
+                pipe.setex(f"{self.RESULT_PREFIX}{key}", max(int(result_ttl), 1), payload)
+            pipe.eval(_RELEASE_SCRIPT, 1, f"{self.LEASE_PREFIX}{key}", token)
+            pipe.publish(f"{self.CHANNEL_PREFIX}{key}", payload)
+            pipe.execute()
+        except Exception as flight_error:
+            logger.warning(f"Single-flight result could not be published: {flight_error}")
+
+    @staticmethod
+    def _encode(result: Any, share: Callable[[Any], bool] | None) -> str:
+        if share is not None and not share(result):
+            return _FAILED
+        return json.dumps(result, ensure_ascii=False)
+
+
+@lru_cache(maxsize=1)
+def get_singleflight() -> SingleFlight:
+    settings = get_settings()
+    return SingleFlight(
+        redis_cache=get_redis_cache(),
+        metrics=get_metrics(),
+        enabled=settings.singleflight_enabled,
+        async_cache=get_async_redis_cache(),
+    )
@@ -0,0 +1,92 @@
+import hashlib
+import json
+from functools import lru_cache
+from typing import Any
+
+from app.cache import RedisCache, get_redis_cache
+from app.config import get_settings
+from app.logging import get_logger
+from app.metrics import MetricsRecorder, get_metrics
+
+logger = get_logger()
+
+
+def stage_input_key(stage_name: str, state: dict, input_keys: tuple[str, ...]) -> str:
+    """Stage adı + okuduğu state alanlarının hash'i; girdiler aynıysa çıktı da aynı kabul edilir."""
+    payload = json.dumps(
+        {"stage": stage_name, "inputs": {key: state.get(key) for key in input_keys}},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StageMemo:
+    """
+    Pipeline stage çıktıları için Redis memo.
+
+    Her başarılı stage çıktısı girdilerinden türetilen key altında saklanır.
+    Hata sonrası resume'da (ya da aynı girdilerle tekrar çalıştırmada) biten
+    stage'ler LLM'e tekrar gitmez. Redis yoksa stage normal çalışır.
+    """
+
+    KEY_PREFIX = "stage_memo:"
+
+    def __init__(
+        self,
+        redis_cache: RedisCache,
+        metrics: MetricsRecorder,
+        enabled: bool = True,
+        ttl_seconds: int = 86400,
+    ):
+        self._redis_cache = redis_cache
+        self._metrics = metrics
+        self._enabled = enabled
+        self._ttl_seconds = ttl_seconds
+
+    def get(self, stage_name: str, state: dict, input_keys: tuple[str, ...]) -> Any | None:
+        client = self._redis_cache.client
+        if client is None or not self._enabled or not input_keys:
+            return None
+
+        try:
+            cached = client.get(self._key(stage_name, state, input_keys))
+        except Exception as memo_error:
+            logger.warning(f"Stage memo read failed: {memo_error}")
+            return None
+
+        if cached is None:
+            self._metrics.incr(f"stage_memo:{stage_name}:miss")
+            return None
+
+        self._metrics.incr(f"stage_memo:{stage_name}:hit")
+        logger.info(f"Stage memo hit: {stage_name}")
+        return json.loads(cached)
+
+    def set(self, stage_name: str, state: dict, input_keys: tuple[str, ...], output: Any):
+        client = self._redis_cache.client
+        if client is None or not self._enabled or not input_keys:
+            return
+
+        try:
+            client.setex(
+                self._key(stage_name, state, input_keys),
+                self._ttl_seconds,
+                json.dumps(output, ensure_ascii=False),
+            )
+        except Exception as memo_error:
+            logger.warning(f"Stage memo write failed: {memo_error}")
+
+    def _key(self, stage_name: str, state: dict, input_keys: tuple[str, ...]) -> str:
+        return f"{self.KEY_PREFIX}{stage_name}:{stage_input_key(stage_name, state, input_keys)}"
+
+
+@lru_cache(maxsize=1)
+def get_stage_memo() -> StageMemo:
+    settings = get_settings()
+    return StageMemo(
+        redis_cache=get_redis_cache(),
+        metrics=get_metrics(),
+        enabled=settings.stage_memo_enabled,
+        ttl_seconds=settings.stage_memo_ttl_seconds,
+    )
@@ -0,0 +1,110 @@
+"""
+Stream edilen JSON objesi için artımlı parser.
+
+LLM cevabı token token gelirken top-level alanlardan biri kapandığı anda
+(string/obje/liste bitince, sayı/bool için sonraki virgülde) o alan parse
+edilir ve hedef Pydantic modelindeki tipine göre doğrulanır. Tüm cevabı
+beklemeden alanı okuyabilen iş (örn. risk stage'i) erken başlayabilir.
+Tam cevabın doğrulaması yine `model_validate_json` ile yapılır.
+"""
+
+import json
+from typing import Any
+
+from pydantic import BaseModel, TypeAdapter
+
+
+class IncrementalJSONParser:
+    """
+    `feed` her çağrıda o parçayla tamamlanan alanları döner. İlk `{`'den
+    önceki metin (örn. ```json fence'i) ve modelde olmayan alanlar atlanır.
+    Geçersiz alan değeri ValidationError fırlatır.
+    """
+
+    def __init__(self, model: type[BaseModel]):
+        self._adapters = {
+            name: TypeAdapter(field.annotation) for name, field in model.model_fields.items()
+        }
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._key_start: int | None = None
+        self._key: str | None = None
+        self._value_start: int | None = None
+        self.fields: dict[str, Any] = {}
+        self.closed = False
+
+    def feed(self, text: str) -> dict[str, Any]:
+        self._buffer += text
+        completed: dict[str, Any] = {}
+
+        while self._pos < len(self._buffer) and not self.closed:
+            position = self._pos
+            self._pos += 1
+            self._scan(self._buffer[position], position, completed)
+
+        return completed
+
+    def _scan(self, char: str, position: int, completed: dict[str, Any]):
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    self._close_top_level_string(position, completed)
+            return
+
+        if self._depth == 0:
+            if char == "{":
+                self._depth = 1
+            return
+
+        if char == '"':
+            self._in_string = True
+            if self._depth == 1:
+                if self._key is None:
+                    self._key_start = position
+                else:
+                    self._value_start = position
+        elif char in "{[":
+            if self._depth == 1:
+                self._value_start = position
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._depth == 1:
+                self._complete(position + 1, completed)
+            elif self._depth == 0:
+                # Son alan sayı/bool olabilir: kapanış süslüsü onu da bitirir
+                self._complete(position, completed)
+                self.closed = True
+        elif self._depth == 1:
+            if char == ",":
+                self._complete(position, completed)
+            elif char not in ": \t\r\n" and self._key is not None and self._value_start is None:
+                self._value_start = position
+
+    def _close_top_level_string(self, position: int, completed: dict[str, Any]):
+        if self._key is None:
+            self._key = json.loads(self._buffer[self._key_start : position + 1])
+        else:
+            self._complete(position + 1, completed)
+
+    def _complete(self, end: int, completed: dict[str, Any]):
+        if self._key is None or self._value_start is None:
+            return
+
+        key, raw = self._key, self._buffer[self._value_start : end]
+        self._key = self._key_start = self._value_start = None
+
+        adapter = self._adapters.get(key)
+        if adapter is None:
+            return
+        value = json.loads(raw)
+        adapter.validate_python(value)
+        self.fields[key] = completed[key] = value
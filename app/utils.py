@@ -1,5 +1,8 @@
+import json
 import re
 from datetime import datetime, timezone
+from typing import Any
+
 from lingua import Language, LanguageDetectorBuilder
 
 
@@ -23,6 +26,16 @@ def utc_now() -> datetime:
     return datetime.now(timezone.utc)
 
 
+_NON_WORD = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Küçük harf, noktalama yok, tek boşluk — hashing/eşleştirme için."""
+    lowered = text.replace("İ", "i").lower()
+    return _SPACES.sub(" ", _NON_WORD.sub(" ", lowered)).strip()
+
+
 def clean_llm_json_response(response: str) -> str:
     cleaned = response.strip()
     code_block_match = re.search(
@@ -49,6 +62,45 @@ def clean_llm_json_response(response: str) -> str:
     return cleaned
 
 
+def parse_llm_json(response: str) -> Any:
+    return json.loads(clean_llm_json_response(response))
+
+
+_SECTION_HEADING = re.compile(r"^(?=#{1,6}\s)", re.MULTILINE)
+
+
+def split_sections(text: str, max_chars: int) -> list[str]:
+    """
+    Metni en fazla `max_chars`'lık parçalara böler. Markdown başlıklarından
+    bölünür, sığmayan bölüm paragraflardan (gerekirse karakterden) bölünür;
+    küçük komşu bölümler aynı parçada birleştirilir.
+    """
+    pieces = []
+    for section in _SECTION_HEADING.split(text):
+        if len(section) <= max_chars:
+            pieces.append(section.strip())
+            continue
+        for paragraph in section.split("\n\n"):
+            pieces.extend(
+                paragraph[start:start + max_chars].strip()
+                for start in range(0, len(paragraph), max_chars)
+            )
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        if current and len(current) + len(piece) + 2 > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
 if __name__ == "__main__":
     print("=== detect_language tests ===\n")
 
@@ -1,13 +1,38 @@
 import asyncio
+import time
 
-from celery import Celery
+from celery import Celery, chain, group, states
+from celery.exceptions import Ignore
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_success,
+)
 
-from app.agents.workflow import AdvisorWorkflow, create_workflow_with_checkpointer
+from app.agents.workflow import (
+    AdvisorWorkflow,
+    StageListener,
+    TokenListener,
+    create_workflow_with_checkpointer,
+    stage_events,
+)
 from app.cache import get_redis_cache
 from app.config import get_settings
-from app.db import get_mongodb_service, log_conversation_sync
+from app.db import log_conversation_sync
+from app.events import (
+    TERMINAL_STATUSES,
+    AsyncTaskEventPublisher,
+    TaskEventPublisher,
+    TokenEventBuffer,
+    get_event_publisher,
+)
 from app.logging import LogContext, get_logger
+from app.metrics import get_metrics
 from app.models.db import ConversationLog
+from app.models.domain import ResearchTimings
+from app.search import RESEARCH_PENDING, get_research_service
 
 settings = get_settings()
 logger = get_logger()
@@ -26,6 +51,42 @@ celery_app.conf.update(
     task_soft_time_limit=270,
 )
 
+# API'nin polling ettiği task'lar; status kaydı bunlar için tutulur
+STATUS_TRACKED_TASKS = {"process_agent_task", "process_pipeline_task"}
+
+
+def stage_queue(stage_name: str) -> str:
+    """Stage'in Celery queue'su; tanımlı değilse default queue."""
+    return settings.celery_stage_queues.get(stage_name, celery_app.conf.task_default_queue)
+
+
+def queue_lane(queue: str | None) -> str:
+    """Queue'nun lane'i (fast/bulk); bekleme süresi lane başına ölçülür."""
+    return settings.celery_queue_lanes.get(queue or celery_app.conf.task_default_queue, "bulk")
+
+
+def agent_task_lane(existing_state: dict | None, inline_pipeline: bool) -> str:
+    """
+    Yeni task ve discovery cevapları kısa sürer (fast). Pipeline aynı işte
+    çalışacaksa (resume ya da discovery'yi bitirebilecek cevap) iş bulk'a gider.
+    """
+    if not existing_state or not inline_pipeline:
+        return "fast"
+    if existing_state.get("discovery_output") is not None:
+        return "bulk"
+
+    # Discovery min_questions'tan önce bitmez
+    turns = (existing_state.get("discovery_session") or {}).get("conversation_turns", [])
+    return "bulk" if len(turns) + 1 >= settings.discovery_min_questions else "fast"
+
+
+def agent_task_queue(existing_state: dict | None) -> str:
+    """process_agent_task'ın queue'su; split kapalıyken pipeline inline çalışır."""
+    if agent_task_lane(existing_state, inline_pipeline=not settings.celery_split_stages) == "bulk":
+        return stage_queue("pipeline")
+    return stage_queue("discovery" if existing_state else "peer")
+
+
 _workflow: AdvisorWorkflow | None = None
 
 
@@ -37,24 +98,42 @@ def _get_workflow() -> AdvisorWorkflow:
     return _workflow
 
 
+def _event_listeners(
+    task_id: str, publisher: TaskEventPublisher | AsyncTaskEventPublisher | None = None
+) -> tuple[StageListener, TokenListener]:
+    publisher = publisher or get_event_publisher()
+    token_buffer = TokenEventBuffer(publisher, task_id)
+
+    def publish_stage(stage: str, output: dict):
+        # Stage'in son token'ları stage event'inden önce gitmeli
+        token_buffer.flush()
+        publisher.publish(task_id, "stage", {"stage": stage, "output": output})
+
+    return publish_stage, token_buffer
+
+
+def build_conversation_log(session_id: str, user_input: str, state: dict) -> ConversationLog:
+    discovery_session = state.get("discovery_session") or {}
+    return ConversationLog(
+        session_id=session_id,
+        user_input=user_input,
+        initial_input=discovery_session.get("initial_problem", user_input),
+        intent=state.get("intent", "unknown"),
+        intent_source=state.get("intent_source"),
+        agent_flow=state.get("agent_flow", []),
+        final_response={
+            "discovery_output": state.get("discovery_output"),
+            "problem_tree": state.get("problem_tree"),
+            "action_plan": state.get("action_plan"),
+            "risk_analysis": state.get("risk_analysis"),
+            "business_report": state.get("business_report"),
+        },
+    )
+
+
 def _persist_completed_session(session_id: str, user_input: str, state: dict):
     try:
-        db = get_mongodb_service()
-
-        conversation = ConversationLog(
-            session_id=session_id,
-            user_input=user_input,
-            intent=state.get("intent", "unknown"),
-            agent_flow=state.get("agent_flow", []),
-            final_response={
-                "discovery_output": state.get("discovery_output"),
-                "problem_tree": state.get("problem_tree"),
-                "action_plan": state.get("action_plan"),
-                "risk_analysis": state.get("risk_analysis"),
-                "business_report": state.get("business_report"),
-            },
-        )
-
+        conversation = build_conversation_log(session_id, user_input, state)
         result = log_conversation_sync(conversation)
         if result:
             logger.info(f"Session persisted to MongoDB: {result}")
@@ -67,7 +146,12 @@ def _persist_completed_session(session_id: str, user_input: str, state: dict):
 
 @celery_app.task(bind=True, name="process_agent_task")
 def process_agent_task(
-    self, session_id: str, task: str, existing_state: dict | None = None
+    self,
+    session_id: str,
+    task: str,
+    existing_state: dict | None = None,
+    intent: str | None = None,
+    intent_source: str | None = None,
 ) -> dict:
     with LogContext(session_id=session_id, agent="worker"):
         try:
@@ -75,14 +159,29 @@ def process_agent_task(
             cache = get_redis_cache()
             cache.connect()
 
-            if existing_state and existing_state.get("awaiting_user_input"):
-                logger.info(f"Continuing discovery: {task[:50]}...")
-                state = workflow.continue_session(existing_state, task)
-            else:
-                logger.info(f"New task: {task[:50]}...")
-                state = workflow.run(session_id, task)
+            with stage_events(*_event_listeners(self.request.id)):
+                if existing_state and existing_state.get("awaiting_user_input"):
+                    logger.info(f"Continuing discovery: {task[:50]}...")
+                    state = workflow.continue_session(
+                        existing_state, task, run_pipeline=not settings.celery_split_stages
+                    )
+                else:
+                    logger.info(f"New task: {task[:50]}...")
+                    state = workflow.run(
+                        session_id, task, intent=intent, intent_source=intent_source
+                    )
+
+            if state.get("pending_research"):
+                _park_for_research(cache, self.request.id, session_id, state)
+                raise Ignore()
+
+            if _pipeline_pending(state):
+                _dispatch_pipeline(self.request.id, session_id, state)
+                raise Ignore()
 
-            if state["awaiting_user_input"]:
+            if state.get("error"):
+                _save_failed_session(cache, session_id, state)
+            elif state["awaiting_user_input"]:
                 cache.save_session(
                     session_id, dict(state), settings.session_ttl_seconds
                 )
@@ -96,7 +195,318 @@ def process_agent_task(
 
             return {"success": True, "session_id": session_id, "state": dict(state)}
 
+        except Ignore:
+            raise
         except Exception as e:
             logger.error(f"Task failed: {str(e)}")
             return {"success": False, "session_id": session_id, "error": str(e)}
 
+
+@celery_app.task(bind=True, name="process_pipeline_task")
+def process_pipeline_task(self, session_id: str, state: dict) -> dict:
+    """
+    Discovery API'de (WebSocket) tamamlandıktan sonra ağır pipeline'ı çalıştırır.
+    Sonuç process_agent_task ile aynı formatta döner.
+    """
+    with LogContext(session_id=session_id, agent="worker"):
+        try:
+            workflow = _get_workflow()
+            cache = get_redis_cache()
+            cache.connect()
+
+            if settings.celery_split_stages:
+                _dispatch_pipeline(self.request.id, session_id, state)
+                raise Ignore()
+
+            with stage_events(*_event_listeners(self.request.id)):
+                state = workflow.run_pipeline(state)
+
+            if state.get("error"):
+                _save_failed_session(cache, session_id, state)
+            else:
+                cache.delete_session(session_id)
+            if state["is_complete"]:
+                _persist_completed_session(session_id, state["user_input"], state)
+
+            logger.info("Pipeline completed")
+            return {"success": True, "session_id": session_id, "state": dict(state)}
+
+        except Ignore:
+            raise
+        except Exception as e:
+            logger.error(f"Pipeline failed: {str(e)}")
+            return {"success": False, "session_id": session_id, "error": str(e)}
+
+
+def _pipeline_pending(state: dict) -> bool:
+    return (
+        settings.celery_split_stages
+        and not state.get("error")
+        and not state["awaiting_user_input"]
+        and state.get("discovery_output") is not None
+        and not state["is_complete"]
+    )
+
+
+def _dispatch_pipeline(parent_task_id: str, session_id: str, state: dict):
+    """
+    Pipeline'ı stage başına Celery task'ı olarak başlatır: aynı seviyedeki
+    stage'ler (risk, report) group, seviyeler chain. Parent task STARTED
+    kalır; sonucu finish_pipeline_task ya da pipeline_failed_task yazar.
+    """
+    context = {"parent_task_id": parent_task_id, "session_id": session_id}
+    steps = []
+    for level in _get_workflow().pipeline_levels(state):
+        signatures = [
+            run_stage_task.s(stage_name=name, **context).set(queue=stage_queue(name))
+            for name in level
+        ]
+        steps.append(signatures[0] if len(signatures) == 1 else group(signatures))
+
+    pipeline = chain(*steps, finish_pipeline_task.s(**context))
+    pipeline.on_error(pipeline_failed_task.s(**context))
+    pipeline.apply_async((dict(state),))
+    logger.info(f"Pipeline dispatched: {len(steps)} levels")
+
+
+def merge_stage_states(states: dict | list[dict]) -> dict:
+    """Paralel stage'lerin (group) state'lerini birleştirir; her biri kendi output'unu ekler."""
+    if isinstance(states, dict):
+        return states
+
+    merged = dict(states[0])
+    for other in states[1:]:
+        for key, value in other.items():
+            if key == "agent_flow":
+                merged["agent_flow"] = merged["agent_flow"] + [
+                    stage for stage in value if stage not in merged["agent_flow"]
+                ]
+            elif merged.get(key) is None and value is not None:
+                merged[key] = value
+    return merged
+
+
+@celery_app.task(
+    bind=True,
+    name="run_stage_task",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=settings.celery_stage_max_retries,
+)
+def run_stage_task(
+    self, state: dict | list[dict], stage_name: str, parent_task_id: str, session_id: str
+) -> dict:
+    """Tek pipeline stage'i; hata alırsa sadece bu stage retry edilir."""
+    with LogContext(session_id=session_id, agent=stage_name):
+        state = merge_stage_states(state)
+        with stage_events(*_event_listeners(parent_task_id)):
+            return dict(_get_workflow().run_stage(state, stage_name))
+
+
+@celery_app.task(name="finish_pipeline_task")
+def finish_pipeline_task(states: dict | list[dict], parent_task_id: str, session_id: str):
+    with LogContext(session_id=session_id, agent="worker"):
+        state = merge_stage_states(states)
+        state["is_complete"] = True
+        state["current_agent"] = "pipeline"
+
+        cache = get_redis_cache()
+        cache.connect()
+        cache.delete_session(session_id)
+        _persist_completed_session(session_id, state["user_input"], state)
+
+        _store_parent_result(
+            parent_task_id, {"success": True, "session_id": session_id, "state": state}
+        )
+        logger.info("Pipeline completed")
+
+
+@celery_app.task(name="pipeline_failed_task")
+def pipeline_failed_task(request, exc, traceback, parent_task_id: str, session_id: str):
+    """Stage retry'ları tükenince çalışır (errback); hata parent task'a yazılır."""
+    with LogContext(session_id=session_id, agent="worker"):
+        cache = get_redis_cache()
+        cache.connect()
+        if cache.get_task_status(parent_task_id) in TERMINAL_STATUSES:
+            # Paralel stage hatasında errback hem stage'den hem chord'dan gelir
+            return
+
+        stage_name = (request.kwargs or {}).get("stage_name", "pipeline")
+        try:
+            agent = _get_workflow().stage_agent(stage_name)
+        except KeyError:
+            agent = stage_name
+        error = f"{agent} error: {exc}"
+        logger.error(f"Pipeline failed: {error}")
+
+        # Stage'in girdisi saklanır; resume biten stage'leri memo'dan alır
+        if request.args:
+            failed_state = merge_stage_states(request.args[0])
+            failed_state.update(error=error, is_complete=True)
+            _save_failed_session(cache, session_id, failed_state)
+        else:
+            cache.delete_session(session_id)
+        _store_parent_result(
+            parent_task_id, {"success": False, "session_id": session_id, "error": error}
+        )
+
+
+def _save_failed_session(cache, session_id: str, state: dict):
+    """Hatalı session silinmez; POST /v1/sessions/{id}/resume kaldığı yerden devam eder."""
+    cache.save_session(session_id, dict(state), settings.session_ttl_seconds)
+    logger.info(f"Failed session kept for resume: {state.get('error')}")
+
+
+def _park_for_research(cache, parent_task_id: str, session_id: str, state: dict):
+    """
+    Tavily task'ı başlatıldı; session Redis'e park edilir ve worker slotu
+    serbest bırakılır. Parent task STARTED kalır, sonucu poller yazar.
+    """
+    cache.save_session(session_id, dict(state), settings.session_ttl_seconds)
+    first_delay = get_research_service().polling_schedule.delay(0)
+    poll_research_task.apply_async(
+        kwargs={"parent_task_id": parent_task_id, "session_id": session_id},
+        countdown=first_delay,
+    )
+    logger.info(f"Research parked: {state['pending_research']['task_id']}")
+
+
+def _store_parent_result(parent_task_id: str, result: dict):
+    celery_app.backend.store_result(parent_task_id, result, states.SUCCESS)
+    _set_task_status(parent_task_id, result)
+
+
+def _set_task_status(task_id: str, result: dict | None = None, error: str | None = None):
+    """Sonuç backend'e yazıldıktan sonra çağrılır; API status'u görünce sonucu okur."""
+    if result is None and error is None:
+        status = "processing"
+    elif error is None and result.get("success"):
+        status = "completed"
+    else:
+        status = "failed"
+        error = error or result.get("error", "Unknown error")
+
+    try:
+        cache = get_redis_cache()
+        cache.connect()
+        cache.set_task_status(task_id, status, error, ttl_seconds=celery_app.conf.result_expires)
+    except Exception as status_error:
+        logger.warning(f"Task status could not be written: {status_error}")
+
+    # SSE client'ları için; terminal status stream'i kapatır
+    get_event_publisher().publish(task_id, "status", {"status": status, "error": error})
+
+
+@before_task_publish.connect
+def _on_before_task_publish(headers=None, routing_key=None, **kwargs):
+    # Custom header'lar worker'da task.request attribute'u olarak gelir
+    headers["enqueued_at"] = time.time()
+    headers["lane"] = queue_lane(routing_key)
+
+
+# Task süresi lane başına; admission kontrolü kuyruk tahmininde kullanır
+_task_started_at: dict[str, float] = {}
+
+
+@task_prerun.connect
+def _on_task_prerun(sender=None, task_id=None, **kwargs):
+    _record_queue_wait(sender.request)
+    _task_started_at[task_id] = time.monotonic()
+    if sender.name in STATUS_TRACKED_TASKS:
+        _set_task_status(task_id)
+
+
+@task_postrun.connect
+def _on_task_postrun(sender=None, task_id=None, **kwargs):
+    started_at = _task_started_at.pop(task_id, None)
+    lane = getattr(sender.request, "lane", None)
+    if started_at is None or lane is None:
+        return
+
+    get_redis_cache().connect()
+    get_metrics().observe(f"task_runtime:{lane}", time.monotonic() - started_at)
+
+
+def _record_queue_wait(request):
+    enqueued_at = getattr(request, "enqueued_at", None)
+    # Countdown/retry'lı task'larda bekleme planlı; ölçülmez
+    if enqueued_at is None or request.eta is not None:
+        return
+
+    get_redis_cache().connect()
+    get_metrics().observe(
+        f"queue_wait:{getattr(request, 'lane', 'bulk')}", max(time.time() - enqueued_at, 0.0)
+    )
+
+
+@task_success.connect
+def _on_task_success(sender=None, result=None, **kwargs):
+    # Celery sonucu backend'e yazdıktan sonra task_success'i gönderir
+    if sender.name in STATUS_TRACKED_TASKS:
+        _set_task_status(sender.request.id, result=result)
+
+
+@task_failure.connect
+def _on_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    if sender.name in STATUS_TRACKED_TASKS:
+        _set_task_status(task_id, error=str(exception))
+
+
+@celery_app.task(bind=True, name="poll_research_task")
+def poll_research_task(self, parent_task_id: str, session_id: str):
+    """Tek bir status kontrolü yapar; research bitmediyse kendini yeniden planlar."""
+    with LogContext(session_id=session_id, agent="research_poller"):
+        cache = get_redis_cache()
+        cache.connect()
+
+        state = cache.get_session(session_id)
+        if not state or not state.get("pending_research"):
+            logger.warning("Parked research session not found")
+            _store_parent_result(
+                parent_task_id,
+                {"success": False, "session_id": session_id, "error": "Research session expired"},
+            )
+            return
+
+        pending = state["pending_research"]
+        research_service = get_research_service()
+        schedule = research_service.polling_schedule
+        timings = ResearchTimings(**pending["timings"])
+
+        # Gerçek bekleme (countdown + queue gecikmesi) kaydedilir
+        now = time.time()
+        research_status = research_service.check_research(
+            pending["task_id"], timings, delay=now - pending["last_poll_at"]
+        )
+        pending["attempt"] += 1
+
+        if research_status.get("status") == RESEARCH_PENDING:
+            waited = time.time() - pending["started_at"] - timings.submit_seconds
+            if not schedule.is_exhausted(pending["attempt"], waited):
+                pending["timings"] = timings.model_dump()
+                pending["last_poll_at"] = time.time()
+                cache.save_session(session_id, state, settings.session_ttl_seconds)
+                poll_research_task.apply_async(
+                    kwargs={"parent_task_id": parent_task_id, "session_id": session_id},
+                    countdown=schedule.delay(pending["attempt"]),
+                )
+                return
+            research_status = research_service.timeout_status()
+
+        elapsed = time.time() - pending["started_at"]
+        research_output = research_service.build_result(research_status, elapsed, timings)
+
+        try:
+            with stage_events(*_event_listeners(parent_task_id)):
+                state = _get_workflow().complete_research(state, research_output)
+            result = {"success": True, "session_id": session_id, "state": dict(state)}
+        except Exception as e:
+            logger.error(f"Research completion failed: {str(e)}")
+            result = {"success": False, "session_id": session_id, "error": str(e)}
+
+        cache.delete_session(session_id)
+        if result["success"]:
+            _persist_completed_session(session_id, pending["query"], state)
+
+        _store_parent_result(parent_task_id, result)
+        logger.info(f"Research completed after {pending['attempt']} polls")
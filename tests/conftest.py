@@ -1,6 +1,11 @@
+import os
 
 import pytest
 
+# Settings API key'leri zorunlu tutuyor; unit testler gerçek provider'a gitmez
+for _key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY"):
+    os.environ.setdefault(_key, "test")
+
 
 @pytest.fixture
 def sample_discovery_output():
@@ -113,6 +118,12 @@ def sample_business_problem_state():
             "route_to": "discovery",
         },
         "discovery_question": "Satış düşüşü ne zaman başladı?",
+        "discovery_session": {
+            "initial_problem": "Satışlarımız düşüyor",
+            "response_language": "Turkish",
+            "current_question": "Satış düşüşü ne zaman başladı?",
+            "conversation_turns": [],
+        },
         "discovery_output": None,
         "awaiting_user_input": True,
         "problem_tree": None,
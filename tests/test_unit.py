@@ -1,3 +1,5 @@
+import pytest
+
 
 class TestDiscoveryOutputStructure:
 
@@ -154,6 +156,2142 @@ class TestSessionStateLogic:
         assert sample_business_problem_state["awaiting_user_input"] == True
         assert sample_business_problem_state["is_complete"] == False
 
+    def test_discovery_session_survives_workflow_state_round_trip(self):
+        import json
+
+        from app.agents.discovery import DiscoveryAgent
+        from app.agents.workflow import create_initial_state
+        from app.models.domain import DiscoverySession
+
+        def agent():
+            # Her tur ayrı worker: agent instance'ı turlar arasında paylaşılmaz
+            discovery_agent = DiscoveryAgent()
+            discovery_agent.max_questions = 10
+            discovery_agent.invoke_llm = lambda prompt_name, prompt_variables: (
+                f"Soru {prompt_variables['question_number']}?"
+            )
+            return discovery_agent
+
+        state = create_initial_state("s1", "Satışlar düşüyor")
+        session = agent().new_session(state["user_input"], language="Turkish")
+        agent().start_discovery(session)
+
+        for answer in ["Son 6 ayda %20", "Online kanalda"]:
+            state["discovery_session"] = session.model_dump()
+            state["discovery_question"] = session.current_question
+            state = json.loads(json.dumps(state))  # Redis/Celery serileştirmesi
+
+            session = DiscoverySession(**state["discovery_session"])
+            agent().continue_discovery(session, answer)
+
+        assert [turn.answer for turn in session.conversation_turns] == [
+            "Son 6 ayda %20", "Online kanalda"
+        ]
+        assert [turn.question for turn in session.conversation_turns] == ["Soru 1?", "Soru 2?"]
+        assert session.current_question == "Soru 3?"
+        assert session.initial_problem == "Satışlar düşüyor"
+
     def test_not_awaiting_when_complete(self, sample_completed_state):
         assert sample_completed_state["awaiting_user_input"] == False
-        assert sample_completed_state["is_complete"] == True
\ No newline at end of file
+        assert sample_completed_state["is_complete"] == True
+
+class TestStageExecutor:
+
+    def _state(self):
+        return {"agent_flow": [], "current_agent": "discovery", "error": None, "seed": 1}
+
+    def _on_error(self, state, agent, error):
+        state["error"] = f"{agent} error: {error}"
+        state["is_complete"] = True
+
+    def test_independent_stages_run_concurrently(self):
+        import threading
+
+        from app.agents.executor import Stage, StageExecutor
+
+        barrier = threading.Barrier(2, timeout=2)
+
+        def parallel(state):
+            barrier.wait()
+            return state["a"] + 1
+
+        executor = StageExecutor(
+            [
+                Stage(name="a", output_key="a", run=lambda s: s["seed"], agent="A"),
+                Stage(name="b", output_key="b", run=parallel, agent="B", depends_on=("a",)),
+                Stage(name="c", output_key="c", run=parallel, agent="C", depends_on=("a",)),
+            ],
+            on_error=self._on_error,
+        )
+        state = executor.execute(self._state())
+
+        assert state["error"] is None
+        assert state["b"] == state["c"] == 2
+        assert state["agent_flow"][0] == "a"
+        assert set(state["agent_flow"]) == {"a", "b", "c"}
+
+    def test_failure_skips_dependents(self):
+        from app.agents.executor import Stage, StageExecutor
+
+        def fail(state):
+            raise RuntimeError("boom")
+
+        executor = StageExecutor(
+            [
+                Stage(name="a", output_key="a", run=fail, agent="A"),
+                Stage(name="b", output_key="b", run=lambda s: 1, agent="B", depends_on=("a",)),
+            ],
+            on_error=self._on_error,
+        )
+        state = executor.execute(self._state())
+
+        assert state["error"] == "A error: boom"
+        assert "b" not in state
+        assert state["agent_flow"] == []
+
+    def test_existing_outputs_are_not_recomputed(self):
+        from app.agents.executor import Stage, StageExecutor
+
+        def must_not_run(state):
+            raise AssertionError("stage should be skipped")
+
+        executor = StageExecutor(
+            [
+                Stage(name="a", output_key="a", run=must_not_run, agent="A"),
+                Stage(name="b", output_key="b", run=lambda s: s["a"] * 10, agent="B", depends_on=("a",)),
+            ],
+            on_error=self._on_error,
+        )
+        state = self._state()
+        state["a"] = 4
+        state = executor.execute(state)
+
+        assert state["b"] == 40
+        assert state["agent_flow"] == ["b"]
+
+    def test_levels_group_parallel_stages_and_skip_completed(self):
+        from app.agents.executor import Stage, StageExecutor
+
+        executor = StageExecutor(
+            [
+                Stage(name="a", output_key="a", run=lambda s: 1, agent="A"),
+                Stage(name="b", output_key="b", run=lambda s: 2, agent="B", depends_on=("a",)),
+                Stage(name="c", output_key="c", run=lambda s: 3, agent="C", depends_on=("b",)),
+                Stage(name="d", output_key="d", run=lambda s: 4, agent="D", depends_on=("b",)),
+            ],
+            on_error=self._on_error,
+        )
+
+        assert executor.levels(self._state()) == [["a"], ["b"], ["c", "d"]]
+        assert executor.levels({**self._state(), "a": 1, "b": 2}) == [["c", "d"]]
+
+    def test_run_stage_propagates_errors_for_retry(self):
+        from app.agents.executor import Stage, StageExecutor
+
+        def fail(state):
+            raise RuntimeError("boom")
+
+        executor = StageExecutor(
+            [
+                Stage(name="a", output_key="a", run=lambda s: s["seed"] + 1, agent="A"),
+                Stage(name="b", output_key="b", run=fail, agent="B", depends_on=("a",)),
+            ],
+            on_error=self._on_error,
+        )
+        state = executor.run_stage(self._state(), "a")
+        assert state["a"] == 2 and state["agent_flow"] == ["a"]
+
+        with pytest.raises(RuntimeError):
+            executor.run_stage(state, "b")
+        assert state["error"] is None
+
+    def test_memoized_stages_are_not_recomputed(self):
+        from app.agents.executor import Stage, StageExecutor
+        from app.stage_memo import stage_input_key
+
+        class DictMemo:
+            def __init__(self):
+                self.entries = {}
+
+            def get(self, name, state, inputs):
+                return self.entries.get(stage_input_key(name, state, inputs))
+
+            def set(self, name, state, inputs, output):
+                self.entries[stage_input_key(name, state, inputs)] = output
+
+        calls = []
+
+        def run_b(state):
+            calls.append(state["a"])
+            return state["a"] * 10
+
+        memo = DictMemo()
+        stages = [
+            Stage(name="a", output_key="a", run=lambda s: s["seed"], agent="A", inputs=("seed",)),
+            Stage(name="b", output_key="b", run=run_b, agent="B", depends_on=("a",), inputs=("a",)),
+        ]
+
+        first = StageExecutor(stages, on_error=self._on_error, memo=memo).execute(self._state())
+        second = StageExecutor(stages, on_error=self._on_error, memo=memo).execute(self._state())
+
+        assert first["b"] == second["b"] == 10
+        assert calls == [1]
+        assert second["agent_flow"] == ["a", "b"]
+
+    def test_parallel_stage_states_are_merged(self):
+        from app.worker import merge_stage_states
+
+        base = {"agent_flow": ["structuring", "action_plan"], "risk_analysis": None, "business_report": None}
+        merged = merge_stage_states([
+            {**base, "agent_flow": base["agent_flow"] + ["risk"], "risk_analysis": {"level": "high"}},
+            {**base, "agent_flow": base["agent_flow"] + ["report"], "business_report": {"summary": "s"}},
+        ])
+
+        assert merged["risk_analysis"] == {"level": "high"}
+        assert merged["business_report"] == {"summary": "s"}
+        assert merged["agent_flow"] == ["structuring", "action_plan", "risk", "report"]
+
+    @pytest.mark.asyncio
+    async def test_async_execution_runs_independent_stages_together(self):
+        import asyncio
+
+        from app.agents.executor import Stage, StageExecutor
+
+        started = asyncio.Event()
+
+        async def first(state):
+            started.set()
+            await asyncio.sleep(0)
+            return state["a"] + 1
+
+        async def second(state):
+            # first'ün başlamış olması iki stage'in aynı anda çalıştığını gösterir
+            await asyncio.wait_for(started.wait(), timeout=1)
+            return state["a"] + 2
+
+        executor = StageExecutor(
+            [
+                Stage(name="a", output_key="a", run=lambda s: s["seed"], agent="A"),
+                Stage(name="b", output_key="b", run=None, run_async=first, agent="B", depends_on=("a",)),
+                Stage(name="c", output_key="c", run=None, run_async=second, agent="C", depends_on=("a",)),
+            ],
+            on_error=self._on_error,
+        )
+        state = await executor.execute_async(self._state())
+
+        assert state["error"] is None
+        assert (state["b"], state["c"]) == (2, 3)
+        assert state["agent_flow"][0] == "a"
+
+
+class FakeTavilyClient:
+    """Lokal fake Tavily: `pending_polls` kadar pending döner, sonra tamamlanır."""
+
+    def __init__(self, pending_polls: int = 1, fail: bool = False):
+        self.pending_polls = pending_polls
+        self.fail = fail
+        self.get_calls = 0
+
+    def research(self, input: str, model: str = "mini") -> dict:
+        return {"request_id": "fake-task-1", "status": "pending"}
+
+    def get_research(self, request_id: str) -> dict:
+        self.get_calls += 1
+        if self.fail:
+            return {"status": "failed", "error": "quota"}
+        if self.get_calls <= self.pending_polls:
+            return {"status": "in_progress"}
+        return {
+            "status": "completed",
+            "content": "E-ticaret pazarında lider oyuncular...",
+            "sources": [{"title": "Rapor", "url": "https://example.com/rapor"}],
+        }
+
+
+class TestTavilyResearchService:
+
+    def _service(self, fake_client):
+        from app.search import PollingSchedule, TavilyResearchService
+
+        return TavilyResearchService(
+            tavily_api_key="test",
+            polling_schedule=PollingSchedule(first_delay=0, jitter=0, max_attempts=5),
+            tavily_client=fake_client,
+        )
+
+    def test_deferred_submit_and_check(self):
+        from app.search import RESEARCH_PENDING
+
+        service = self._service(FakeTavilyClient(pending_polls=1))
+
+        submitted = service.submit_research("e-ticaret sektöründe lider kim?")
+        assert submitted["request_id"] == "fake-task-1"
+
+        assert service.check_research("fake-task-1")["status"] == RESEARCH_PENDING
+
+        completed = service.check_research("fake-task-1")
+        result = service.build_result(completed, elapsed=1.5)
+        assert result.is_successful
+        assert result.source_urls == ["https://example.com/rapor"]
+
+    def test_blocking_research_records_phase_timings(self):
+        service = self._service(FakeTavilyClient(pending_polls=2))
+
+        result = service.research("e-ticaret sektöründe lider kim?")
+
+        assert result.is_successful
+        assert [poll.status for poll in result.timings.polls] == [
+            "pending", "pending", "completed"
+        ]
+
+    def test_failed_research_surfaces_error(self):
+        service = self._service(FakeTavilyClient(fail=True))
+
+        result = service.research("e-ticaret sektöründe lider kim?")
+
+        assert not result.is_successful
+        assert "quota" in result.error
+
+    def test_blocking_research_times_out(self):
+        service = self._service(FakeTavilyClient(pending_polls=100))
+
+        result = service.research("e-ticaret sektöründe lider kim?")
+
+        assert "tamamlanmadı" in result.error
+
+    @pytest.mark.asyncio
+    async def test_async_research_polls_without_blocking(self):
+        service = self._service(FakeTavilyClient(pending_polls=2))
+
+        result = await service.research_async("e-ticaret sektöründe lider kim?")
+
+        assert result.is_successful
+        assert [poll.status for poll in result.timings.polls] == [
+            "pending", "pending", "completed"
+        ]
+
+
+class TestPollingSchedule:
+
+    def test_fast_probes_then_backoff_to_cap(self):
+        from app.search import PollingSchedule
+
+        schedule = PollingSchedule(
+            first_delay=0.5, fast_probes=2, backoff=2.0, max_interval=3.0, jitter=0
+        )
+        delays = [schedule.delay(attempt) for attempt in range(6)]
+
+        assert delays == [0.5, 0.5, 1.0, 2.0, 3.0, 3.0]
+
+    def test_jitter_stays_within_bounds(self):
+        from app.search import PollingSchedule
+
+        schedule = PollingSchedule(first_delay=1.0, fast_probes=1, jitter=0.2)
+
+        for _ in range(50):
+            assert 0.8 <= schedule.delay(0) <= 1.2
+
+    def test_exhausted_by_deadline_or_attempts(self):
+        from app.search import PollingSchedule
+
+        schedule = PollingSchedule(deadline=10, max_attempts=3)
+
+        assert not schedule.is_exhausted(attempt=1, waited=5)
+        assert schedule.is_exhausted(attempt=1, waited=10)
+        assert schedule.is_exhausted(attempt=3, waited=0)
+
+    def test_deprecated_polling_interval_still_loads(self, monkeypatch):
+        from app.config import Settings
+
+        monkeypatch.setenv("TAVILY_POLLING_INTERVAL", "3")
+
+        with pytest.warns(FutureWarning):
+            settings = Settings(_env_file=None)
+
+        assert settings.tavily_poll_max_interval == 3.0
+        assert settings.tavily_poll_first_delay == 0.5
+
+
+class TestLLMResponseCache:
+
+    def _cache(self, max_local_entries: int = 2):
+        from app.cache import RedisCache
+        from app.llm_cache import LLMResponseCache
+        from app.metrics import MetricsRecorder
+
+        # Bağlanmamış RedisCache: sadece process içi katman test edilir
+        redis_cache = RedisCache("redis://localhost:0/0")
+        return LLMResponseCache(
+            redis_cache=redis_cache,
+            metrics=MetricsRecorder(redis_cache),
+            max_local_entries=max_local_entries,
+        )
+
+    def test_key_depends_on_model_and_messages(self):
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        from app.llm import LLMSpec
+        from app.llm_cache import make_cache_key
+
+        messages = [SystemMessage(content="sys"), HumanMessage(content="Satışlar düşüyor")]
+        spec = LLMSpec(provider="openai", model="gpt-5.1", temperature=0.3)
+
+        assert make_cache_key(spec, messages) == make_cache_key(spec, list(messages))
+        assert make_cache_key(spec, messages) != make_cache_key(
+            LLMSpec(provider="openai", model="gpt-5.1", temperature=0.7), messages
+        )
+        assert make_cache_key(spec, messages) != make_cache_key(
+            spec, [SystemMessage(content="sys"), HumanMessage(content="Hava nasıl?")]
+        )
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = self._cache(max_local_entries=2)
+
+        cache.set("a", "A", ttl_seconds=60)
+        cache.set("b", "B", ttl_seconds=60)
+        assert cache.get("a", "test") == "A"
+        cache.set("c", "C", ttl_seconds=60)
+
+        assert cache.get("b", "test") is None
+        assert cache.get("a", "test") == "A"
+        assert cache.get("c", "test") == "C"
+
+    def test_unparseable_legacy_json_is_not_cached(self, monkeypatch):
+        from types import SimpleNamespace
+
+        import app.agents.base as base
+        from app.agents.risk import RiskAgent
+        from app.models.domain import ActionPlan, ProblemType, StructuredProblemTree
+
+        stored = []
+        monkeypatch.setattr(
+            base,
+            "get_llm_cache",
+            lambda: SimpleNamespace(
+                get=lambda key, prompt: None, set=lambda *args: stored.append(args)
+            ),
+        )
+        agent = RiskAgent()
+        agent.structured_output = False
+        agent._use_cache = lambda prompt_name: True
+        responses = [
+            '{"risks": [], "overall_risk_level": "hig',
+            '{"risks": [], "overall_risk_level": "high"}',
+        ]
+        agent._invoke_model = lambda llm, messages, output_schema=None: responses.pop(0)
+        plan = ActionPlan(
+            short_term=[], mid_term=[], long_term=[],
+            risks=["Bütçe"], quick_wins=[], success_metrics=[],
+        )
+        tree = StructuredProblemTree(problem_type=ProblemType.COST, main_problem="m", problem_tree=[])
+
+        fallback = agent.analyze_risks(plan, tree)
+        assert stored == [] and fallback.top_priority_risk == "Bütçe"
+
+        agent.analyze_risks(plan, tree)
+        assert len(stored) == 1
+
+    def test_expired_entries_are_misses(self):
+        cache = self._cache()
+
+        cache.set("a", "A", ttl_seconds=-1)
+
+        assert cache.get("a", "test") is None
+
+
+class TestHashedNgramIntentModel:
+
+    TRAINING_DATA = [
+        ("Türkiye'de e-ticaret sektöründe lider şirketler kimler?", "business_info"),
+        ("Yapay zeka sektöründeki yeni trendler neler?", "business_info"),
+        ("Rakiplerimiz hangi kampanyaları yapıyor?", "business_info"),
+        ("Who are the market leaders in retail?", "business_info"),
+        ("Satışlarımız son 3 ayda düştü, nedenini anlamak istiyorum", "business_problem"),
+        ("Müşteri şikayetleri %40 arttı, yardım eder misin?", "business_problem"),
+        ("Depo operasyonlarımız sürekli gecikiyor", "business_problem"),
+        ("Our sales are dropping and we don't know why", "business_problem"),
+        ("Bugün hava nasıl?", "non_business"),
+        ("En iyi pizza tarifi nedir?", "non_business"),
+        ("Bana bir fıkra anlatır mısın?", "non_business"),
+        ("What's the weather like today?", "non_business"),
+    ]
+
+    def _train(self):
+        from app.intent_model import HashedNgramIntentModel
+
+        texts, labels = zip(*self.TRAINING_DATA)
+        return HashedNgramIntentModel.train(list(texts), list(labels), n_features=2**12)
+
+    def test_fits_training_examples(self):
+        model = self._train()
+
+        for text, label in self.TRAINING_DATA:
+            intent, confidence = model.predict(text)
+            assert intent.value == label
+            assert 0 < confidence <= 1
+
+    def test_save_and_load_roundtrip(self, tmp_path):
+        from app.intent_model import HashedNgramIntentModel
+
+        model = self._train()
+        model_path = model.save(tmp_path)
+        loaded = HashedNgramIntentModel.load(model_path)
+
+        assert model_path.name == f"intent-{model.version}.npz"
+        assert loaded.labels == model.labels
+        assert loaded.predict("Bugün hava nasıl?") == model.predict("Bugün hava nasıl?")
+
+    def test_intent_source_is_logged_and_only_llm_labels_are_trained(self, monkeypatch):
+        import pymongo
+
+        from app.agents.peer import PeerAgent
+        from app.intent_model import load_training_data
+        from app.models.domain import IntentType
+        from app.worker import build_conversation_log
+
+        agent = PeerAgent()
+        agent._classify_with_llm = lambda user_message: IntentType.BUSINESS_INFO
+        agent._classify_locally = lambda user_message: IntentType.NON_BUSINESS
+        assert agent.classify_intent("Bugün hava nasıl?") == (IntentType.NON_BUSINESS, "local")
+        agent._classify_locally = lambda user_message: None
+        assert agent.classify_intent("Pazar payı?") == (IntentType.BUSINESS_INFO, "llm")
+
+        log = build_conversation_log(
+            "s1", "Bugün hava nasıl?", {"intent": "non_business", "intent_source": "local"}
+        )
+        assert log.intent_source == "local"
+
+        queries = []
+
+        class FakeCursor(list):
+            def sort(self, *args):
+                return self
+
+        class FakeMongoClient:
+            def __init__(self, uri):
+                pass
+
+            def __getitem__(self, name):
+                return {"conversations": self}
+
+            def find(self, query, projection):
+                queries.append(query)
+                return FakeCursor([{"user_input": "Pazar payı?", "intent": "business_info"}])
+
+            def close(self):
+                pass
+
+        monkeypatch.setattr(pymongo, "MongoClient", FakeMongoClient)
+
+        assert load_training_data() == (["Pazar payı?"], ["business_info"])
+        assert queries[0]["intent_source"] == {"$in": ["llm", "human"]}
+
+
+class TestResearchCacheSimilarity:
+
+    def test_near_duplicate_queries_are_similar(self):
+        from app.research_cache import MinHasher, query_shingles
+
+        hasher = MinHasher(num_perm=64)
+        first = hasher.signature(query_shingles("e-ticaret sektöründe lider kim?"))
+        second = hasher.signature(query_shingles("E-ticaret sektöründe lider kimdir?"))
+
+        assert MinHasher.similarity(first, second) >= 0.8
+
+    def test_unrelated_queries_are_not_similar(self):
+        from app.research_cache import MinHasher, query_shingles
+
+        hasher = MinHasher(num_perm=64)
+        first = hasher.signature(query_shingles("e-ticaret sektöründe lider kim?"))
+        second = hasher.signature(query_shingles("Otomotiv sektöründe elektrikli araç trendleri"))
+
+        assert MinHasher.similarity(first, second) < 0.3
+
+    def test_suffix_variants_pass_term_check(self):
+        from app.research_cache import query_terms_match
+
+        assert query_terms_match(
+            "e-ticaret sektöründe lider kim?", "E-ticaret sektöründe lider kimdir?"
+        )
+
+    def test_different_country_is_not_served_from_cache(self):
+        from app.research_cache import query_terms_match
+
+        assert not query_terms_match(
+            "e-commerce market size Turkey", "e-commerce market size Germany"
+        )
+
+    def test_different_year_is_not_served_from_cache(self):
+        from app.research_cache import MinHasher, query_shingles, query_terms_match
+
+        first, second = "AI market trends 2024", "AI market trends 2023"
+        hasher = MinHasher(num_perm=64)
+        similarity = MinHasher.similarity(
+            hasher.signature(query_shingles(first)), hasher.signature(query_shingles(second))
+        )
+
+        # Karakter benzerliği eşiği geçiyor, kelime kontrolü reddediyor
+        assert similarity >= 0.8
+        assert not query_terms_match(first, second)
+
+    def test_normalization_ignores_case_and_punctuation(self):
+        from app.research_cache import query_shingles
+
+        assert query_shingles("Lider KİM?") == query_shingles("lider kim")
+
+
+class FakeRedis:
+    """SingleFlight'ın kullandığı komutların thread-safe, in-memory karşılığı."""
+
+    def __init__(self):
+        import threading
+
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+
+    def setex(self, key, ttl, value):
+        return self.set(key, value)
+
+    def exists(self, key):
+        with self.lock:
+            return int(key in self.data)
+
+    def eval(self, script, numkeys, key, token):
+        with self.lock:
+            if self.data.get(key) == token:
+                del self.data[key]
+                return 1
+            return 0
+
+    def publish(self, channel, payload):
+        return 0
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+    def pubsub(self, **kwargs):
+        return FakePubSub()
+
+
+class FakePubSub:
+
+    def subscribe(self, channel):
+        pass
+
+    def get_message(self, timeout=0):
+        import time
+
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeAsyncRedis:
+    """FakeRedis verisini paylaşan redis.asyncio karşılığı; abonelik loop'ta bekler."""
+
+    def __init__(self, sync_client):
+        self.sync_client = sync_client
+
+    async def get(self, key):
+        return self.sync_client.get(key)
+
+    async def exists(self, key):
+        return self.sync_client.exists(key)
+
+    def pubsub(self, **kwargs):
+        return FakeFlightPubSub()
+
+
+class FakeFlightPubSub:
+
+    async def subscribe(self, channel):
+        pass
+
+    async def get_message(self, timeout=0):
+        import asyncio
+
+        await asyncio.sleep(timeout)
+        return None
+
+    async def aclose(self):
+        pass
+
+
+class TestSingleFlight:
+
+    def _flight(self, client=None, async_client=None):
+        from app.cache import AsyncRedisCache, RedisCache
+        from app.metrics import MetricsRecorder
+        from app.singleflight import SingleFlight
+
+        redis_cache = RedisCache("redis://localhost:0/0")
+        redis_cache._client = client
+        async_cache = AsyncRedisCache("redis://localhost:0/0", max_subscribers=1)
+        async_cache._client = async_client
+        async_cache._subscriber_client = async_client
+        return SingleFlight(
+            redis_cache=redis_cache,
+            metrics=MetricsRecorder(RedisCache("redis://localhost:0/0")),
+            poll_interval=0.01,
+            async_cache=async_cache,
+        )
+
+    def _run_concurrently(self, flight, compute, share=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            futures = [
+                pool.submit(flight.run, "test", "same-key", compute, 5, 5, share)
+                for _ in range(3)
+            ]
+            return [future.result() for future in futures]
+
+    def test_without_redis_computes_every_time(self):
+        flight = self._flight()
+        calls = []
+
+        flight.run("test", "key", lambda: calls.append(1) or len(calls))
+        flight.run("test", "key", lambda: calls.append(1) or len(calls))
+
+        assert len(calls) == 2
+
+    def test_concurrent_callers_share_one_computation(self):
+        import time
+
+        flight = self._flight(FakeRedis())
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"message": "özet"}
+
+        results = self._run_concurrently(flight, compute)
+
+        assert len(calls) == 1
+        assert results == [{"message": "özet"}] * 3
+
+    def test_unshared_result_makes_waiters_compute(self):
+        import time
+
+        flight = self._flight(FakeRedis())
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"error": "timeout"}
+
+        self._run_concurrently(flight, compute, share=lambda result: "error" not in result)
+
+        assert len(calls) == 3
+
+    def test_async_followers_wait_on_the_event_loop(self, monkeypatch):
+        import asyncio
+
+        import app.singleflight as singleflight_module
+
+        client = FakeRedis()
+        flight = self._flight(client, FakeAsyncRedis(client))
+        calls = []
+        threaded = []
+        to_thread = asyncio.to_thread
+
+        async def tracking_to_thread(func, *args, **kwargs):
+            threaded.append(func.__name__)
+            return await to_thread(func, *args, **kwargs)
+
+        monkeypatch.setattr(singleflight_module.asyncio, "to_thread", tracking_to_thread)
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return {"message": "özet"}
+
+        async def run_all():
+            # Tek abonelik slotu: bir takipçi pub/sub'da, diğeri GET yoklamasında bekler
+            return await asyncio.gather(
+                *[flight.run_async("test", "same-key", compute, 5, 5) for _ in range(3)]
+            )
+
+        results = asyncio.run(run_all())
+
+        assert len(calls) == 1
+        assert results == [{"message": "özet"}] * 3
+        assert "_wait" not in threaded
+        assert "_join" not in threaded
+
+
+class TestLLMRateLimiter:
+
+    class FakeClient:
+        def __init__(self, delay="0"):
+            self.delay = delay
+            self.calls = []
+
+        def eval(self, script, numkeys, key, *args):
+            self.calls.append((key, args))
+            return self.delay
+
+    def _limiter(self, client, limits, enabled=True):
+        from types import SimpleNamespace
+
+        from app.llm_limiter import LLMRateLimiter
+
+        metrics = SimpleNamespace(
+            observed=[], observe=lambda name, value: metrics.observed.append((name, value)),
+            incr=lambda name, amount=1: None,
+        )
+        return LLMRateLimiter(SimpleNamespace(client=client), metrics, limits, enabled), metrics
+
+    def _spec(self, model="gpt-5.1"):
+        from app.llm import LLMSpec
+
+        return LLMSpec(provider="openai", model=model, temperature=0.3, max_tokens=1000)
+
+    def test_model_limit_overrides_provider_bucket(self):
+        client = self.FakeClient(delay="1.5")
+        limiter, metrics = self._limiter(
+            client,
+            {"openai": {"rpm": 500, "tpm": 1000}, "openai:gpt-5-mini": {"rpm": 10, "tpm": 100}},
+        )
+
+        assert limiter.reserve(self._spec(), 200) == 1.5
+        limiter.reserve(self._spec("gpt-5-mini"), 50)
+
+        assert client.calls == [
+            ("llm_rate:openai", (500, 1000, 200)),
+            ("llm_rate:openai:gpt-5-mini", (10, 100, 50)),
+        ]
+        assert metrics.observed[0] == ("llm_rate_wait:openai", 1.5)
+
+    def test_unlimited_provider_and_disabled_limiter_do_not_wait(self):
+        client = self.FakeClient(delay="30")
+
+        limiter, _ = self._limiter(client, {"anthropic": {"rpm": 1, "tpm": 1}})
+        assert limiter.reserve(self._spec(), 200) == 0.0
+
+        limiter, _ = self._limiter(client, {"openai": {"rpm": 1, "tpm": 1}}, enabled=False)
+        assert limiter.reserve(self._spec(), 200) == 0.0
+        assert client.calls == []
+
+    def test_settle_returns_unused_estimate(self):
+        client = self.FakeClient()
+        limiter, _ = self._limiter(client, {"openai": {"rpm": 500, "tpm": 1000}})
+
+        limiter.settle(self._spec(), estimated_tokens=1200, used_tokens=300)
+        limiter.settle(self._spec(), estimated_tokens=1200, used_tokens=None)
+
+        assert client.calls == [("llm_rate:openai", (900,))]
+
+    def test_estimate_includes_output_budget(self):
+        from langchain_core.messages import HumanMessage, SystemMessage
+
+        from app.llm_limiter import estimate_tokens
+
+        messages = [SystemMessage(content="a" * 400), HumanMessage(content="b" * 400)]
+        assert estimate_tokens(messages, 1000) == 1200
+
+
+class TestHedgePolicy:
+
+    class FakeLLM:
+        _llm_type = "fake"
+
+        def __init__(self, model, delay=0.0, fail=False):
+            self.model = model
+            self.delay = delay
+            self.fail = fail
+            self.cancelled = False
+
+    def _policy(self, p95=None):
+        from types import SimpleNamespace
+
+        from app.hedging import HedgePolicy
+
+        metrics = SimpleNamespace(
+            counters={},
+            observe=lambda name, value: None,
+            incr=lambda name, amount=1: metrics.counters.update(
+                {name: metrics.counters.get(name, 0) + amount}
+            ),
+            percentile=lambda name, quantile, min_samples=1: p95,
+        )
+        policy = HedgePolicy(metrics, backups={}, min_delay_seconds=0.05)
+        return policy, metrics
+
+    def _call(self, llm):
+        import time
+
+        time.sleep(llm.delay)
+        if llm.fail:
+            raise RuntimeError(f"{llm.model} failed")
+        return llm.model
+
+    def test_slow_primary_is_hedged_to_backup(self):
+        policy, metrics = self._policy(p95=0.01)
+        backup = self.FakeLLM("backup")
+        policy.backup_llm = lambda spec: backup
+
+        result = policy.run("risk_analysis", self.FakeLLM("primary", delay=1.0), self._call)
+
+        assert result == "backup"
+        assert metrics.counters == {
+            "llm_hedge:risk_analysis:fired": 1,
+            "llm_hedge:risk_analysis:backup_won": 1,
+        }
+
+    def test_primary_error_fails_over_without_learned_latency(self):
+        policy, metrics = self._policy(p95=None)
+        policy.backup_llm = lambda spec: self.FakeLLM("backup")
+
+        result = policy.run("risk_analysis", self.FakeLLM("primary", fail=True), self._call)
+
+        assert result == "backup"
+        assert metrics.counters == {"llm_hedge:risk_analysis:failover": 1}
+
+    def test_fast_primary_is_not_hedged(self):
+        policy, metrics = self._policy(p95=5.0)
+        policy.backup_llm = lambda spec: self.FakeLLM("backup")
+
+        assert policy.run("risk_analysis", self.FakeLLM("primary"), self._call) == "primary"
+        assert metrics.counters == {}
+
+    @pytest.mark.asyncio
+    async def test_async_hedge_cancels_losing_request(self):
+        import asyncio
+
+        policy, metrics = self._policy(p95=0.01)
+        primary = self.FakeLLM("primary", delay=5.0)
+        policy.backup_llm = lambda spec: self.FakeLLM("backup")
+
+        async def call(llm):
+            try:
+                await asyncio.sleep(llm.delay)
+            except asyncio.CancelledError:
+                llm.cancelled = True
+                raise
+            return llm.model
+
+        assert await policy.run_async("risk_analysis", primary, call) == "backup"
+        await asyncio.sleep(0)
+        assert primary.cancelled
+        assert metrics.counters["llm_hedge:risk_analysis:backup_won"] == 1
+
+
+class TestAdmissionController:
+
+    class FakeQueueRedis:
+
+        def __init__(self, depths):
+            self.depths = depths
+            self.commands = []
+
+        def pipeline(self):
+            return self
+
+        def llen(self, queue):
+            self.commands.append(queue)
+
+        def execute(self):
+            queued, self.commands = self.commands, []
+            return [self.depths.get(queue, 0) for queue in queued]
+
+    def _controller(self, depths, runtimes, enabled=True):
+        from types import SimpleNamespace
+
+        from app.admission import AdmissionController
+
+        metrics = SimpleNamespace(
+            counters={},
+            incr=lambda name, amount=1: metrics.counters.update(
+                {name: metrics.counters.get(name, 0) + amount}
+            ),
+            percentile=lambda name, quantile, min_samples=1: runtimes.get(name),
+        )
+        controller = AdmissionController(
+            SimpleNamespace(client=self.FakeQueueRedis(depths)),
+            metrics,
+            lane_queues={"fast": ["peer", "discovery"], "bulk": ["structuring", "risk"]},
+            lane_concurrency={"fast": 4, "bulk": 8},
+            slo_seconds={"fast": 15.0, "bulk": 120.0},
+            enabled=enabled,
+        )
+        return controller, metrics
+
+    def test_admits_while_projected_wait_is_within_slo(self):
+        controller, _ = self._controller(
+            {"peer": 10, "structuring": 20}, {"task_runtime:fast": 2.0, "task_runtime:bulk": 30.0}
+        )
+
+        assert controller.projected_wait("fast") == 5.0
+        assert controller.projected_wait("bulk") == 75.0
+        assert controller.retry_after(("fast", "bulk")) is None
+
+    def test_rejects_with_time_until_backlog_fits_slo(self):
+        controller, metrics = self._controller(
+            {"structuring": 20, "risk": 20}, {"task_runtime:bulk": 30.0}
+        )
+
+        assert controller.retry_after(("fast", "bulk")) == 30
+        assert metrics.counters == {"admission:bulk:rejected": 1}
+
+    def test_admits_without_runtime_samples_or_when_disabled(self):
+        no_samples, _ = self._controller({"peer": 1000}, {})
+        disabled, _ = self._controller({"peer": 1000}, {"task_runtime:fast": 5.0}, enabled=False)
+
+        assert no_samples.retry_after(("fast",)) is None
+        assert disabled.retry_after(("fast",)) is None
+
+
+class TestSessionStores:
+
+    def test_sync_and_async_stores_share_key_layout(self):
+        from app.cache import deserialize_session, serialize_session, session_key
+
+        state = {"session_id": "s1", "user_input": "Satışlar düştü", "agent_flow": ["peer"]}
+
+        assert session_key("s1") == "session:s1"
+        assert deserialize_session(serialize_session(state)) == state
+        assert deserialize_session(None) is None
+
+    @pytest.mark.asyncio
+    async def test_async_store_without_connection_is_noop(self):
+        from app.cache import AsyncRedisCache
+
+        cache = AsyncRedisCache("redis://localhost:0/0")
+
+        assert await cache.get_session("s1") is None
+        assert await cache.session_exists("s1") is False
+        assert await cache.is_connected() is False
+
+
+class TestTaskStatusFromMeta:
+
+    def test_started_task_is_processing(self):
+        from app.main import _task_response_from_meta
+
+        response = _task_response_from_meta("t1", {"status": "STARTED", "result": None})
+
+        assert response.status == "processing"
+        assert response.result is None
+
+    def test_unsuccessful_result_is_failed(self):
+        from app.main import _task_response_from_meta
+
+        task_meta = {
+            "status": "SUCCESS",
+            "result": {"success": False, "session_id": "s1", "error": "LLM timeout"},
+        }
+        response = _task_response_from_meta("t1", task_meta)
+
+        assert response.status == "failed"
+        assert response.error == "LLM timeout"
+
+    def test_failure_meta_is_decoded(self):
+        from app.main import _task_response_from_meta
+        from app.worker import celery_app
+
+        failure = celery_app.backend.prepare_exception(RuntimeError("worker crashed"))
+        response = _task_response_from_meta("t1", {"status": "FAILURE", "result": failure})
+
+        assert response.status == "failed"
+        assert response.error == "worker crashed"
+
+
+class TestLaneRouting:
+
+    @staticmethod
+    def _discovery_state(turns: int) -> dict:
+        return {
+            "awaiting_user_input": True,
+            "discovery_output": None,
+            "discovery_session": {"conversation_turns": [{"answer": "x"}] * turns},
+        }
+
+    def test_new_tasks_and_split_discovery_answers_are_fast(self):
+        from app.worker import agent_task_lane
+
+        assert agent_task_lane(None, inline_pipeline=True) == "fast"
+        assert agent_task_lane(self._discovery_state(10), inline_pipeline=False) == "fast"
+        assert agent_task_lane(self._discovery_state(0), inline_pipeline=True) == "fast"
+
+    def test_work_that_may_run_pipeline_inline_is_bulk(self):
+        from app.config import get_settings
+        from app.worker import agent_task_lane
+
+        last_turn = self._discovery_state(get_settings().discovery_min_questions - 1)
+        resumed = {**self._discovery_state(5), "discovery_output": {"chat_summary": "..."}}
+
+        assert agent_task_lane(last_turn, inline_pipeline=True) == "bulk"
+        assert agent_task_lane(resumed, inline_pipeline=True) == "bulk"
+
+    def test_queue_wait_is_recorded_per_lane(self, monkeypatch):
+        import time
+        from types import SimpleNamespace
+
+        import app.worker as worker
+
+        observed = []
+        monkeypatch.setattr(
+            worker,
+            "get_metrics",
+            lambda: SimpleNamespace(observe=lambda name, value: observed.append((name, value))),
+        )
+        monkeypatch.setattr(worker, "get_redis_cache", lambda: SimpleNamespace(connect=lambda: True))
+
+        worker._record_queue_wait(SimpleNamespace(enqueued_at=time.time() - 2, lane="fast", eta=None))
+        worker._record_queue_wait(SimpleNamespace(enqueued_at=time.time() - 9, lane="bulk", eta="x"))
+        worker._record_queue_wait(SimpleNamespace(eta=None))
+
+        assert [name for name, _ in observed] == ["queue_wait:fast"]
+        assert observed[0][1] >= 2
+        assert worker.queue_lane("discovery") == "fast"
+        assert worker.queue_lane("risk") == "bulk"
+
+
+class FakeAsyncPubSub:
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def subscribe(self, channel):
+        pass
+
+    async def get_message(self, timeout=0):
+        return self.messages.pop(0) if self.messages else None
+
+    async def aclose(self):
+        pass
+
+
+class FakeAsyncEventRedis:
+
+    def __init__(self, stored, live):
+        self.stored = stored
+        self.live = live
+
+    async def lrange(self, key, start, end):
+        return self.stored
+
+    def pubsub(self, **kwargs):
+        return FakeAsyncPubSub({"data": event} for event in self.live)
+
+
+class TestTaskEvents:
+
+    def _event(self, seq, event_type, data):
+        import json
+
+        return json.dumps({"seq": seq, "event": event_type, "data": data})
+
+    async def _collect(self, client, **kwargs):
+        from app.events import iter_task_events
+
+        return [
+            event
+            async for event in iter_task_events(client, "t1", timeout_seconds=1, **kwargs)
+            if event is not None
+        ]
+
+    @pytest.mark.asyncio
+    async def test_replay_then_live_without_duplicates(self):
+        stored = [
+            self._event(1, "status", {"status": "processing"}),
+            self._event(2, "stage", {"stage": "peer", "output": {}}),
+        ]
+        live = [
+            self._event(2, "stage", {"stage": "peer", "output": {}}),
+            self._event(3, "stage", {"stage": "discovery", "output": {}}),
+            self._event(4, "status", {"status": "completed"}),
+            self._event(5, "stage", {"stage": "late", "output": {}}),
+        ]
+
+        events = await self._collect(FakeAsyncEventRedis(stored, live))
+
+        assert [event["seq"] for event in events] == [1, 2, 3, 4]
+
+    @pytest.mark.asyncio
+    async def test_resume_after_last_event_id(self):
+        stored = [
+            self._event(1, "status", {"status": "processing"}),
+            self._event(2, "stage", {"stage": "peer", "output": {}}),
+        ]
+
+        events = await self._collect(
+            FakeAsyncEventRedis(stored, []), after_seq=1, follow=False
+        )
+
+        assert [event["seq"] for event in events] == [2]
+
+    def test_token_buffer_batches_until_flush(self):
+        from app.events import TokenEventBuffer
+
+        class RecordingPublisher:
+            def __init__(self):
+                self.events = []
+
+            def publish(self, task_id, event_type, data):
+                self.events.append((event_type, data))
+
+        publisher = RecordingPublisher()
+        token_buffer = TokenEventBuffer(publisher, "t1", flush_interval=60, max_chars=200)
+
+        for text in ["Satış ", "düşüşü ", "ana ", "risk."]:
+            token_buffer("report", text)
+        assert publisher.events == []
+
+        token_buffer.flush()
+        assert publisher.events == [
+            ("token", {"stage": "report", "text": "Satış düşüşü ana risk."})
+        ]
+
+    def test_sse_format(self):
+        from app.events import format_sse
+
+        frame = format_sse({"seq": 7, "event": "stage", "data": {"stage": "risk"}})
+
+        assert frame == 'id: 7\nevent: stage\ndata: {"stage": "risk"}\n\n'
+
+    @pytest.mark.asyncio
+    async def test_next_status_event_skips_stage_events(self):
+        from app.events import next_status_event
+
+        pubsub = FakeAsyncPubSub(
+            {"data": event}
+            for event in [
+                self._event(3, "stage", {"stage": "structuring", "output": {}}),
+                self._event(4, "status", {"status": "completed"}),
+            ]
+        )
+
+        event = await next_status_event(pubsub, timeout_seconds=1)
+
+        assert event["seq"] == 4
+
+
+class TestStreamingDiscoveryQuestion:
+
+    @pytest.mark.asyncio
+    async def test_question_tokens_are_forwarded(self):
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage
+
+        from app.agents.discovery import DiscoveryAgent
+        from app.models.domain import DiscoverySession
+
+        agent = DiscoveryAgent()
+        agent.llm = GenericFakeChatModel(
+            messages=iter([AIMessage(content="Düşüş hangi ürün grubunda başladı?")])
+        )
+        session = DiscoverySession(initial_problem="Satışlarımız düşüyor")
+        tokens = []
+
+        async def collect(text: str):
+            tokens.append(text)
+
+        question = await agent.start_discovery_async(session, on_token=collect)
+
+        assert len(tokens) > 1
+        assert "".join(tokens).strip() == question
+        assert session.current_question == "Düşüş hangi ürün grubunda başladı?"
+
+    def test_sync_question_stream(self):
+        from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+        from langchain_core.messages import AIMessage
+
+        from app.agents.discovery import DiscoveryAgent
+        from app.models.domain import DiscoverySession
+
+        agent = DiscoveryAgent()
+        agent.llm = GenericFakeChatModel(
+            messages=iter([AIMessage(content="Şikayetler hangi kanaldan geliyor?")])
+        )
+        session = DiscoverySession(initial_problem="Müşteri şikayetleri arttı")
+        tokens = []
+
+        question = agent.start_discovery(session, on_token=tokens.append)
+
+        assert len(tokens) > 1
+        assert "".join(tokens).strip() == question
+
+
+class TestDiscoveryRollingSummary:
+
+    def _agent(self, calls):
+        from app.agents.discovery import DiscoveryAgent
+
+        agent = DiscoveryAgent()
+        agent.verbatim_turns = 2
+        agent.summary_min_chars = 500
+        agent.max_questions = 10
+
+        def fake_invoke(prompt_name, prompt_variables):
+            calls.append((prompt_name, prompt_variables))
+            return "ÖZET" if prompt_name == "discovery_summarize" else "Sonraki soru?"
+
+        agent.invoke_llm = fake_invoke
+        return agent
+
+    def _session(self, answers):
+        from app.models.domain import ConversationTurn, DiscoverySession
+
+        return DiscoverySession(
+            initial_problem="Satışlar düşüyor",
+            current_question=f"Soru {len(answers) + 1}?",
+            conversation_turns=[
+                ConversationTurn(question=f"Soru {i}?", answer=answer, turn_number=i)
+                for i, answer in enumerate(answers, start=1)
+            ],
+        )
+
+    def test_old_long_turns_are_folded_into_summary(self):
+        calls = []
+        agent = self._agent(calls)
+        session = self._session(["a" * 400, "b" * 400, "kısa"])
+
+        agent.continue_discovery(session, "son cevap")
+
+        summarize, question = calls
+        assert summarize[0] == "discovery_summarize"
+        assert "Q1:" in summarize[1]["new_turns"] and "Q3:" not in summarize[1]["new_turns"]
+        assert session.summary == "ÖZET" and session.summarized_turns == 2
+
+        history = question[1]["conversation_history"]
+        assert history.startswith("Summary of Q1-Q2: ÖZET")
+        assert "aaaa" not in history and "A3: kısa" in history and "A4: son cevap" in history
+
+    def test_short_turns_stay_verbatim_without_extra_call(self):
+        calls = []
+        agent = self._agent(calls)
+        session = self._session(["evet", "hayır", "belki"])
+
+        agent.continue_discovery(session, "tamam")
+
+        assert [name for name, _ in calls] == ["discovery_question"]
+        assert session.summarized_turns == 0
+
+    def test_verbatim_answers_are_clipped_to_budget(self):
+        agent = self._agent([])
+        agent.history_budget_chars = 1000
+        session = self._session(["x" * 5000, "y" * 5000])
+
+        history = agent._bounded_conversation_history(session)
+
+        assert len(history) <= 1000
+        assert "[...]" in history
+
+    def test_long_summary_is_clipped_instead_of_exceeding_budget(self):
+        agent = self._agent([])
+        agent.history_budget_chars = 1000
+        session = self._session(["a" * 400, "b" * 400, "x" * 5000, "y" * 5000])
+        session.summary = "ö" * 3000
+        session.summarized_turns = 2
+
+        history = agent._bounded_conversation_history(session)
+
+        assert len(history) <= 1000
+        assert history.startswith("Summary of Q1-Q2: ") and "A4: yyy" in history
+
+    def test_failed_summary_keeps_turns_verbatim(self):
+        calls = []
+        agent = self._agent(calls)
+
+        def failing_invoke(prompt_name, prompt_variables):
+            if prompt_name == "discovery_summarize":
+                raise TimeoutError("summary timed out")
+            calls.append((prompt_name, prompt_variables))
+            return "Sonraki soru?"
+
+        agent.invoke_llm = failing_invoke
+        session = self._session(["a" * 400, "b" * 400, "kısa"])
+
+        question = agent.continue_discovery(session, "son cevap")
+
+        assert question == "Sonraki soru?"
+        assert session.summary == "" and session.summarized_turns == 0
+        history = calls[0][1]["conversation_history"]
+        assert "A1: aaaa" in history and "A4: son cevap" in history
+
+
+class TestResearchMapReduce:
+
+    def _agent(self, calls, min_chars=1000, chunk_chars=600):
+        from app.agents.peer import PeerAgent
+
+        agent = PeerAgent()
+        agent.settings = agent.settings.model_copy(
+            update={"peer_map_reduce_min_chars": min_chars, "peer_chunk_chars": chunk_chars}
+        )
+
+        def fake_invoke(prompt_name, prompt_variables, llm=None):
+            calls.append((prompt_name, prompt_variables, llm))
+            if prompt_name == "peer_summarize_chunk":
+                return f"* notes {prompt_variables['part_number']}"
+            return "final summary"
+
+        async def fake_invoke_async(prompt_name, prompt_variables, llm=None):
+            return fake_invoke(prompt_name, prompt_variables, llm)
+
+        agent.invoke_llm = fake_invoke
+        agent.invoke_llm_async = fake_invoke_async
+        return agent
+
+    def _report(self):
+        from app.models.domain import ResearchResult
+
+        sections = [f"## Section {i}\n" + f"Finding {i} grew 12% [{i}]. " * 20 for i in range(4)]
+        return ResearchResult(content="\n\n".join(sections))
+
+    def test_split_sections_respects_headings_and_limit(self):
+        from app.utils import split_sections
+
+        text = "# A\nshort\n\n# B\n" + "long paragraph. " * 60 + "\n\n# C\nend"
+        chunks = split_sections(text, 400)
+
+        assert all(len(chunk) <= 400 for chunk in chunks)
+        assert chunks[0].startswith("# A") and chunks[-1].endswith("# C\nend")
+        assert "".join(chunks).count("long paragraph.") == 60
+
+    def test_long_report_is_summarized_in_chunks_then_reduced(self):
+        calls = []
+        agent = self._agent(calls)
+
+        response = agent.summarize_research("AI sektöründe trendler neler?", self._report())
+
+        chunk_calls = [call for call in calls if call[0] == "peer_summarize_chunk"]
+        assert len(chunk_calls) == 4
+        assert all(call[2] is agent.chunk_llm for call in chunk_calls)
+        assert calls[-1][0] == "peer_summarize" and calls[-1][2] is None
+        assert "Part 4:\n* notes 4" in calls[-1][1]["research_content"]
+        assert response["message"] == "final summary"
+        assert response["summary_timings"]["mode"] == "map_reduce"
+        assert response["summary_timings"]["chunks"] == 4
+
+    @pytest.mark.asyncio
+    async def test_short_report_keeps_single_call(self):
+        calls = []
+        agent = self._agent(calls, min_chars=100000)
+
+        response = await agent.summarize_research_async("AI trends?", self._report())
+
+        assert [call[0] for call in calls] == ["peer_summarize"]
+        assert response["summary_timings"]["mode"] == "single"
+
+
+class TestStructuredOutput:
+
+    def _agent(self, responses, calls):
+        from app.agents.risk import RiskAgent
+
+        agent = RiskAgent()
+
+        def fake_invoke_model(llm, messages, output_schema=None):
+            calls.append(output_schema)
+            return responses.pop(0)
+
+        agent._invoke_model = fake_invoke_model
+        return agent
+
+    def _inputs(self):
+        from app.models.domain import ActionPlan, ProblemType, StructuredProblemTree
+
+        plan = ActionPlan(
+            short_term=[], mid_term=[], long_term=[],
+            quick_wins=[], risks=["Bütçe aşımı"], success_metrics=[],
+        )
+        tree = StructuredProblemTree(
+            problem_type=ProblemType.COST, main_problem="Maliyet artışı", problem_tree=[]
+        )
+        return plan, tree
+
+    def test_output_schema_excludes_agent_filled_fields(self):
+        from app.llm import llm_output_schema
+        from app.models.domain import DiscoveryOutput
+
+        schema = llm_output_schema(DiscoveryOutput, ("conversation_turns",))
+
+        assert "conversation_turns" not in schema.model_json_schema()["properties"]
+        assert schema.model_json_schema()["properties"]["chat_summary"]["description"]
+        assert llm_output_schema(DiscoveryOutput) is DiscoveryOutput
+        assert llm_output_schema(DiscoveryOutput, ("conversation_turns",)) is schema
+
+    def test_schema_bound_response_is_validated_without_regex(self):
+        from app.models.domain import RiskAnalysis, RiskLevel
+
+        calls = []
+        agent = self._agent(
+            ['{"risks": [], "overall_risk_level": "high", "top_priority_risk": "Bütçe aşımı"}'],
+            calls,
+        )
+        agent.structured_output = True
+
+        analysis = agent.analyze_risks(*self._inputs())
+
+        assert calls == [RiskAnalysis]
+        assert analysis.overall_risk_level is RiskLevel.HIGH
+
+    def test_invalid_response_raises_instead_of_fallback(self):
+        from pydantic import ValidationError
+
+        calls = []
+        truncated = '{"risks": [], "overall_risk_level": "hig'
+        agent = self._agent([truncated, truncated], calls)
+        agent.structured_output = True
+
+        # Kesik JSON yedek modele düşer, o da geçersizse stage hata alır
+        with pytest.raises(ValidationError):
+            agent.analyze_risks(*self._inputs())
+        assert len(calls) == 2
+
+    def test_invalid_stream_falls_back_to_invoke_structured(self):
+        import json
+
+        from app.agents.action import ActionPlanAgent
+
+        agent = ActionPlanAgent()
+        agent.structured_output = True
+        plan = {
+            "short_term": [], "mid_term": [], "long_term": [], "risks": ["r2"],
+            "quick_wins": ["w"], "success_metrics": ["m"],
+        }
+        truncated = '{"short_term": [], "mid_term": [], "long_term": [], "risks": ["r1"], "qu'
+        invoked, streamed_fields = [], []
+
+        def fake_stream(prompt_name, prompt_variables, on_token, output_schema=None):
+            on_token(truncated)
+            return truncated
+
+        def fake_invoke_model(llm, messages, output_schema=None):
+            invoked.append(output_schema)
+            return json.dumps(plan)
+
+        agent.stream_llm = fake_stream
+        agent._invoke_model = fake_invoke_model
+        _, tree = self._inputs()
+
+        result = agent.create_plan(tree, "özet", on_fields=streamed_fields.append)
+
+        assert result.risks == ["r2"] and len(invoked) == 1
+        assert streamed_fields[-1]["risks"] == ["r1"]
+
+
+class TestEarlyStageStart:
+
+    def _on_error(self, state, agent, error):
+        state["error"] = f"{agent} error: {error}"
+        state["is_complete"] = True
+
+    def _executor(self, run_plan, run_risk):
+        from app.agents.executor import Stage, StageExecutor
+
+        return StageExecutor(
+            [
+                Stage(name="plan", output_key="plan", run=run_plan, agent="Plan"),
+                Stage(
+                    name="risk", output_key="risk", run=run_risk, agent="Risk",
+                    depends_on=("plan",), fields={"plan": ("risks",)},
+                ),
+            ],
+            on_error=self._on_error,
+        )
+
+    def test_parser_emits_fields_as_they_close(self):
+        import json
+
+        from app.models.domain import ActionPlan
+        from app.streaming_json import IncrementalJSONParser
+
+        plan = {
+            "short_term": [{"action": 'a "}', "timeline": "1", "owner": "o",
+                            "priority": "high", "expected_outcome": "x"}],
+            "mid_term": [], "long_term": [], "quick_wins": ["w"],
+            "risks": ["r1"], "success_metrics": ["m"],
+        }
+        text = "```json\n" + json.dumps(plan, ensure_ascii=False, indent=2) + "\n```"
+        parser = IncrementalJSONParser(ActionPlan)
+
+        batches = [list(parser.feed(text[i:i + 5])) for i in range(0, len(text), 5)]
+        emitted = [name for batch in batches for name in batch]
+        closed_at = {name: index for index, batch in enumerate(batches) for name in batch}
+
+        assert emitted == list(plan)
+        assert closed_at["quick_wins"] < closed_at["risks"] < len(batches) - 1
+        assert parser.fields == plan and parser.closed
+
+    def test_dependent_stage_starts_before_dependency_finishes(self):
+        import threading
+
+        from app.agents.executor import partial_output_listener
+
+        risk_started = threading.Event()
+        events = []
+
+        def run_plan(state):
+            partial_output_listener()({"risks": ["r1"]})
+            assert risk_started.wait(timeout=2)
+            events.append("plan_done")
+            return {"risks": ["r1"], "quick_wins": ["w"]}
+
+        def run_risk(state):
+            risk_started.set()
+            events.append("risk_started")
+            return {"top": state["plan"]["risks"][0], "seen": sorted(state["plan"])}
+
+        state = self._executor(run_plan, run_risk).execute({"agent_flow": [], "error": None})
+
+        assert events == ["risk_started", "plan_done"]
+        assert state["risk"] == {"top": "r1", "seen": ["risks"]}
+        assert state["agent_flow"] == ["plan", "risk"]
+
+    @pytest.mark.asyncio
+    async def test_early_output_is_dropped_when_dependency_fails(self):
+        import asyncio
+        import time
+
+        from app.agents.executor import partial_output_listener
+
+        def run_plan(state):
+            partial_output_listener()({"risks": ["r1"]})
+            time.sleep(0.1)
+            raise RuntimeError("truncated")
+
+        def run_risk(state):
+            return {"top": state["plan"]["risks"][0]}
+
+        executor = self._executor(run_plan, run_risk)
+        state = await asyncio.wait_for(
+            executor.execute_async({"agent_flow": [], "error": None}), timeout=2
+        )
+
+        assert state["error"] == "Plan error: truncated"
+        assert "risk" not in state and state["agent_flow"] == []
+
+    def test_risk_overlaps_the_streamed_plan_tail(self):
+        import json
+        import time
+
+        from app.agents.action import ActionPlanAgent
+        from app.agents.executor import Stage, StageExecutor, partial_output_listener
+        from app.models.domain import ProblemType, StructuredProblemTree
+
+        item = {"action": "a", "timeline": "1", "owner": "o", "priority": "high",
+                "expected_outcome": "x"}
+        plan = {
+            "short_term": [item] * 4, "mid_term": [item] * 4, "long_term": [item] * 4,
+            "quick_wins": ["w"] * 4, "risks": ["r1"], "success_metrics": ["m" * 40] * 8,
+        }
+        text = json.dumps(plan)
+        agent = ActionPlanAgent()
+        agent.structured_output = True
+
+        def fake_stream(prompt_name, prompt_variables, on_token, output_schema=None):
+            # Sabit hızda token: stream süresi metin uzunluğuyla orantılı
+            for i in range(0, len(text), 20):
+                on_token(text[i:i + 20])
+                time.sleep(0.005)
+            return text
+
+        agent.stream_llm = fake_stream
+        tree = StructuredProblemTree(
+            problem_type=ProblemType.COST, main_problem="Maliyet artışı", problem_tree=[]
+        )
+        timeline = {}
+
+        def run_plan(state):
+            timeline["plan_started"] = time.monotonic()
+            result = agent.create_plan(tree, "özet", on_fields=partial_output_listener())
+            timeline["plan_done"] = time.monotonic()
+            return result.model_dump()
+
+        def run_risk(state):
+            timeline["risk_started"] = time.monotonic()
+            return {"top": state["plan"]["risks"][0]}
+
+        executor = StageExecutor(
+            [
+                Stage(name="plan", output_key="plan", run=run_plan, agent="Plan"),
+                Stage(
+                    name="risk", output_key="risk", run=run_risk, agent="Risk",
+                    depends_on=("plan",),
+                    fields={"plan": ("risks", "short_term", "mid_term", "long_term")},
+                ),
+            ],
+            on_error=self._on_error,
+        )
+        state = executor.execute({"agent_flow": [], "error": None})
+
+        plan_seconds = timeline["plan_done"] - timeline["plan_started"]
+        overlap = timeline["plan_done"] - timeline["risk_started"]
+        tail_share = len(text[text.index('"success_metrics"'):]) / len(text)
+        assert state["risk"] == {"top": "r1"}
+        # Risk, plan'ın sadece risks'ten sonraki kuyruğuyla çakışıyor
+        assert 0 < overlap / plan_seconds < tail_share + 0.15
+
+    def test_early_output_is_recomputed_when_dependency_changes(self):
+        import threading
+
+        from app.agents.executor import partial_output_listener
+
+        risk_started = threading.Event()
+        risk_inputs = []
+
+        def run_plan(state):
+            # Stream "r1" verdi, fallback son planı "r2" ile üretti
+            partial_output_listener()({"risks": ["r1"]})
+            assert risk_started.wait(timeout=2)
+            return {"risks": ["r2"]}
+
+        def run_risk(state):
+            risk_inputs.append(state["plan"]["risks"][0])
+            risk_started.set()
+            return {"top": state["plan"]["risks"][0]}
+
+        state = self._executor(run_plan, run_risk).execute({"agent_flow": [], "error": None})
+
+        assert risk_inputs == ["r1", "r2"]
+        assert state["risk"] == {"top": "r2"} and state["agent_flow"] == ["plan", "risk"]
+
+
+class TestSubscriberLimit:
+
+    def _client(self, monkeypatch, cache):
+        from fastapi.testclient import TestClient
+
+        from app import main
+
+        monkeypatch.setattr(main.limiter, "enabled", False)
+        monkeypatch.setattr(main, "get_async_redis_cache", lambda: cache)
+        return TestClient(main.app)
+
+    def test_subscriber_slots_are_capped_and_released(self):
+        from app.cache import AsyncRedisCache
+
+        cache = AsyncRedisCache("redis://localhost:6379/0", max_subscribers=2)
+        cache._subscriber_client = object()
+
+        assert cache.acquire_subscriber() is cache.acquire_subscriber() is not None
+        assert cache.acquire_subscriber() is None
+
+        cache.release_subscriber()
+        assert cache.acquire_subscriber() is not None
+
+    def test_event_stream_is_rejected_when_subscribers_are_full(self, monkeypatch):
+        from types import SimpleNamespace
+
+        full_cache = SimpleNamespace(client=object(), acquire_subscriber=lambda: None)
+
+        response = self._client(monkeypatch, full_cache).get("/v1/tasks/t1/events")
+
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+    def test_long_poll_answers_immediately_when_subscribers_are_full(self, monkeypatch):
+        import time
+        from types import SimpleNamespace
+
+        from app import main
+        from app.models.api import TaskStatusResponse
+
+        async def load_status(task_id):
+            return TaskStatusResponse(task_id=task_id, status="processing")
+
+        monkeypatch.setattr(main, "_load_task_status", load_status)
+        full_cache = SimpleNamespace(client=object(), acquire_subscriber=lambda: None)
+
+        started_at = time.monotonic()
+        response = self._client(monkeypatch, full_cache).get("/v1/tasks/t1?wait=20")
+
+        assert response.status_code == 200 and response.json()["status"] == "processing"
+        assert time.monotonic() - started_at < 5
+
+
+class TestDiscoverySocketHandoff:
+
+    def test_peer_skips_classification_when_intent_is_given(self):
+        from app.agents.peer import PeerAgent
+        from app.models.domain import IntentType
+
+        agent = PeerAgent()
+        calls = []
+
+        def fake_invoke(prompt_name, prompt_variables, llm=None):
+            calls.append(prompt_name)
+            return "Sadece iş konularında yardımcı olabilirim."
+
+        agent.invoke_llm = fake_invoke
+        agent._classify_locally = lambda user_message: None
+
+        result = agent.process("Bugün hava nasıl?", intent=IntentType.NON_BUSINESS)
+
+        assert result["intent"] == "non_business"
+        assert "peer_classify" not in calls
+
+    def test_socket_messages_are_rate_limited_at_execute_rate(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from limits import storage, strategies
+
+        from app import main
+
+        monkeypatch.setattr(main.limiter, "enabled", True)
+        monkeypatch.setattr(
+            main.limiter, "_limiter", strategies.MovingWindowRateLimiter(storage.MemoryStorage())
+        )
+        monkeypatch.setattr(
+            main, "settings", main.settings.model_copy(update={"rate_limit_execute": "1/minute"})
+        )
+        monkeypatch.setattr(main, "get_async_redis_cache", lambda: None)
+        monkeypatch.setattr(main, "get_advisor_workflow", lambda: None)
+        client = TestClient(main.app)
+
+        with client.websocket_connect("/v1/discovery/ws") as socket:
+            socket.send_json({"task": ""})
+            assert socket.receive_json()["message"] == "Task cannot be empty"
+
+        with client.websocket_connect("/v1/discovery/ws") as socket:
+            socket.send_json({"task": ""})
+            assert socket.receive_json()["message"].startswith("Rate limit exceeded")
+
+    def _async_mode_client(self, monkeypatch, workflow):
+        from types import SimpleNamespace
+
+        from fastapi.testclient import TestClient
+
+        from app import main
+
+        queued = []
+
+        async def rpush(queue, raw_job):
+            queued.append((queue, raw_job))
+
+        async def save_session(session_id, state, ttl_seconds=3600):
+            queued.append(("session", state))
+
+        cache = SimpleNamespace(client=SimpleNamespace(rpush=rpush), save_session=save_session)
+
+        async def no_backpressure():
+            return None
+
+        def celery_not_used(*args, **kwargs):
+            raise AssertionError("async modda Celery'ye gitmemeli")
+
+        monkeypatch.setattr(main.limiter, "enabled", False)
+        monkeypatch.setattr(
+            main, "settings", main.settings.model_copy(update={"worker_mode": "async"})
+        )
+        monkeypatch.setattr(main, "get_async_redis_cache", lambda: cache)
+        monkeypatch.setattr(main, "get_advisor_workflow", lambda: workflow)
+        monkeypatch.setattr(main, "_admission_retry_after", no_backpressure)
+        monkeypatch.setattr(main.process_pipeline_task, "apply_async", celery_not_used)
+        monkeypatch.setattr(main.process_agent_task, "apply_async", celery_not_used)
+        return TestClient(main.app), queued
+
+    def test_socket_enqueues_async_jobs_in_async_worker_mode(self, monkeypatch):
+        import json
+        from types import SimpleNamespace
+
+        from app import main
+        from app.agents.workflow import create_initial_state
+
+        async def start_session_async(session_id, task, on_token=None):
+            return {
+                **create_initial_state(session_id, task),
+                "intent": "business_problem",
+                "discovery_output": {"summary": "özet"},
+            }
+
+        async def classify_only(session_id, task, on_token=None):
+            return {
+                **create_initial_state(session_id, task),
+                "intent": "non_business",
+                "intent_source": "local",
+            }
+
+        client, queued = self._async_mode_client(
+            monkeypatch, SimpleNamespace(start_session_async=start_session_async)
+        )
+        with client.websocket_connect("/v1/discovery/ws") as socket:
+            socket.send_json({"task": "Satışlarımız düşüyor"})
+            complete = socket.receive_json()
+
+        client, peer_queued = self._async_mode_client(
+            monkeypatch, SimpleNamespace(start_session_async=classify_only)
+        )
+        with client.websocket_connect("/v1/discovery/ws") as socket:
+            socket.send_json({"task": "Bugün hava nasıl?"})
+            peer = socket.receive_json()
+
+        [(_, saved), (queue, raw_job)] = queued
+        job = json.loads(raw_job)
+        assert complete["type"] == "discovery_complete"
+        assert saved["awaiting_user_input"] is False
+        assert queue == main.settings.async_worker_queue and job["lane"] == "bulk"
+        assert job["task_id"] == complete["task_id"]
+        assert job["existing_state"]["discovery_output"] == {"summary": "özet"}
+
+        [(queue, raw_job)] = peer_queued
+        job = json.loads(raw_job)
+        assert peer["type"] == "task_queued" and job["task_id"] == peer["task_id"]
+        assert queue == main.settings.async_worker_fast_queue
+        assert (job["intent"], job["intent_source"]) == ("non_business", "local")
+
+
+class FakeAsyncListRedis:
+
+    def __init__(self, lists=None):
+        self.lists = {key: list(items) for key, items in (lists or {}).items()}
+        self.published = []
+        self.counter = 0
+
+    async def lmove(self, source, destination, src="LEFT", dest="RIGHT"):
+        if not self.lists.get(source):
+            return None
+        item = self.lists[source].pop(0)
+        self.lists.setdefault(destination, []).append(item)
+        return item
+
+    async def blmove(self, source, destination, timeout, src="LEFT", dest="RIGHT"):
+        return await self.lmove(source, destination)
+
+    async def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    async def lrem(self, key, count, value):
+        self.lists[key].remove(value)
+
+    async def incr(self, key):
+        self.counter += 1
+        return self.counter
+
+    def pipeline(self, transaction=True):
+        return FakeAsyncPipeline(self)
+
+
+class FakeAsyncPipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    async def execute(self):
+        import json
+
+        for name, args in self.commands:
+            if name == "lpush":
+                self.redis.lists.setdefault(args[0], []).insert(0, args[1])
+            elif name == "delete":
+                self.redis.lists.pop(args[0], None)
+            elif name == "publish":
+                self.redis.published.append(json.loads(args[1]))
+
+
+class TestAsyncWorkerQueue:
+
+    def _worker(self, redis, max_sessions=4):
+        from types import SimpleNamespace
+
+        from app.async_worker import AsyncWorker
+
+        return AsyncWorker(
+            workflow=None,
+            cache=SimpleNamespace(client=redis),
+            queue="bulk",
+            fast_queue="fast",
+            max_sessions=max_sessions,
+            fast_reserved_sessions=1,
+            worker_id="w1",
+        )
+
+    @pytest.mark.asyncio
+    async def test_unfinished_jobs_are_requeued_in_their_lane(self):
+        import json
+
+        jobs = [json.dumps({"task_id": "a", "lane": "bulk"}), json.dumps({"task_id": "b"})]
+        redis = FakeAsyncListRedis(
+            {"bulk:processing:w1": jobs, "bulk": [json.dumps({"task_id": "c", "lane": "bulk"})]}
+        )
+
+        await self._worker(redis)._requeue_unfinished()
+
+        assert [json.loads(job)["task_id"] for job in redis.lists["bulk"]] == ["a", "c"]
+        assert [json.loads(job)["task_id"] for job in redis.lists["fast"]] == ["b"]
+        assert "bulk:processing:w1" not in redis.lists
+
+    @pytest.mark.asyncio
+    async def test_job_stays_in_processing_list_until_result_is_stored(self, monkeypatch):
+        import json
+
+        raw_job = json.dumps({"task_id": "t1", "session_id": "s1", "task": "x", "lane": "fast"})
+        redis = FakeAsyncListRedis({"fast": [raw_job]})
+        worker = self._worker(redis)
+        seen_in_processing = []
+
+        async def fake_process(
+            task_id, session_id, task, existing_state=None, intent=None, intent_source=None
+        ):
+            seen_in_processing.append(list(redis.lists["bulk:processing:w1"]))
+            return {"success": True}
+
+        monkeypatch.setattr(worker, "process", fake_process)
+        monkeypatch.setattr(worker, "_store_result", lambda task_id, result: None)
+
+        taken = await worker._take_job()
+        await worker._slots.acquire()
+        await worker._run_job(json.loads(taken), taken)
+
+        assert seen_in_processing == [[raw_job]]
+        assert redis.lists["bulk:processing:w1"] == [] and redis.lists["fast"] == []
+
+    @pytest.mark.asyncio
+    async def test_async_publisher_keeps_event_order(self):
+        from types import SimpleNamespace
+
+        from app.events import AsyncTaskEventPublisher, TokenEventBuffer
+
+        redis = FakeAsyncListRedis()
+        publisher = AsyncTaskEventPublisher(SimpleNamespace(client=redis))
+        tokens = TokenEventBuffer(publisher, "t1", flush_interval=60)
+
+        tokens("report", "Özet ")
+        tokens("report", "metni")
+        tokens.flush()
+        publisher.publish("t1", "stage", {"stage": "report"})
+        await publisher.aclose()
+
+        assert [(event["seq"], event["event"]) for event in redis.published] == [
+            (1, "token"),
+            (2, "stage"),
+        ]
+        assert redis.published[0]["data"]["text"] == "Özet metni"
+
+
+class FakeResumeCache:
+
+    def __init__(self, sessions, locked=()):
+        self.sessions = dict(sessions)
+        self.locks = set(locked)
+
+    async def claim_session_resume(self, session_id, ttl_seconds=30):
+        if session_id in self.locks:
+            return False
+        self.locks.add(session_id)
+        return True
+
+    async def release_session_resume(self, session_id):
+        self.locks.discard(session_id)
+
+    async def get_session(self, session_id):
+        return self.sessions.get(session_id)
+
+    async def save_session(self, session_id, state, ttl_seconds=3600):
+        self.sessions[session_id] = state
+
+
+class TestSessionResume:
+
+    FAILED_DISCOVERY = {
+        "user_input": "Cevap 2",
+        "error": "DiscoveryAgent error: timeout",
+        "discovery_session": {"initial_problem": "Satışlar düşüyor"},
+        "discovery_output": None,
+        "awaiting_user_input": True,
+        "is_complete": True,
+    }
+    FAILED_PIPELINE = {
+        **FAILED_DISCOVERY,
+        "error": "RiskAgent error: boom",
+        "discovery_output": {"customer_stated_problem": "x"},
+        "awaiting_user_input": False,
+    }
+
+    def _client(self, monkeypatch, cache):
+        from types import SimpleNamespace
+
+        from fastapi.testclient import TestClient
+
+        from app import main
+
+        dispatched = []
+
+        def recorder(name):
+            def apply_async(kwargs, queue):
+                dispatched.append((name, kwargs))
+                return SimpleNamespace(id=f"{name}-task")
+
+            return SimpleNamespace(apply_async=apply_async)
+
+        monkeypatch.setattr(main.limiter, "enabled", False)
+        monkeypatch.setattr(main, "get_async_redis_cache", lambda: cache)
+        monkeypatch.setattr(main, "process_agent_task", recorder("agent"))
+        monkeypatch.setattr(main, "process_pipeline_task", recorder("pipeline"))
+        return TestClient(main.app), dispatched
+
+    def test_missing_session_returns_404(self, monkeypatch):
+        cache = FakeResumeCache({})
+        client, dispatched = self._client(monkeypatch, cache)
+
+        assert client.post("/v1/sessions/s1/resume").status_code == 404
+        assert dispatched == [] and cache.locks == set()
+
+    def test_resume_in_progress_returns_409(self, monkeypatch):
+        client, dispatched = self._client(
+            monkeypatch, FakeResumeCache({"s1": self.FAILED_PIPELINE}, locked={"s1"})
+        )
+
+        response = client.post("/v1/sessions/s1/resume")
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Session resume already in progress"
+        assert dispatched == []
+
+    def test_second_resume_sees_cleared_state(self, monkeypatch):
+        cache = FakeResumeCache({"s1": self.FAILED_PIPELINE})
+        client, dispatched = self._client(monkeypatch, cache)
+
+        assert client.post("/v1/sessions/s1/resume").status_code == 200
+        second = client.post("/v1/sessions/s1/resume")
+
+        assert second.status_code == 409 and second.json()["detail"] == "Session has not failed"
+        assert len(dispatched) == 1
+        assert cache.sessions["s1"]["error"] is None
+
+    def test_failed_discovery_turn_goes_to_agent_task(self, monkeypatch):
+        client, dispatched = self._client(
+            monkeypatch, FakeResumeCache({"s1": self.FAILED_DISCOVERY})
+        )
+
+        response = client.post("/v1/sessions/s1/resume")
+
+        assert response.json()["task_id"] == "agent-task"
+        name, kwargs = dispatched[0]
+        assert kwargs["task"] == "Cevap 2" and kwargs["existing_state"]["awaiting_user_input"]
+
+    def test_failed_pipeline_goes_to_pipeline_task(self, monkeypatch):
+        client, dispatched = self._client(
+            monkeypatch, FakeResumeCache({"s1": self.FAILED_PIPELINE})
+        )
+
+        response = client.post("/v1/sessions/s1/resume")
+
+        assert response.json()["task_id"] == "pipeline-task"
+        name, kwargs = dispatched[0]
+        assert kwargs["state"]["error"] is None and not kwargs["state"]["is_complete"]